@@ -8,10 +8,13 @@ Licensed under GPLv3, see LICENSE.md
 """
 
 import os
+import time
 
 from arkos import configs
-from arkos.utilities import test_dns
+from arkos.utilities import errors, test_dns
 from arkos.utilities.logs import LoggingControl
+from arkos.utilities.snapshot import Snapshot
+from arkos.utilities.ldapcache import LDAPCache
 from arkos.connections import ConnectionsManager
 from arkos.utilities import detect_architecture
 
@@ -31,6 +34,8 @@ class StorageControl:
         """Initialize arkOS storage."""
         for x in self.TYPES:
             setattr(self, x, {})
+        self.snapshot = Snapshot()
+        self.ldap_cache = LDAPCache()
 
 
 def init(
@@ -62,6 +67,7 @@ def init(
     )
     secrets.load(secrets_path, default={})
     policies.load(policies_path, default={})
+    storage.snapshot.load(config.get("general", "snapshot_path"), version)
 
     if log:
         logger.logger = log
@@ -79,21 +85,123 @@ def init(
         logger.warning("Init", "DNS resolution failed. Please make sure your "
                        "server network connection is properly configured.")
     conns.connect()
+    storage.ldap_cache.configure(
+        config.get("general", "ldap_cache", False),
+        config.get("general", "ldap_cache_ttl", 5))
+    if storage.ldap_cache.enabled \
+            and config.get("general", "ldap_syncrepl", False):
+        storage.ldap_cache.start_sync(
+            config.get("general", "ldap_uri"),
+            "cn=admin,{0}".format(config.get("general", "ldap_rootdn")),
+            secrets.get("ldap"), config.get("general", "ldap_rootdn"))
     return config
 
 
-def initial_scans():
-    """Setup initial scans for all arkOS objects."""
+def initial_scans(serial=None, workers=4):
+    """
+    Setup initial scans for all arkOS objects.
+
+    Scans are run as a dependency graph: each stage starts as soon as the
+    stages it depends on have finished, and independent stages run at the
+    same time on a thread pool. If ``serial`` is not specified, the
+    ``general.serial_scans`` config value is used.
+
+    :param bool serial: Run one stage at a time, in order (for debugging)
+    :param int workers: Maximum number of stages to run at once
+    """
     from arkos import applications, backup, certificates, databases, websites
     from arkos import tracked_services
-    applications.scan(cry=False)
-    backup.get()
-    certificates.scan()
-    databases.scan()
-    websites.scan()
-    tracked_services.initialize()
+    if serial is None:
+        serial = config.get("general", "serial_scans", False)
+    stages = [
+        ("applications", lambda: applications.scan(cry=False), []),
+        ("backups", backup.get, []),
+        ("certificates", certificates.scan, ["applications"]),
+        ("databases", databases.scan, ["applications"]),
+        ("websites", websites.scan,
+         ["applications", "certificates", "databases"]),
+        ("policies", tracked_services.initialize, ["websites"])
+    ]
     if config.get("general", "enable_upnp"):
-        tracked_services.initialize_upnp(tracked_services.get())
+        stages.append((
+            "upnp",
+            lambda: tracked_services.initialize_upnp(tracked_services.get()),
+            ["policies"]
+        ))
+    with tracked_services.batch() as scan_batch:
+        # Stages run on worker threads, which join the scan's batch
+        def _in_batch(func):
+            def _run():
+                with tracked_services.batch(join=scan_batch):
+                    func()
+            return _run
+        stages = [(x[0], _in_batch(x[1]), x[2]) for x in stages]
+        run_stages(stages, serial=serial, workers=workers)
+    try:
+        storage.snapshot.save()
+    except (IOError, OSError) as e:
+        logger.warning("Init", "Could not save scan snapshot: {0}".format(e))
+
+
+def run_stages(stages, serial=False, workers=4):
+    """
+    Run a set of interdependent startup stages.
+
+    ``stages`` is an ordered list of ``(name, func, depends)`` tuples, where
+    ``depends`` lists the names of stages that must finish first. The time
+    taken by each stage is logged. If a stage raises, no further stages are
+    started and the exception is re-raised once running stages complete.
+
+    :param list stages: Stage tuples to run
+    :param bool serial: Run one stage at a time, in list order
+    :param int workers: Maximum number of stages to run at once
+    """
+    from concurrent import futures
+    names = [x[0] for x in stages]
+    for name, func, depends in stages:
+        for dep in depends:
+            if dep not in names:
+                raise errors.InvalidConfigError(
+                    "Stage {0} depends on unknown stage {1}".format(name, dep))
+
+    def _timed(name, func):
+        start = time.time()
+        func()
+        logger.debug("Init", "Stage {0} finished in {1:.2f}s".format(
+            name, time.time() - start))
+
+    start = time.time()
+    if serial:
+        for name, func, depends in stages:
+            _timed(name, func)
+    else:
+        pending, done, running = list(stages), set(), {}
+        error = None
+        with futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            while pending or running:
+                for stage in [x for x in pending if not error]:
+                    if all(dep in done for dep in stage[2]):
+                        pending.remove(stage)
+                        fut = pool.submit(_timed, stage[0], stage[1])
+                        running[fut] = stage[0]
+                if not running:
+                    break
+                finished, _ = futures.wait(
+                    running, return_when=futures.FIRST_COMPLETED)
+                for fut in finished:
+                    name = running.pop(fut)
+                    if fut.exception() and not error:
+                        error = fut.exception()
+                    elif not fut.exception():
+                        done.add(name)
+        if error:
+            raise error
+        if pending:
+            raise errors.InvalidConfigError(
+                "Circular stage dependencies: {0}".format(
+                    ", ".join(x[0] for x in pending)))
+    logger.debug("Init", "Initial scans finished in {0:.2f}s".format(
+        time.time() - start))
 
 
 config = configs.Config("settings.json")
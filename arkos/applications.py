@@ -11,7 +11,6 @@ import imp
 import inspect
 import json
 import os
-import pacman
 import shutil
 import tarfile
 
@@ -19,7 +18,9 @@ from arkos import config, logger, storage, signals, tracked_services
 from arkos.messages import Notification, NotificationThread
 from arkos.system import services
 from arkos.languages import python, ruby
-from arkos.utilities import api, compare_versions, errors
+from arkos.utilities import api, compare_versions, errors, lazy_import
+
+pacman = lazy_import("pacman")
 
 
 class App:
@@ -47,12 +48,13 @@ class App:
         """
         return getattr(self, "_{0}".format(mod_type), None)
 
-    def load(self, verify=True, cry=True, installed={}):
+    def load(self, verify=True, cry=True, installed=None):
         """
         Load an application and associated metadata into the running process.
 
         :param bool verify: Verify System/Python/OS dependencies
         :param bool cry: Raise exception on dependency install failure?
+        :param dict installed: Inventories from ``get_installed_packages``
         """
         try:
             signals.emit("apps", "pre_load", self)
@@ -116,7 +118,7 @@ class App:
                 )
             ).send()
 
-    def verify_dependencies(self, cry, installed):
+    def verify_dependencies(self, cry, installed=None):
         """
         Verify that the associated dependencies are all properly installed.
 
@@ -124,25 +126,18 @@ class App:
         installed status. Sets ``self.loadable`` with verify status and
         ``self.error`` with error message encountered on check.
 
+        :param bool cry: Raise exception on dependency install failure?
+        :param dict installed: Inventories from ``get_installed_packages``
         :returns: True if all verify checks passed
         :rtype: bool
         """
         verify, error = True, ""
         # If dependency isn't installed, add it to "to install" list
         # If it can't be installed, mark the app as not loadable and say why
-        if not installed:
-            pacman.refresh()
-            installed["sys"] = pacman.get_installed()
-            installed["py"] = python.get_installed()
-            installed["py2"] = python.get_installed(py2=True)
-            installed["rb"] = ruby.get_installed()
+        installed = installed or get_installed_packages()
         for dep in self.dependencies:
             if dep["type"] == "system":
-                pack = next(
-                    filter(lambda x: x["id"] == dep["package"],
-                           installed["sys"]),
-                    None
-                )
+                pack = installed["sys"].get(dep["package"].lower())
                 invalid_ver = False
                 if pack and dep.get("version"):
                     invalid_ver = compare_versions(
@@ -154,7 +149,8 @@ class App:
                         .format(dep["package"]))
                     try:
                         pacman.install(dep["package"])
-                    except:
+                    except Exception:
+                        # python-pacman raises plain Exceptions
                         error = "Couldn't install {0}".format(dep["package"])
                         verify = False
                         if cry:
@@ -164,11 +160,7 @@ class App:
                         verify = False
             if dep["type"] == "python":
                 ilist = installed["py2"] if dep.get("py2") else installed["py"]
-                pack = next(
-                    filter(lambda x: x["id"].lower() == dep["package"].lower(),
-                           ilist),
-                    None
-                )
+                pack = ilist.get(dep["package"].lower())
                 invalid_ver = False
                 if pack and dep.get("version"):
                     invalid_ver = compare_versions(
@@ -184,7 +176,7 @@ class App:
                             version=dep.get("version"),
                             py2=True if dep.get("py2") else False
                         )
-                    except:
+                    except errors.OperationFailedError:
                         error = "Couldn't install {0}".format(dep["package"])
                         verify = False
                         if cry:
@@ -193,11 +185,7 @@ class App:
                         error = "Reload required"
                         verify = False
             if dep["type"] == "ruby":
-                pack = next(
-                    filter(lambda x: x["id"] == dep["package"],
-                           installed["rb"]),
-                    None
-                )
+                pack = installed["rb"].get(dep["package"].lower())
                 invalid_ver = False
                 if pack and dep.get("version"):
                     invalid_ver = compare_versions(
@@ -212,7 +200,7 @@ class App:
                             dep["package"],
                             version=dep.get("version")
                         )
-                    except:
+                    except (errors.OperationFailedError, OSError):
                         error = "Couldn't install {0}".format(dep["package"])
                         verify = False
                         if cry:
@@ -294,16 +282,24 @@ class App:
                     exclude.append(item["package"])
 
         # Stop any running services associated with this app
-        for item in self.dependencies:
-            if item["type"] == "system" and not item["package"] in exclude:
-                if item.get("daemon"):
-                    try:
-                        services.get(item["daemon"]).stop()
-                        services.get(item["daemon"]).disable()
-                    except:
-                        pass
-                pacman.remove([item["package"]],
-                              purge=config.get("apps", "purge"))
+        deps = [x for x in self.dependencies
+                if x["type"] == "system" and not x["package"] in exclude]
+        daemons = [x["daemon"] for x in deps if x.get("daemon")]
+        if daemons:
+            try:
+                services.bulk("stop", daemons)
+            except services.ActionError:
+                pass
+        for x in daemons:
+            try:
+                svc = services.get(x)
+                if svc:
+                    svc.disable()
+            except services.ActionError:
+                pass
+        for item in deps:
+            pacman.remove([item["package"]],
+                          purge=config.get("apps", "purge"))
 
         # Remove the app's directory and cleanup the app object
         shutil.rmtree(os.path.join(config.get("apps", "app_dir"), self.id))
@@ -451,14 +447,8 @@ def scan(verify=True, cry=True):
     if not os.path.exists(app_dir):
         os.makedirs(app_dir)
 
-    pacman.refresh()
     logger.debug("Apps", "Getting system/python/ruby installed list")
-    inst_list = {
-        "sys": pacman.get_installed(),
-        "py": python.get_installed(),
-        "py2": python.get_installed(py2=True),
-        "rb": ruby.get_installed()
-    }
+    inst_list = get_installed_packages()
 
     # Get paths for installed apps, metadata for available ones
     installed_apps = [x for x in os.listdir(app_dir) if not x.startswith(".")]
@@ -477,30 +467,32 @@ def scan(verify=True, cry=True):
         available_apps = []
 
     # Create objects for installed apps with appropriate metadata
-    for x in installed_apps:
-        try:
-            with open(os.path.join(app_dir, x, "manifest.json"), "r") as f:
-                data = json.loads(f.read())
-        except ValueError:
-            warn_str = "Failed to load {0} due to a JSON parsing error"
-            logger.warning("Apps", warn_str.format(x))
-            continue
-        except IOError:
-            warn_str = "Failed to load {0}: manifest file inaccessible "\
-                       "or not present"
-            logger.warning("Apps", warn_str.format(x))
-            continue
-        logger.debug("Apps", " *** Loading {0}".format(data["id"]))
-        app = App(**data)
-        app.installed = True
-        for y in enumerate(available_apps):
-            if app.id == y[1]["id"] and app.version != y[1]["version"]:
-                app.upgradable = y[1]["version"]
-            if app.id == y[1]["id"]:
-                app.assets = y[1]["assets"]
-                available_apps[y[0]]["installed"] = True
-        app.load(verify=verify, cry=cry, installed=inst_list)
-        storage.applications[app.id] = app
+    with tracked_services.batch():
+        for x in installed_apps:
+            try:
+                mpath = os.path.join(app_dir, x, "manifest.json")
+                with open(mpath, "r") as f:
+                    data = json.loads(f.read())
+            except ValueError:
+                warn_str = "Failed to load {0} due to a JSON parsing error"
+                logger.warning("Apps", warn_str.format(x))
+                continue
+            except IOError:
+                warn_str = "Failed to load {0}: manifest file inaccessible "\
+                           "or not present"
+                logger.warning("Apps", warn_str.format(x))
+                continue
+            logger.debug("Apps", " *** Loading {0}".format(data["id"]))
+            app = App(**data)
+            app.installed = True
+            for y in enumerate(available_apps):
+                if app.id == y[1]["id"] and app.version != y[1]["version"]:
+                    app.upgradable = y[1]["version"]
+                if app.id == y[1]["id"]:
+                    app.assets = y[1]["assets"]
+                    available_apps[y[0]]["installed"] = True
+            app.load(verify=verify, cry=cry, installed=inst_list)
+            storage.applications[app.id] = app
 
     # Convert available apps payload to objects
     for x in available_apps:
@@ -515,6 +507,28 @@ def scan(verify=True, cry=True):
     return storage.applications
 
 
+def get_installed_packages():
+    """
+    Get inventories of installed system, Python and Ruby packages.
+
+    Each inventory maps lowercased package names to their package dicts,
+    so dependencies can be looked up without scanning the full lists.
+    Build them once and pass them to each app that is verified.
+
+    :returns: dict of inventories (``sys``, ``py``, ``py2`` and ``rb``)
+    :rtype: dict
+    """
+    pacman.refresh()
+    inventories = {
+        "sys": pacman.get_installed(),
+        "py": python.get_installed(),
+        "py2": python.get_installed(py2=True),
+        "rb": ruby.get_installed()
+    }
+    return {x: {y["id"].lower(): y for y in z}
+            for x, z in inventories.items()}
+
+
 def verify_app_dependencies():
     """
     Verify that any dependent arkOS apps are properly installed/verified.
@@ -619,18 +633,22 @@ def _install(id, load=True, cry=True):
         setattr(app, x, data[x])
     app.upgradable = ""
     app.installed = True
+    svcs = []
     for x in app.services:
         if x.get("type") == "system" and x.get("binary") \
                 and not x.get("ignore_on_install"):
             s = services.get(x["binary"])
             if s:
+                if x.get("limits"):
+                    s.set_limits(x["limits"])
                 s.enable()
                 if s.state != "running":
-                    try:
-                        s.start()
-                    except services.ActionError as e:
-                        logger.warning(
-                            "Apps", "{0} could not be automatically started."
-                            .format(s.name))
+                    svcs.append(s)
+    if svcs:
+        for name, err in services.bulk("start", svcs).items():
+            if err:
+                logger.warning(
+                    "Apps", "{0} could not be automatically started."
+                    .format(name))
     if load:
         app.load(cry=cry)
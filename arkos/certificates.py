@@ -8,13 +8,7 @@ Licensed under GPLv3, see LICENSE.md
 """
 
 import binascii
-from cryptography import x509
-from cryptography.x509.oid import NameOID
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import serialization, hashes
-from cryptography.hazmat.primitives.asymmetric import dsa, rsa, ec
 import datetime
-from free_tls_certificates import client as leclient
 import glob
 import os
 import time
@@ -22,7 +16,18 @@ import time
 from arkos import config, signals, storage, websites, applications, logger
 from arkos.messages import Notification, NotificationThread
 from arkos.system import users, groups
-from arkos.utilities import errors, shell
+from arkos.utilities import errors, shell, lazy_import
+
+x509 = lazy_import("cryptography.x509")
+NameOID = lazy_import("cryptography.x509.oid", "NameOID")
+default_backend = lazy_import(
+    "cryptography.hazmat.backends", "default_backend")
+serialization = lazy_import("cryptography.hazmat.primitives.serialization")
+hashes = lazy_import("cryptography.hazmat.primitives.hashes")
+dsa = lazy_import("cryptography.hazmat.primitives.asymmetric.dsa")
+rsa = lazy_import("cryptography.hazmat.primitives.asymmetric.rsa")
+ec = lazy_import("cryptography.hazmat.primitives.asymmetric.ec")
+leclient = lazy_import("free_tls_certificates.client")
 
 
 if not groups.get_system("ssl-cert"):
@@ -320,6 +325,21 @@ def scan():
 
 
 def _scan_a_cert(id, cert_path, key_path, assigns, is_acme=False):
+    meta = storage.snapshot.get(
+        "certificates", cert_path, [cert_path, key_path])
+    if not meta:
+        meta = _read_cert_meta(cert_path, key_path)
+        storage.snapshot.set(
+            "certificates", cert_path, [cert_path, key_path], meta)
+    expiry = datetime.datetime.strptime(meta["expiry"], "%Y-%m-%dT%H:%M:%S")
+    return Certificate(
+        id=id, cert_path=cert_path, key_path=key_path,
+        keytype=meta["keytype"], keylength=meta["keylength"],
+        domain=meta["domain"], assigns=assigns.get(id, []), expiry=expiry,
+        sha1=meta["sha1"], md5=meta["md5"], is_acme=is_acme)
+
+
+def _read_cert_meta(cert_path, key_path):
     with open(cert_path, "rb") as f:
         crt = x509.load_pem_x509_certificate(f.read(), default_backend())
     with open(key_path, "rb") as f:
@@ -334,11 +354,11 @@ def _scan_a_cert(id, cert_path, key_path, assigns, is_acme=False):
     md5 = ":".join([md5[i:i+2].upper() for i in range(0, len(md5), 2)])
     kt = "RSA" if isinstance(key.public_key(), rsa.RSAPublicKey) else "DSA"
     common_name = crt.subject.get_attributes_for_oid(NameOID.COMMON_NAME)
-    return Certificate(
-        id=id, cert_path=cert_path, key_path=key_path, keytype=kt,
-        keylength=key.key_size, domain=common_name[0].value,
-        assigns=assigns.get(id, []), expiry=crt.not_valid_after, sha1=sha1,
-        md5=md5, is_acme=is_acme)
+    return {
+        "keytype": kt, "keylength": key.key_size,
+        "domain": common_name[0].value, "sha1": sha1, "md5": md5,
+        "expiry": crt.not_valid_after.strftime("%Y-%m-%dT%H:%M:%S")
+    }
 
 
 def get_authorities(id=None, force=False):
@@ -18,13 +18,23 @@ DEFAULT_CONFIG = {
         "repo_server": "grm.arkos.io",
         "policy_path": "/etc/arkos/policies.json",
         "firewall": True,
+        "firewall_backend": "iptables",
         "enable_upnp": True,
         "ntp_server": "ntp.arkos.io",
         "date_format": "DD MMM YYYY",
         "time_format": "HH:mm:ss",
         "ldap_uri": "ldap://localhost",
         "ldap_rootdn": "dc=arkos-servers,dc=org",
-        "ldap_conntype": "dynamic"
+        "ldap_conntype": "dynamic",
+        "ldap_pool_size": 4,
+        "ldap_cache": False,
+        "ldap_cache_ttl": 5,
+        "ldap_syncrepl": False,
+        "serial_scans": False,
+        "services_cache_ttl": 5,
+        "resources_interval": 10,
+        "snapshot_path": "/var/lib/arkos/snapshot.json",
+        "stats_archive_dir": "/var/lib/arkos/stats"
     },
     "apps": {
         "app_dir": "/var/lib/arkos/applications",
@@ -70,7 +80,10 @@ TEST_CONFIG = copy.deepcopy(DEFAULT_CONFIG)
 TEST_CONFIG["general"].update({
     "repo_server": "grm-test.arkos.io",
     "enable_upnp": False,
-    "ldap_conntype": "simple"
+    "ldap_conntype": "simple",
+    "ldap_cache": False,
+    "snapshot_path": "",
+    "stats_archive_dir": ""
 })
 TEST_CONFIG["certificates"].update({
     "acme_server": "https://acme-staging.api.letsencrypt.org/directory"
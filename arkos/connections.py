@@ -7,41 +7,424 @@ Written by Jacob Cook
 Licensed under GPLv3, see LICENSE.md
 """
 
-import ldap
-import ldap.modlist
+import collections
+import contextlib
+import itertools
+import threading
 import xmlrpc.client
 
-
 from .utilities import errors
-from dbus import SystemBus, Interface
+from .utilities.lazy import lazy_import
+
+dbus = lazy_import("dbus")
+ldap = lazy_import("ldap")
+
+# D-Bus errors after which a proxy is rebuilt and the call retried once
+DBUS_RETRY_ERRORS = [
+    "org.freedesktop.DBus.Error.Disconnected",
+    "org.freedesktop.DBus.Error.NoReply",
+    "org.freedesktop.DBus.Error.NoServer",
+    "org.freedesktop.DBus.Error.ServiceUnknown"
+]
+
+# Number of entries requested per page of an LDAP search
+LDAP_PAGE_SIZE = 500
+
+# Number of LDAP writes sent ahead before waiting for their results
+LDAP_PIPELINE_SIZE = 32
 
 
 class ConnectionsManager:
-    """Manages arkOS connections to system-level processes via their APIs."""
+    """
+    Manages arkOS connections to system-level processes via their APIs.
+
+    Connections are opened on first use and cached. D-Bus proxies are
+    rebuilt after the remote daemon restarts, and LDAP operations are run
+    on a small pool of connections so that threads do not share one handle.
+    """
 
     def __init__(self, config, secrets):
         self.config = config
         self.secrets = secrets
+        self._lock = threading.RLock()
+        self._bus = None
+        self._proxies = {}
+        self._supervisor = threading.local()
+        self._ldap_pool = None
+        self._ldap_fixed = None
 
     def connect(self):
-        """Initialize the connections."""
+        """Initialize the connections. They are opened on first use."""
         self.connect_services()
         self.connect_ldap()
 
     def connect_services(self):
-        self.DBus = SystemBus()
-        self.SystemD = self.SystemDConnect(
-            "/org/freedesktop/systemd1", "org.freedesktop.systemd1.Manager")
-        self.Supervisor = supervisor_connect()
+        """Drop cached service connections so they are reopened on use."""
+        with self._lock:
+            self._bus = None
+            self._proxies = {}
+            self._supervisor = threading.local()
 
     def connect_ldap(self):
-        self.LDAP = ldap_connect(
-            config=self.config, passwd=self.secrets.get("ldap")
-        )
+        """Set up the LDAP connection pool."""
+        with self._lock:
+            if self._ldap_pool:
+                self._ldap_pool.close()
+            self._ldap_fixed = None
+            self._ldap_pool = LDAPPool(
+                lambda: ldap_connect(
+                    config=self.config, passwd=self.secrets.get("ldap")),
+                size=self.config.get("general", "ldap_pool_size", 4)
+            )
+
+    @property
+    def DBus(self):
+        """Return the system bus connection, reconnecting if it was lost."""
+        with self._lock:
+            if self._bus is not None and not self._bus.get_is_connected():
+                self.reset_bus()
+            if self._bus is None:
+                self._bus = dbus.SystemBus()
+            return self._bus
+
+    def reset_bus(self):
+        """Close the system bus connection and all proxies built on it."""
+        with self._lock:
+            if self._bus is not None:
+                try:
+                    self._bus.close()
+                except Exception:
+                    pass
+            self._bus = None
+            for x in self._proxies.values():
+                x.reset()
+
+    @property
+    def SystemD(self):
+        """Return the systemd manager interface."""
+        return self.SystemDConnect(
+            "/org/freedesktop/systemd1", "org.freedesktop.systemd1.Manager")
 
     def SystemDConnect(self, path, interface):
-        systemd = self.DBus.get_object("org.freedesktop.systemd1", path)
-        return Interface(systemd, dbus_interface=interface)
+        """
+        Return a cached proxy for a systemd D-Bus object and interface.
+
+        :param str path: D-Bus object path
+        :param str interface: D-Bus interface name
+        :returns: D-Bus interface proxy
+        :rtype: DBusProxy
+        """
+        with self._lock:
+            proxy = self._proxies.get((path, interface))
+            if not proxy:
+                proxy = DBusProxy(
+                    self, "org.freedesktop.systemd1", path, interface)
+                self._proxies[(path, interface)] = proxy
+            return proxy
+
+    @property
+    def Supervisor(self):
+        """Return the Supervisor XML-RPC interface for the current thread."""
+        return self.SupervisorRPC.supervisor
+
+    @property
+    def SupervisorRPC(self):
+        """Return the Supervisor XML-RPC server for the current thread."""
+        if getattr(self._supervisor, "server", None) is None:
+            self._supervisor.server = supervisor_connect()
+        return self._supervisor.server
+
+    @property
+    def LDAP(self):
+        """Return the LDAP connection, served from the connection pool."""
+        if self._ldap_fixed is not None:
+            return self._ldap_fixed
+        with self._lock:
+            if not self._ldap_pool:
+                self.connect_ldap()
+            return PooledLDAP(self._ldap_pool)
+
+    @LDAP.setter
+    def LDAP(self, value):
+        """Use a single fixed LDAP connection instead of the pool."""
+        self._ldap_fixed = value
+
+
+class DBusProxy:
+    """
+    A D-Bus interface proxy that survives restarts of the remote service.
+
+    Method calls are forwarded to a ``dbus.Interface`` built on first use.
+    If a call fails because the service or bus went away, the interface is
+    rebuilt and the call is retried once.
+    """
+
+    def __init__(self, manager, bus_name, path, interface):
+        """
+        Initialize the proxy.
+
+        :param ConnectionsManager manager: manager holding the bus
+        :param str bus_name: D-Bus service name
+        :param str path: D-Bus object path
+        :param str interface: D-Bus interface name
+        """
+        self._manager = manager
+        self._bus_name = bus_name
+        self._path = path
+        self._interface = interface
+        self._iface = None
+
+    def reset(self):
+        """Drop the underlying interface so it is rebuilt on next use."""
+        self._iface = None
+
+    def _connect(self):
+        if self._iface is None:
+            obj = self._manager.DBus.get_object(self._bus_name, self._path)
+            self._iface = dbus.Interface(obj, dbus_interface=self._interface)
+        return self._iface
+
+    def __getattr__(self, name):
+        """Return a callable for the named D-Bus method."""
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def method(*args, **kwargs):
+            try:
+                return getattr(self._connect(), name)(*args, **kwargs)
+            except dbus.exceptions.DBusException as e:
+                if e.get_dbus_name() not in DBUS_RETRY_ERRORS:
+                    raise
+                if e.get_dbus_name().endswith((".Disconnected", ".NoServer")):
+                    self._manager.reset_bus()
+                self.reset()
+            return getattr(self._connect(), name)(*args, **kwargs)
+        return method
+
+
+class LDAPPool:
+    """A small thread-safe pool of LDAP connections."""
+
+    def __init__(self, factory, size=4):
+        """
+        Initialize the pool.
+
+        :param func factory: function returning a new bound LDAP connection
+        :param int size: maximum number of open connections
+        """
+        self.factory = factory
+        self.size = size
+        self._idle = []
+        self._count = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """
+        Take a connection from the pool, opening one if needed.
+
+        Blocks if ``size`` connections are already in use.
+
+        :returns: LDAP connection object
+        """
+        with self._cond:
+            while not self._idle and self._count >= self.size:
+                self._cond.wait()
+            if self._idle:
+                return self._idle.pop()
+            self._count += 1
+        try:
+            return self.factory()
+        except Exception:
+            with self._cond:
+                self._count -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn, discard=False):
+        """
+        Return a connection to the pool.
+
+        :param conn: LDAP connection object
+        :param bool discard: Close the connection instead of reusing it
+        """
+        with self._cond:
+            if discard:
+                self._count -= 1
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+        if discard:
+            try:
+                conn.unbind_s()
+            except Exception:
+                pass
+
+    def close(self):
+        """Close all idle connections."""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._count -= len(idle)
+        for x in idle:
+            try:
+                x.unbind_s()
+            except Exception:
+                pass
+
+
+class PooledLDAP:
+    """
+    Stand-in for an LDAP connection that runs each call on a pooled one.
+
+    If the server went away, the connection is discarded and the call is
+    retried once on a fresh one.
+    """
+
+    def __init__(self, pool):
+        """
+        Initialize the pooled connection.
+
+        :param LDAPPool pool: pool to take connections from
+        """
+        self._pool = pool
+
+    def __getattr__(self, name):
+        """Return a callable for the named LDAP connection method."""
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def method(*args, **kwargs):
+            for attempt in range(2):
+                conn = self._pool.acquire()
+                try:
+                    result = getattr(conn, name)(*args, **kwargs)
+                except ldap.SERVER_DOWN:
+                    self._pool.release(conn, discard=True)
+                    if attempt:
+                        raise
+                    continue
+                except Exception:
+                    self._pool.release(conn)
+                    raise
+                self._pool.release(conn)
+                return result
+        return method
+
+    @contextlib.contextmanager
+    def connection(self):
+        """
+        Hold one pooled connection for several calls.
+
+        The connection is discarded instead of reused if the server went
+        away while it was held.
+        """
+        conn = self._pool.acquire()
+        discard = False
+        try:
+            yield conn
+        except ldap.SERVER_DOWN:
+            discard = True
+            raise
+        finally:
+            self._pool.release(conn, discard=discard)
+
+
+def ldap_search(
+        conn, base, scope, filterstr="(objectClass=*)", attrlist=None,
+        page_size=LDAP_PAGE_SIZE):
+    """
+    Search LDAP, yielding entries as they arrive.
+
+    Results are fetched in pages using the Simple Paged Results control,
+    so large directories are never held in memory at once. Servers that do
+    not support paging return all results in one go. When searching on a
+    pooled connection, one connection is held until iteration finishes.
+
+    :param conn: LDAP connection, such as ``conns.LDAP``
+    :param str base: Base DN to search from
+    :param int scope: LDAP search scope
+    :param str filterstr: LDAP search filter
+    :param list attrlist: Attributes to fetch (always pass these explicitly)
+    :param int page_size: Number of entries to request per page
+    :returns: iterator of (dn, attrs) tuples
+    """
+    if isinstance(conn, PooledLDAP):
+        with conn.connection() as c:
+            yield from ldap_search(
+                c, base, scope, filterstr, attrlist, page_size)
+        return
+    if not hasattr(conn, "search_ext"):
+        yield from conn.search_s(base, scope, filterstr, attrlist)
+        return
+
+    from ldap.controls import SimplePagedResultsControl
+    ctrl = SimplePagedResultsControl(False, size=page_size, cookie="")
+    while True:
+        msgid = conn.search_ext(
+            base, scope, filterstr, attrlist, serverctrls=[ctrl])
+        try:
+            while True:
+                rtype, rdata, rmsgid, rctrls = conn.result3(msgid, all=0)
+                if rtype == ldap.RES_SEARCH_RESULT:
+                    msgid = None
+                    break
+                for dn, attrs in rdata:
+                    if dn is not None:
+                        yield (dn, attrs)
+        finally:
+            # Stop the search on the server if iteration ended early
+            if msgid is not None:
+                try:
+                    conn.abandon(msgid)
+                except ldap.LDAPError:
+                    pass
+        cookies = [x.cookie for x in rctrls if x.controlType
+                   == SimplePagedResultsControl.controlType]
+        if not cookies or not cookies[0]:
+            break
+        ctrl.cookie = cookies[0]
+
+
+def ldap_add_many(conn, entries, window=LDAP_PIPELINE_SIZE):
+    """
+    Add many LDAP entries, pipelining the requests over one connection.
+
+    Up to ``window`` adds are sent before waiting for their results, so the
+    round trip to the server is not paid once per entry. A failed add does
+    not stop the others.
+
+    :param conn: LDAP connection, such as ``conns.LDAP``
+    :param entries: iterable of (dn, modlist) tuples
+    :param int window: Maximum number of adds awaiting results
+    :returns: iterator of (dn, LDAPError or None) tuples, in order
+    """
+    if isinstance(conn, PooledLDAP):
+        with conn.connection() as c:
+            yield from ldap_add_many(c, entries, window)
+        return
+    entries = iter(entries)
+    if not hasattr(conn, "add_ext"):
+        for dn, modlist in entries:
+            try:
+                conn.add_s(dn, modlist)
+            except ldap.LDAPError as e:
+                yield (dn, e)
+                continue
+            yield (dn, None)
+        return
+
+    pending = collections.deque()
+    while True:
+        for dn, modlist in itertools.islice(entries, window - len(pending)):
+            pending.append((dn, conn.add_ext(dn, modlist)))
+        if not pending:
+            break
+        dn, msgid = pending.popleft()
+        try:
+            conn.result3(msgid)
+        except ldap.LDAPError as e:
+            yield (dn, e)
+            continue
+        yield (dn, None)
 
 
 def ldap_connect(
@@ -88,10 +471,9 @@ def supervisor_connect():
     """
     Initialize a connection to Supervisor via XML-RPC API.
 
-    :returns: XML-RPC connection object
+    :returns: XML-RPC server proxy
     """
     try:
-        s = xmlrpc.client.Server("http://localhost:9001/RPC2")
-        return s.supervisor
+        return xmlrpc.client.Server("http://localhost:9001/RPC2")
     except Exception as e:
         raise errors.ConnectionError("Supervisor") from e
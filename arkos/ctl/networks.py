@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import click
+import time
 
 from arkos import logger
 from arkos.system import network
@@ -47,9 +48,15 @@ def list_networks():
 
 
 @net.command(name='ifaces')
-def list_interfaces():
+@click.option("-r", "--rates", is_flag=True,
+              help="Measure current throughput (takes a second)")
+def list_interfaces(rates):
     """List system network interfaces"""
     try:
+        if rates:
+            network.sample_rates()
+            time.sleep(1)
+            network.sample_rates()
         data = network.get_interfaces()
         for x in data:
             click.echo(
@@ -60,6 +67,12 @@ def list_interfaces():
                 click.style(" * Rx/Tx: ", fg="yellow") +
                 "{0} / {1}".format(str_fsize(x.rx), str_fsize(x.tx))
             )
+            if x.rx_rate is not None:
+                click.echo(
+                    click.style(" * Rate Rx/Tx: ", fg="yellow") +
+                    "{0}/s / {1}/s".format(
+                        str_fsize(int(x.rx_rate)), str_fsize(int(x.tx_rate)))
+                )
             click.echo(
                 click.style(" * Connected: ", fg="yellow") +
                 ("Yes" if x.up else "No")
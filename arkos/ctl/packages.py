@@ -1,10 +1,12 @@
 # -*- coding: utf-8 -*-
 import click
-import pacman
 
 from arkos import logger
+from arkos.utilities import lazy_import
 from arkos.ctl.utilities import abort_if_false, CLIException
 
+pacman = lazy_import("pacman")
+
 
 @click.group()
 def pkg():
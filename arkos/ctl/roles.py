@@ -1,11 +1,39 @@
 # -*- coding: utf-8 -*-
 import click
+import os
 
 from arkos import conns, logger
 from arkos.system import users, groups, domains
 from arkos.ctl.utilities import abort_if_false, CLIException
 
 
+def _format(path, fmt):
+    """Return the import/export format, guessing it from the file name."""
+    if fmt:
+        return fmt
+    return "ldif" if os.path.splitext(path)[1].lower() == ".ldif" else "csv"
+
+
+def _import(module, comp, path, fmt):
+    """Bulk-add users or groups from a CSV or LDIF file."""
+    with open(path, "r") as f:
+        entries = module.read_entries(f, _format(path, fmt))
+    added, failed = module.bulk_add(entries)
+    for name, error in sorted(failed.items()):
+        logger.error(comp, "{0}: {1}".format(name, error))
+    logger.success(comp, "Imported {0} of {1}".format(
+        len(added), len(entries)))
+
+
+def _export(module, comp, path, fmt):
+    """Write users or groups to a CSV or LDIF file."""
+    # User exports hold password hashes
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with open(fd, "w") as f:
+        count = module.write_entries(f, _format(path, fmt))
+    logger.success(comp, "Exported {0} to {1}".format(count, path))
+
+
 @click.group()
 def user():
     """User commands (LDAP)"""
@@ -141,6 +169,30 @@ def delete_user(name):
         raise CLIException(str(e))
 
 
+@user.command(name='import')
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(["csv", "ldif"]),
+              help="File format (default from file extension)")
+def import_users(path, fmt):
+    """Add users to arkOS LDAP from a CSV or LDIF file"""
+    try:
+        _import(users, 'ctl:usr:import', path, fmt)
+    except Exception as e:
+        raise CLIException(str(e))
+
+
+@user.command(name='export')
+@click.argument("path", type=click.Path(dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(["csv", "ldif"]),
+              help="File format (default from file extension)")
+def export_users(path, fmt):
+    """Export arkOS LDAP users to a CSV or LDIF file"""
+    try:
+        _export(users, 'ctl:usr:export', path, fmt)
+    except Exception as e:
+        raise CLIException(str(e))
+
+
 @group.command(name='list')
 def list_groups():
     """List groups"""
@@ -205,6 +257,30 @@ def delete_group(name):
         raise CLIException(str(e))
 
 
+@group.command(name='import')
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(["csv", "ldif"]),
+              help="File format (default from file extension)")
+def import_groups(path, fmt):
+    """Add groups to arkOS LDAP from a CSV or LDIF file"""
+    try:
+        _import(groups, 'ctl:grp:import', path, fmt)
+    except Exception as e:
+        raise CLIException(str(e))
+
+
+@group.command(name='export')
+@click.argument("path", type=click.Path(dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(["csv", "ldif"]),
+              help="File format (default from file extension)")
+def export_groups(path, fmt):
+    """Export arkOS LDAP groups to a CSV or LDIF file"""
+    try:
+        _export(groups, 'ctl:grp:export', path, fmt)
+    except Exception as e:
+        raise CLIException(str(e))
+
+
 @domain.command(name='list')
 def list_domains():
     """List domains"""
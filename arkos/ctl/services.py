@@ -1,9 +1,9 @@
 # -*- coding: utf-8 -*-
 import click
+import datetime
 
 from arkos import conns, logger
 from arkos.system import services
-from arkos.utilities import shell
 from arkos.ctl.utilities import CLIException
 
 
@@ -38,47 +38,38 @@ def list_services():
 
 
 @svc.command()
-@click.argument("name")
-def start(name):
-    """Start a service"""
-    try:
-        service = services.get(name)
-        service.start()
-        if service.state == "running":
-            logger.success('ctl:svc:start', 'Started {0}'.format(name))
-        else:
-            logger.error('ctl:svc:start', 'Failed to start {0}'.format(name))
-    except Exception as e:
-        raise CLIException(str(e))
+@click.argument("names", nargs=-1, required=True)
+def start(names):
+    """Start one or more services"""
+    _bulk("start", "Started", names)
 
 
 @svc.command()
-@click.argument("name")
-def stop(name):
-    """Stop a service"""
-    try:
-        service = services.get(name)
-        service.stop()
-        logger.success('ctl:svc:stop', 'Stopped {0}'.format(name))
-    except Exception as e:
-        raise CLIException(str(e))
+@click.argument("names", nargs=-1, required=True)
+def stop(names):
+    """Stop one or more services"""
+    _bulk("stop", "Stopped", names)
 
 
 @svc.command()
-@click.argument("name")
-def restart(name):
-    """Restart a service"""
+@click.argument("names", nargs=-1, required=True)
+def restart(names):
+    """Restart one or more services"""
+    _bulk("restart", "Restarted", names)
+
+
+def _bulk(action, verb, names):
     try:
-        service = services.get(name)
-        service.restart()
-        if service.state == "running":
-            logger.success('ctl:svc:restart', 'Restarted {0}'.format(name))
-        else:
-            logger.error(
-                'ctl:svc:restart', 'Failed to restart {0}'.format(name)
-            )
+        results = services.bulk(action, names)
     except Exception as e:
         raise CLIException(str(e))
+    for name in names:
+        if results.get(name):
+            logger.error('ctl:svc:{0}'.format(action), results[name])
+        else:
+            logger.success(
+                'ctl:svc:{0}'.format(action), '{0} {1}'.format(verb, name)
+            )
 
 
 @svc.command()
@@ -105,6 +96,38 @@ def disable(name):
         raise CLIException(str(e))
 
 
+@svc.command()
+@click.argument("name")
+@click.option("--cpu-weight", type=int, default=None,
+              help="Relative CPU weight (1-10000)")
+@click.option("--memory-max", default=None,
+              help="Memory limit (e.g. 256M, or infinity)")
+@click.option("--tasks-max", default=None,
+              help="Maximum number of tasks (or infinity)")
+@click.option("--io-weight", type=int, default=None,
+              help="Relative IO weight (1-10000)")
+@click.option("--clear", is_flag=True, help="Remove all limits")
+def limits(name, cpu_weight, memory_max, tasks_max, io_weight, clear):
+    """Show or set resource limits for a service"""
+    try:
+        service = services.get(name)
+        if not service:
+            raise CLIException("No service found")
+        data = {} if clear else service.get_limits()
+        new = {"CPUWeight": cpu_weight, "MemoryMax": memory_max,
+               "TasksMax": tasks_max, "IOWeight": io_weight}
+        data.update({x: y for x, y in new.items() if y is not None})
+        if clear or any(x is not None for x in new.values()):
+            service.set_limits(data)
+            logger.success(
+                'ctl:svc:limits', 'Limits set for {0}'.format(name))
+        for x in sorted(data):
+            click.echo(click.style(x, fg="white", bold=True) +
+                       ": {0}".format(data[x]))
+    except Exception as e:
+        raise CLIException(str(e))
+
+
 @svc.command()
 @click.argument("name")
 def status(name):
@@ -131,18 +154,34 @@ def status(name):
 
 @svc.command()
 @click.argument("name")
-def log(name):
+@click.option("-f", "--follow", is_flag=True, help="Wait for new entries")
+@click.option("-s", "--since", default=None,
+              help="Show entries since (YYYY-MM-DD HH:MM:SS)")
+@click.option("-p", "--priority", type=int, default=None,
+              help="Show entries of this syslog level (0-7) or more severe")
+@click.option("-a", "--all-boots", is_flag=True,
+              help="Show entries from before the last boot too")
+def log(name, follow, since, priority, all_boots):
     """Get logs since last boot for a particular service"""
     try:
         service = services.get(name)
         if not service:
             raise CLIException("No service found")
-        if service.stype == "system":
-            data = shell("journalctl -x -b 0 -u {0}".format(service.sfname))
-            click.echo_via_pager(
-                data["stdout"].decode()
-            )
+        if since:
+            since = datetime.datetime.strptime(since, "%Y-%m-%d %H:%M:%S")
+        entries = service.iter_log(
+            since=since, priority=priority, follow=follow,
+            this_boot=not all_boots)
+        lines = (_format_log_entry(x) for x in entries)
+        if follow:
+            for x in lines:
+                click.echo(x, nl=False)
         else:
-            click.echo_via_pager(service.get_log())
+            click.echo_via_pager(lines)
     except Exception as e:
         raise CLIException(str(e))
+
+
+def _format_log_entry(entry):
+    stamp = entry["time"].strftime("%b %d %H:%M:%S ") if entry["time"] else ""
+    return "{0}{1}\n".format(stamp, entry["message"])
@@ -1,5 +1,5 @@
 """
-Functions for managing iptables firewall and fail2ban defence security.
+Functions for managing the firewall and fail2ban defence security.
 
 arkOS Core
 (c) 2016 CitizenWeb
@@ -8,49 +8,31 @@ Licensed under GPLv3, see LICENSE.md
 """
 
 import configparser
+import ipaddress
 import os
 
-from arkos import applications, signals
+from arkos import applications, config, signals
 from arkos.system import network
-from arkos.utilities import errors, shell, cidr_to_netmask
+from arkos.utilities import errors, shell
 
 jailconf = "/etc/fail2ban/jail.conf"
 filters = "/etc/fail2ban/filter.d"
 
 
 def initialize_firewall():
-    """Flush all iptables rules and setup a new clean arkOS firewall chain."""
+    """Flush all firewall rules and setup a new clean arkOS firewall."""
     signals.emit("security", "pre_fw_init")
-    flush_chain("INPUT")
-
-    # Accept loopback
-    shell("iptables -A INPUT -i lo -j ACCEPT")
-
-    # Accept designated apps
-    shell("iptables -N arkos-apps")
-    shell("iptables -A INPUT -j arkos-apps")
-
-    # Allow ICMP (ping)
-    shell(
-        "iptables -A INPUT -p icmp -m icmp --icmp-type echo-request -j ACCEPT")
-
-    # Accept established/related connections
-    shell("iptables -A INPUT -m state --state RELATED,ESTABLISHED -j ACCEPT")
-
-    # Allow mDNS (Avahi/Bonjour/Zeroconf)
-    shell("iptables -A INPUT -p udp --dport mdns -j ACCEPT")
-    shell("iptables -A OUTPUT -p udp --dport mdns -j ACCEPT")
-
-    # Reject all else by default
-    shell("iptables -A INPUT -j DROP")
-
-    save_rules()
+    get_backend().initialize()
     signals.emit("security", "post_fw_init")
 
 
 def regenerate_firewall(data, range=[]):
     """
-    Flush and regenerate arkOS firewall chain.
+    Regenerate arkOS firewall rules.
+
+    The new rule set is rendered in memory and only applied if it differs
+    from the current one. Updates are applied in a single transaction, so
+    the firewall is never seen half-built.
 
     If ``range`` is not specified, network module will guess what they are.
 
@@ -58,23 +40,232 @@ def regenerate_firewall(data, range=[]):
     :param list range: Range(s) of local network(s) ('192.168.0.0/24')
     """
     signals.emit("security", "pre_fw_regen")
-    flush_chain("arkos-apps")
     default_range = range or network.get_active_ranges()
-    # For each policy in the system, add a rule
-    for x in data:
-        range = getattr(x, "allowed_ranges", default_range)
-        for port in x.ports:
-            if x.policy == 2:
-                add_rule("ACCEPT", port[0], port[1], ["anywhere"])
-            elif x.policy == 1:
-                add_rule("ACCEPT", port[0], port[1], range)
-            else:
-                add_rule("REJECT", port[0], port[1])
-    shell("iptables -A arkos-apps -j RETURN")
-    save_rules()
+    get_backend().regenerate(list(data), default_range)
     signals.emit("security", "post_fw_regen")
 
 
+def get_backend(name=None):
+    """
+    Get the firewall backend in use.
+
+    If ``name`` is not specified, the ``general.firewall_backend`` config
+    value is used.
+
+    :param str name: Backend name (``iptables`` or ``nftables``)
+    :returns: firewall backend
+    """
+    name = name or config.get("general", "firewall_backend", "iptables")
+    if name not in BACKENDS:
+        raise errors.InvalidConfigError(
+            "Unknown firewall backend: {0}".format(name))
+    if name not in _backends:
+        _backends[name] = BACKENDS[name]()
+    return _backends[name]
+
+
+class IptablesBackend:
+    """
+    Firewall backend using iptables.
+
+    Policies are enacted as rules in an ``arkos-apps`` chain that is
+    jumped to from ``INPUT``.
+    """
+
+    def initialize(self):
+        """Flush all iptables rules and setup a new clean arkOS chain."""
+        flush_chain("INPUT")
+
+        # Accept loopback
+        shell("iptables -A INPUT -i lo -j ACCEPT")
+
+        # Accept designated apps
+        shell("iptables -N arkos-apps")
+        shell("iptables -A INPUT -j arkos-apps")
+
+        # Allow ICMP (ping)
+        shell("iptables -A INPUT -p icmp -m icmp --icmp-type echo-request "
+              "-j ACCEPT")
+
+        # Accept established/related connections
+        shell("iptables -A INPUT -m state --state RELATED,ESTABLISHED "
+              "-j ACCEPT")
+
+        # Allow mDNS (Avahi/Bonjour/Zeroconf)
+        shell("iptables -A INPUT -p udp --dport mdns -j ACCEPT")
+        shell("iptables -A OUTPUT -p udp --dport mdns -j ACCEPT")
+
+        # Reject all else by default
+        shell("iptables -A INPUT -j DROP")
+
+        save_rules()
+
+    def regenerate(self, data, default_range):
+        """
+        Replace the rules in the arkOS chain if they changed.
+
+        :param list data: Security policies to enact
+        :param list default_range: Range(s) of local network(s)
+        """
+        rules = []
+        # For each policy in the system, render its rules. Policies
+        # processed later take precedence, so they go first in the chain.
+        for x in reversed(data):
+            range = getattr(x, "allowed_ranges", default_range)
+            for port in reversed(x.ports):
+                if x.policy == 2:
+                    rules += render_rule(
+                        "ACCEPT", port[0], port[1], ["anywhere"])
+                elif x.policy == 1:
+                    rules += render_rule("ACCEPT", port[0], port[1], range)
+                else:
+                    rules += render_rule("REJECT", port[0], port[1])
+        rules.append("-A arkos-apps -j RETURN")
+        if rules != get_chain_rules("arkos-apps"):
+            signals.emit("security", "fw_flush")
+            apply_rules(rules, flush=["arkos-apps"])
+            save_rules()
+
+
+class NftablesBackend:
+    """
+    Firewall backend using nftables.
+
+    Everything lives in an ``arkos`` table. Ports are looked up in one
+    verdict map per protocol, so matching a packet costs the same however
+    many services are tracked, and local network ranges are kept in an
+    interval set. The table is replaced atomically with ``nft -f``.
+    """
+
+    VERDICTS = {2: "accept", 1: "jump local_only", 0: "jump restricted"}
+
+    def __init__(self):
+        """Initialize the backend."""
+        self.applied = None
+
+    def initialize(self):
+        """Setup a new clean arkOS table with no services allowed."""
+        self.applied = None
+        self.regenerate([], [])
+
+    def regenerate(self, data, default_range):
+        """
+        Replace the arkOS table if its rules changed.
+
+        :param list data: Security policies to enact
+        :param list default_range: Range(s) of local network(s)
+        """
+        ruleset = self.render(data, default_range)
+        if ruleset == self.applied:
+            return
+        s = shell("nft -f /dev/stdin", stdin=ruleset)
+        if s["code"] != 0:
+            raise errors.OperationFailedError(
+                "Firewall rules could not be applied: {0}"
+                .format(s["stderr"].decode().strip()))
+        self.applied = ruleset
+        self.save()
+
+    def render(self, data, default_range):
+        """
+        Render the arkOS table for a set of policies.
+
+        :param list data: Security policies to enact
+        :param list default_range: Range(s) of local network(s)
+        :returns: nft script replacing the arkOS table
+        :rtype: str
+        """
+        ports = {"tcp": {}, "udp": {}}
+        extra = []
+        for x in data:
+            ranges = getattr(x, "allowed_ranges", None)
+            for protocol, port in x.ports:
+                protocol, port = protocol.lower(), int(port)
+                if x.policy == 1 and ranges is not None:
+                    # Policies with their own ranges can't use the shared set
+                    rules = []
+                    if _networks(ranges):
+                        rules.append(
+                            "{0} dport {1} ip saddr {{ {2} }} accept".format(
+                                protocol, port, ", ".join(_networks(ranges))))
+                    rules.append("{0} dport {1} reject".format(protocol, port))
+                    extra.append(rules)
+                    ports[protocol].pop(port, None)
+                else:
+                    ports[protocol][port] = self.VERDICTS[x.policy]
+
+        lines = [
+            "table ip arkos",
+            "delete table ip arkos",
+            "table ip arkos {",
+            "    set local_ranges {",
+            "        type ipv4_addr",
+            "        flags interval"
+        ]
+        if _networks(default_range):
+            lines.append("        elements = {{ {0} }}".format(
+                ", ".join(_networks(default_range))))
+        lines.append("    }")
+        for protocol in ["tcp", "udp"]:
+            lines += [
+                "    map {0}_ports {{".format(protocol),
+                "        type inet_service : verdict"
+            ]
+            if ports[protocol]:
+                lines.append("        elements = {{ {0} }}".format(", ".join(
+                    "{0} : {1}".format(x, ports[protocol][x])
+                    for x in sorted(ports[protocol]))))
+            lines.append("    }")
+        lines += [
+            "    chain local_only {",
+            "        ip saddr @local_ranges accept",
+            "        reject",
+            "    }",
+            "    chain restricted {",
+            "        reject",
+            "    }",
+            "    chain apps {"
+        ]
+        # Later policies come first, but each keeps its accept before reject
+        lines += ["        " + y for x in reversed(extra) for y in x]
+        lines += [
+            "        tcp dport vmap @tcp_ports",
+            "        udp dport vmap @udp_ports",
+            "    }",
+            "    chain input {",
+            "        type filter hook input priority 0; policy accept;",
+            "        iif lo accept",
+            "        jump apps",
+            "        icmp type echo-request accept",
+            "        ct state established,related accept",
+            "        udp dport 5353 accept",
+            "        drop",
+            "    }",
+            "    chain output {",
+            "        type filter hook output priority 0; policy accept;",
+            "        udp dport 5353 accept",
+            "    }",
+            "}"
+        ]
+        return "\n".join(lines) + "\n"
+
+    def save(self):
+        """Persist the nftables ruleset to a file loadable on boot."""
+        s = shell("nft list ruleset")
+        with open("/etc/nftables.conf", "w") as f:
+            f.write("flush ruleset\n\n")
+            f.write(s["stdout"].decode())
+
+
+BACKENDS = {"iptables": IptablesBackend, "nftables": NftablesBackend}
+_backends = {}
+
+
+def _networks(ranges):
+    return [str(ipaddress.ip_network(x, strict=False)) for x in ranges
+            if x not in ["", "anywhere", "0.0.0.0"]]
+
+
 def add_rule(opt, protocol, port, ranges=[]):
     """
     Allow or reject firewall access for specified service.
@@ -86,19 +277,69 @@ def add_rule(opt, protocol, port, ranges=[]):
     :param int port: Port number of service
     :param list ranges: Range(s) of local network(s) ('192.168.0.0/24')
     """
+    rules = [x.replace("-A", "-I", 1)
+             for x in render_rule(opt, protocol, port, ranges)]
+    # Create chain if not exists
+    flush = ["arkos-apps"] if get_chain_rules("arkos-apps") is None else []
+    apply_rules(rules, flush=flush)
+
+
+def render_rule(opt, protocol, port, ranges=[]):
+    """
+    Render the arkOS chain rules for a service.
+
+    Rules are rendered the way ``iptables -S`` prints them, one rule per
+    source range. If ``ranges`` is not specified, defaults to open access
+    to all hosts.
+
+    :param str opt: Target name, like 'ACCEPT' or 'REJECT'
+    :param str protocol: either "TCP" or "UDP"
+    :param int port: Port number of service
+    :param list ranges: Range(s) of local network(s) ('192.168.0.0/24')
+    :returns: rules
+    :rtype: list
+    """
+    rule = "-A arkos-apps {src}-p {ptc} -m {ptc} --dport {prt} -j {opt}"
+    if opt == "REJECT":
+        opt = "REJECT --reject-with icmp-port-unreachable"
+    protocol = protocol.lower()
     # If range is not provided, assume "0.0.0.0"
-    cmd = "iptables -I arkos-apps {src} -p {ptc} -m {ptc} --dport {prt} -j {opt}"
-    src = ""
-    for x in [r for r in ranges if r not in ["", "anywhere", "0.0.0.0"]]:
-        src = "-s " if not src else (src + ",")
-        ip, cidr = x.split("/")
-        mask = cidr_to_netmask(int(cidr))
-        src += ip + "/" + mask
-    s = shell(cmd.format(src=src, ptc=protocol, prt=port, opt=opt))
-    if s["code"] != 0 and b"No chain/target/match by that name" in s["stderr"]:
-        # Create chain if not exists
-        shell("iptables -N arkos-apps")
-        shell(cmd.format(src=src, ptc=protocol, prt=port, opt=opt))
+    srcs = ["-s {0} ".format(x) for x in _networks(ranges)]
+    return [rule.format(src=x, ptc=protocol, prt=int(port), opt=opt)
+            for x in (srcs or [""])]
+
+
+def get_chain_rules(chain):
+    """
+    Get the rules currently in a firewall chain.
+
+    :param str chain: Chain name
+    :returns: rules as printed by ``iptables -S``, or None if no chain
+    :rtype: list
+    """
+    s = shell("iptables -S {0}".format(chain))
+    if s["code"] != 0:
+        return None
+    return [x for x in s["stdout"].decode().splitlines()
+            if x.startswith("-A ")]
+
+
+def apply_rules(rules, flush=[]):
+    """
+    Apply firewall rules in a single ``iptables-restore`` transaction.
+
+    :param list rules: Rules to apply, in ``iptables -S`` format
+    :param list flush: User chains to create or empty before applying
+    """
+    data = ["*filter"]
+    data += [":{0} - [0:0]".format(x) for x in flush]
+    data += rules
+    data.append("COMMIT")
+    s = shell("iptables-restore --noflush", stdin="\n".join(data) + "\n")
+    if s["code"] != 0:
+        raise errors.OperationFailedError(
+            "Firewall rules could not be applied: {0}"
+            .format(s["stderr"].decode().strip()))
 
 
 def flush_chain(chain):
@@ -110,7 +351,7 @@ def flush_chain(chain):
 def save_rules():
     """Persist firewall rules to a file loadable on boot."""
     with open("/etc/iptables/iptables.rules", "w") as f:
-        f.write(str(shell("iptables-save")["stdout"]))
+        f.write(shell("iptables-save")["stdout"].decode())
 
 
 def get_jail_config(jcfg=""):
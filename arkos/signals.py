@@ -7,8 +7,14 @@ Written by Jacob Cook
 Licensed under GPLv3, see LICENSE.md
 """
 
+import threading
+import time
+
 from arkos import storage, logger
 
+_lock = threading.Lock()
+_pool = None
+
 
 class Listener:
     """
@@ -19,9 +25,12 @@ class Listener:
     are good to use for cleanup after an item is removed from the system,
     or for making sure certain elements are established after loading a
     necessary component.
+
+    Background listeners are run on a worker pool, so that slow hooks do
+    not hold up the code emitting the signal.
     """
 
-    def __init__(self, by, id, sig, func):
+    def __init__(self, by, id, sig, func, background=False):
         """
         Initialize the signal listener.
 
@@ -29,11 +38,16 @@ class Listener:
         :param str id: identifier for this listener
         :param str sig: signal ID to listen for
         :param func func: hook function to execute
+        :param bool background: Run the hook function on a worker pool?
         """
         self.id = id
         self.by = by
         self.sig = sig
         self.func = func
+        self.background = background
+        self.calls = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
 
     def trigger(self, data, crit=True):
         """
@@ -42,6 +56,7 @@ class Listener:
         :param data: parameter to provide to the hook function
         :param bool crit: Raise hook function exceptions?
         """
+        start = time.time()
         try:
             if data:
                 self.func(data)
@@ -50,9 +65,53 @@ class Listener:
         except:
             if crit:
                 raise
+        finally:
+            elapsed = time.time() - start
+            self.calls += 1
+            self.total_time += elapsed
+            self.max_time = max(self.max_time, elapsed)
 
+    def trigger_background(self, data):
+        """
+        Trigger the hook function for this listener on the worker pool.
+
+        Exceptions raised by the hook function are logged.
 
-def add(by, id, sig, func):
+        :param data: parameter to provide to the hook function
+        """
+        def _run():
+            try:
+                self.trigger(data)
+            except Exception as e:
+                logger.error("Sign", "Listener {0} for {1} failed: {2}".format(
+                    self.by, self.sig, e))
+        _get_pool().submit(_run)
+
+    @property
+    def as_dict(self):
+        """Return listener timing metadata as dict."""
+        return {
+            "id": self.id,
+            "by": self.by,
+            "sig": self.sig,
+            "background": self.background,
+            "calls": self.calls,
+            "total_time": self.total_time,
+            "avg_time": self.total_time / self.calls if self.calls else 0.0,
+            "max_time": self.max_time
+        }
+
+
+def _get_pool():
+    global _pool
+    with _lock:
+        if _pool is None:
+            from concurrent import futures
+            _pool = futures.ThreadPoolExecutor(max_workers=4)
+        return _pool
+
+
+def add(by, id, sig, func, background=False):
     """
     Register a new listener with the system.
 
@@ -60,10 +119,11 @@ def add(by, id, sig, func):
     :param str id: identifier for this listener
     :param str sig: signal ID to listen for
     :param func func: hook function to execute
+    :param bool background: Run the hook function on a worker pool?
     """
-    if not storage.signals.get(id):
-        storage.signals[id] = []
-    storage.signals[id].append(Listener(by, id, sig, func))
+    with _lock:
+        storage.signals.setdefault((id, sig), []).append(
+            Listener(by, id, sig, func, background))
     logger.debug("Sign", "Registered {0} to {1} for {2}".format(
         sig, id, by
     ))
@@ -78,13 +138,14 @@ def emit(id, sig, data=None, crit=True):
     :param data: parameter to pass to hook function (if necessary)
     :param bool crit: Raise hook function exceptions?
     """
-    if not storage.signals.get(id):
+    listeners = storage.signals.get((id, sig))
+    if not listeners:
         return
-    sigs = filter(
-        lambda x: x.sig == sig, storage.signals.get(id)
-    )
-    for x in sigs:
-        x.trigger(data, crit)
+    for x in listeners[:]:
+        if x.background:
+            x.trigger_background(data)
+        else:
+            x.trigger(data, crit)
 
 
 def remove(by):
@@ -93,6 +154,19 @@ def remove(by):
 
     :param str by: name of the module to dereigster listeners for
     """
-    for x in storage.signals:
-        for y in filter(lambda z: z.by == by, storage.signals[x]):
-            storage.signals.remove(y)
+    with _lock:
+        for x in list(storage.signals):
+            storage.signals[x] = [y for y in storage.signals[x] if y.by != by]
+            if not storage.signals[x]:
+                del storage.signals[x]
+
+
+def get_stats():
+    """
+    Get timing data for all registered listeners, slowest first.
+
+    :returns: listener timing metadata
+    :rtype: list
+    """
+    data = [y.as_dict for x in list(storage.signals.values()) for y in x]
+    return sorted(data, key=lambda x: x["total_time"], reverse=True)
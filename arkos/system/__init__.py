@@ -9,6 +9,8 @@ Licensed under GPLv3, see LICENSE.md
 
 from . import network
 from . import services
+from . import resources
+from . import archive
 from . import stats
 from . import systemtime
 from . import domains
@@ -20,6 +22,8 @@ from . import filesystems
 __all__ = [
     "network",
     "services",
+    "resources",
+    "archive",
     "stats",
     "systemtime",
     "domains",
@@ -0,0 +1,283 @@
+"""
+Classes for keeping a persistent, fixed-size archive of statistics.
+
+arkOS Core
+(c) 2016 CitizenWeb
+Written by Jacob Cook
+Licensed under GPLv3, see LICENSE.md
+"""
+
+import math
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+
+from arkos import config
+
+# Resolutions (seconds per slot) and sizes of each archive tier.
+# Covers 2 days at 1 min, 90 days at 30 min and a year at 6 h.
+TIERS = [(60, 2880), (1800, 4320), (21600, 1460)]
+
+# Seconds between writes of completed slots to disk
+FLUSH_INTERVAL = 600
+
+MAGIC = b"ARRD"
+VERSION = 1
+HEADER = struct.Struct("<4sHH")
+TIER = struct.Struct("<IIdI")
+SLOT = struct.Struct("<fff")
+
+_archives = {}
+_lock = threading.Lock()
+_flushed = {"time": 0.0}
+
+
+class Archive:
+    """
+    A round-robin archive of one metric, stored in a memory-mapped file.
+
+    The file holds a fixed number of slots per tier, each with the average,
+    minimum and maximum of the values recorded in it, so it never grows
+    and writing a slot takes the same time however old the archive is.
+    Completed slots are queued in memory and written out together by
+    ``flush``, to limit writes to SD cards.
+    """
+
+    def __init__(self, path, tiers=TIERS):
+        """
+        Initialize the archive and open its file, creating it if needed.
+
+        :param str path: Path to archive file
+        :param list tiers: (resolution, size) for each tier, finest first
+        """
+        self.path = path
+        self.tiers = tiers
+        self.pending = [None for x in tiers]
+        self.queue = []
+        self._file = None
+        self._map = None
+        self.open()
+
+    @property
+    def file_size(self):
+        """Return the size of the archive file in bytes."""
+        return HEADER.size + TIER.size * len(self.tiers) \
+            + SLOT.size * sum(x[1] for x in self.tiers)
+
+    def open(self):
+        """Open the archive file, recreating it if its layout changed."""
+        if not self._is_valid():
+            self._create()
+        self._file = open(self.path, "r+b")
+        self._map = mmap.mmap(self._file.fileno(), 0)
+
+    def close(self):
+        """
+        Write out all slots, including unfinished ones, and close the file.
+
+        Values recorded later for an unfinished slot are merged into it.
+        """
+        if self._map is None:
+            return
+        for i, acc in enumerate(self.pending):
+            if acc:
+                self.queue.append(
+                    (i, acc[0], acc[1] / acc[2], acc[3], acc[4]))
+        self.pending = [None for x in self.tiers]
+        self.flush()
+        self._map.close()
+        self._file.close()
+        self._map, self._file = None, None
+
+    def add(self, timestamp, value):
+        """
+        Record a value.
+
+        :param float timestamp: Time of the value
+        :param float value: Value
+        """
+        for i, (step, size) in enumerate(self.tiers):
+            slot = timestamp - timestamp % step
+            acc = self.pending[i]
+            if acc and acc[0] != slot:
+                self.queue.append(
+                    (i, acc[0], acc[1] / acc[2], acc[3], acc[4]))
+                acc = None
+            if acc:
+                acc[1] += value
+                acc[2] += 1
+                acc[3] = min(acc[3], value)
+                acc[4] = max(acc[4], value)
+            else:
+                self.pending[i] = [slot, value, 1, value, value]
+
+    def flush(self):
+        """Write queued slots to the archive file."""
+        if not self.queue:
+            return
+        for x in self.queue:
+            self._write_slot(*x)
+        self.queue = []
+        self._map.flush()
+
+    def range(self, start=0, end=None, step=None):
+        """
+        Get archived values in a time range.
+
+        The finest tier that reaches back to ``start`` is used, unless a
+        coarser ``step`` is requested. Slots with no data are skipped.
+
+        :param float start: Start time
+        :param float end: End time (default now)
+        :param int step: Minimum resolution in seconds
+        :returns: list of (time, avg, min, max) tuples, oldest first
+        """
+        end = end or time.time()
+        tiers = [i for i, x in enumerate(self.tiers) if x[0] >= (step or 0)]
+        tiers = tiers or [len(self.tiers) - 1]
+        i = tiers[-1]
+        for x in tiers:
+            last = self._read_tier(x)[2]
+            if last and last - self.tiers[x][0] * (self.tiers[x][1] - 1) \
+                    <= start:
+                i = x
+                break
+        tstep, size, last, pos = self._read_tier(i)
+        start -= start % tstep
+        result = []
+        if last:
+            offset = self._data_offset(i)
+            for n in range(size - 1, -1, -1):
+                t = last - n * tstep
+                if not start <= t <= end:
+                    continue
+                x = SLOT.unpack_from(
+                    self._map, offset + ((pos - n) % size) * SLOT.size)
+                if not math.isnan(x[0]):
+                    result.append((t,) + x)
+        # Include completed and current slots not yet written out
+        for x in self.queue:
+            if x[0] == i and start <= x[1] <= end:
+                result.append(x[1:])
+        acc = self.pending[i]
+        if acc and start <= acc[0] <= end:
+            result.append((acc[0], acc[1] / acc[2], acc[3], acc[4]))
+        return result
+
+    def _is_valid(self):
+        if not os.path.exists(self.path) \
+                or os.path.getsize(self.path) != self.file_size:
+            return False
+        with open(self.path, "rb") as f:
+            data = f.read(HEADER.size + TIER.size * len(self.tiers))
+        magic, version, count = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION or count != len(self.tiers):
+            return False
+        for i, (step, size) in enumerate(self.tiers):
+            x = TIER.unpack_from(data, HEADER.size + i * TIER.size)
+            if x[0] != step or x[1] != size:
+                return False
+        return True
+
+    def _create(self):
+        if not os.path.exists(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+        empty = SLOT.pack(float("nan"), float("nan"), float("nan"))
+        with open(self.path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, len(self.tiers)))
+            for step, size in self.tiers:
+                f.write(TIER.pack(step, size, 0.0, 0))
+            for step, size in self.tiers:
+                f.write(empty * size)
+
+    def _read_tier(self, i):
+        return TIER.unpack_from(self._map, HEADER.size + i * TIER.size)
+
+    def _data_offset(self, i):
+        return HEADER.size + TIER.size * len(self.tiers) \
+            + SLOT.size * sum(x[1] for x in self.tiers[:i])
+
+    def _write_slot(self, i, timestamp, avg, low, high):
+        step, size, last, pos = self._read_tier(i)
+        offset = self._data_offset(i)
+        if last:
+            gap = int(round((timestamp - last) / step))
+            if gap < 0:
+                return
+            if gap == 0:
+                # Slot was written unfinished on close, merge with it
+                x = SLOT.unpack_from(self._map, offset + pos * SLOT.size)
+                if not math.isnan(x[0]):
+                    avg, low, high = ((x[0] + avg) / 2, min(x[1], low),
+                                      max(x[2], high))
+            # Mark slots skipped while nothing was recorded as empty
+            nan = float("nan")
+            for n in range(1, min(gap, size + 1)):
+                SLOT.pack_into(self._map, offset + ((pos + n) % size)
+                               * SLOT.size, nan, nan, nan)
+            pos = (pos + gap) % size
+        SLOT.pack_into(self._map, offset + pos * SLOT.size, avg, low, high)
+        TIER.pack_into(self._map, HEADER.size + i * TIER.size,
+                       step, size, timestamp, pos)
+
+
+def get(metric, create=False):
+    """
+    Get the archive for a metric, opening it if needed.
+
+    Archives are kept in the ``general.stats_archive_dir`` directory, and
+    are only created for metrics that are recorded.
+
+    :param str metric: Metric name
+    :param bool create: Create the archive if it does not exist yet
+    :returns: Archive, or None if archiving is disabled or there is none
+    """
+    path = config.get("general", "stats_archive_dir", "")
+    if not path:
+        return None
+    name = re.sub("[^A-Za-z0-9_.-]", "_", metric)
+    with _lock:
+        if name not in _archives:
+            path = os.path.join(path, "{0}.rrd".format(name))
+            if not create and not os.path.exists(path):
+                return None
+            _archives[name] = Archive(path)
+        return _archives[name]
+
+
+def record(timestamp, values):
+    """
+    Record values for several metrics.
+
+    Queued slots of all archives are written out once every
+    ``FLUSH_INTERVAL`` seconds.
+
+    :param float timestamp: Time of the values
+    :param dict values: Values by metric name
+    """
+    for metric, value in values.items():
+        archive = get(metric, create=True)
+        if archive is None:
+            return
+        archive.add(timestamp, value)
+    if timestamp - _flushed["time"] >= FLUSH_INTERVAL:
+        flush()
+
+
+def flush():
+    """Write queued slots of all archives to disk."""
+    with _lock:
+        for x in _archives.values():
+            x.flush()
+        _flushed["time"] = time.time()
+
+
+def close():
+    """Flush and close all archives."""
+    with _lock:
+        for x in _archives.values():
+            x.close()
+        _archives.clear()
@@ -7,12 +7,12 @@ Written by Jacob Cook
 Licensed under GPLv3, see LICENSE.md
 """
 
-import ldap
-import ldap.modlist
 
-from arkos import config, conns, signals
-from arkos.system import users
-from arkos.utilities import b, errors
+from arkos import config, conns, signals, storage
+from arkos.connections import ldap_search
+from arkos.utilities import b, errors, lazy_import
+
+ldap = lazy_import("ldap")
 
 
 class Domain:
@@ -51,15 +51,25 @@ class Domain:
                 "objectClass": [b"mailDomain", b"top"]}
         signals.emit("domains", "pre_add", self)
         conns.LDAP.add_s(self.ldap_id, ldap.modlist.addModlist(ldif))
+        storage.ldap_cache.invalidate("domains", self.ldap_id)
         signals.emit("domains", "post_add", self)
 
     def remove(self):
         """Delete domain."""
-        if self.name in [x.domain for x in users.get()]:
-            emsg = "A user is still using this domain"
-            raise errors.InvalidConfigError(emsg)
+        # Not every server supports substring filters on mail, so the
+        # domain is matched here
+        suffix = b("@{0}".format(self.name.lower()))
+        search = ldap_search(
+            conns.LDAP, "ou=users,{0}".format(self.rootdn),
+            ldap.SCOPE_SUBTREE, "(objectClass=inetOrgPerson)", ["mail"])
+        for dn, attrs in search:
+            if any(x.lower().endswith(suffix) for x in attrs.get("mail", [])):
+                search.close()
+                emsg = "A user is still using this domain"
+                raise errors.InvalidConfigError(emsg)
         signals.emit("domains", "pre_remove", self)
         conns.LDAP.delete_s(self.ldap_id)
+        storage.ldap_cache.invalidate("domains", self.ldap_id)
         signals.emit("domains", "post_remove", self)
 
     @property
@@ -82,13 +92,26 @@ def get(id=None):
     :rtype: Domain or list thereof
     """
     results = []
-    qset = conns.LDAP.search_s(
-        "ou=domains,{0}".format(config.get("general", "ldap_rootdn")),
+    rootdn = config.get("general", "ldap_rootdn")
+    if id:
+        d = storage.ldap_cache.get(
+            "domains", "virtualdomain={0},ou=domains,{1}".format(id, rootdn))
+    else:
+        d = storage.ldap_cache.get_all("domains")
+    if d is not None:
+        return d
+    qset = ldap_search(
+        conns.LDAP, "ou=domains,{0}".format(rootdn),
         ldap.SCOPE_SUBTREE, "(virtualdomain=*)", ["virtualdomain"])
     for x in qset:
         d = Domain(x[1]["virtualdomain"][0].decode(),
                    x[0].split("ou=domains,")[1])
         if d.name == id:
+            storage.ldap_cache.set("domains", d.ldap_id, d)
             return d
         results.append(d)
-    return results if id is None else None
+    if id is None:
+        storage.ldap_cache.set_all(
+            "domains", {x.ldap_id: x for x in results})
+        return results
+    return None
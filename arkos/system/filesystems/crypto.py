@@ -24,9 +24,10 @@ Modified for use in arkOS by Jacob Cook <jacob@citizenweb.io>
 
 import random
 import time
-from pycryptsetup import CryptSetup
 
-from ...utilities import get_current_entropy
+from ...utilities import get_current_entropy, lazy_import
+
+CryptSetup = lazy_import("pycryptsetup", "CryptSetup")
 
 MIN_CREATE_ENTROPY = 256  # bits
 
@@ -11,14 +11,15 @@ import ctypes
 import ctypes.util
 import glob
 import os
-import parted
 
 from . import crypto
 from . import losetup
 
 from arkos import config, signals, sharers
 from arkos.messages import Notification, NotificationThread
-from arkos.utilities import b, errors, shell
+from arkos.utilities import b, errors, shell, lazy_import
+
+parted = lazy_import("parted")
 
 libc = ctypes.CDLL(ctypes.util.find_library("libc"), use_errno=True)
 
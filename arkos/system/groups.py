@@ -7,12 +7,28 @@ Written by Jacob Cook
 Licensed under GPLv3, see LICENSE.md
 """
 
+import csv
 import grp
-import ldap
-import ldap.modlist
+import os
+import threading
 
-from arkos import conns, config, signals
-from arkos.utilities import b, errors, shell
+from arkos import conns, config, logger, signals, storage
+from arkos.connections import ldap_add_many, ldap_search
+from arkos.messages import Notification, NotificationThread
+from arkos.utilities import b, errors, shell, lazy_import
+
+ldap = lazy_import("ldap")
+
+# Attributes read from LDAP to build Group objects
+GROUP_ATTRS = ["cn", "gidNumber", "memberUid"]
+
+# Columns of group CSV files
+CSV_FIELDS = ["name", "gid", "users"]
+
+GROUP_FILE = "/etc/group"
+
+_index = {"current": None, "next": None}
+_index_lock = threading.Lock()
 
 
 class Group:
@@ -48,6 +64,14 @@ class Group:
             raise errors.InvalidConfigError(emsg)
         except ldap.NO_SUCH_OBJECT:
             pass
+        ldif = ldap.modlist.addModlist(self._ldif())
+        signals.emit("groups", "pre_add", self)
+        conns.LDAP.add_s(self.ldap_id, ldif)
+        _invalidate(self.ldap_id, [self.gid])
+        signals.emit("groups", "post_add", self)
+
+    def _ldif(self):
+        """Build the LDAP attributes of a new group."""
         ldif = {
             "objectClass": [b"posixGroup", b"top"],
             "cn": [b(self.name)],
@@ -55,10 +79,7 @@ class Group:
         }
         if self.users:
             ldif["memberUid"] = [b(u) for u in self.users]
-        ldif = ldap.modlist.addModlist(ldif)
-        signals.emit("groups", "pre_add", self)
-        conns.LDAP.add_s(self.ldap_id, ldif)
-        signals.emit("groups", "post_add", self)
+        return ldif
 
     def update(self):
         """Update a group object in LDAP. Change params on the object first."""
@@ -73,12 +94,14 @@ class Group:
             ignore_oldexistent=1)
         signals.emit("groups", "pre_update", self)
         conns.LDAP.modify_s(self.ldap_id, ldif)
+        _invalidate(self.ldap_id)
         signals.emit("groups", "post_update", self)
 
     def delete(self):
         """Delete group."""
         signals.emit("groups", "pre_remove", self)
         conns.LDAP.delete_s(self.ldap_id)
+        _invalidate(self.ldap_id)
         signals.emit("groups", "post_remove", self)
 
     @property
@@ -116,9 +139,9 @@ class SystemGroup:
         """Add group."""
         shell("groupadd {0}".format(self.name))
         self.update()
-        for x in grp.getgrall():
-            if x.gr_name == self.name:
-                self.gid = x.gr_gid
+        g = get_system(self.name)
+        if g:
+            self.gid = g.gid
 
     def update(self):
         """Update group members."""
@@ -139,23 +162,199 @@ def get(gid=None, name=None):
     :rtype: Group or list thereof
     """
     r = []
-    qry = "ou=groups,{0}".format(config.get("general", "ldap_rootdn"))
-    search = conns.LDAP.search_s(qry, ldap.SCOPE_SUBTREE,
-                                 "(objectClass=posixGroup)", None)
+    rootdn = config.get("general", "ldap_rootdn")
+    if gid is not None:
+        g = storage.ldap_cache.find("groups", lambda x: x.gid == gid)
+    elif name:
+        g = storage.ldap_cache.get(
+            "groups", "cn={0},ou=groups,{1}".format(name, rootdn))
+    else:
+        g = storage.ldap_cache.get_all("groups")
+    if g is not None:
+        return g
+    qry = "ou=groups,{0}".format(rootdn)
+    search = ldap_search(conns.LDAP, qry, ldap.SCOPE_SUBTREE,
+                         "(objectClass=posixGroup)", GROUP_ATTRS)
     for x in search:
         for y in x[1]:
-            if type(x[1][y]) == list and len(x[1][y]) == 1 \
+            if isinstance(x[1][y], list) and len(x[1][y]) == 1 \
                     and y != "memberUid":
                 x[1][y] = x[1][y][0]
         g = Group(x[1]["cn"].decode(), int(x[1]["gidNumber"]),
                   [z.decode() for z in x[1].get("memberUid", [])],
                   x[0].split("ou=groups,")[1])
-        if g.gid == gid:
-            return g
-        elif name and g.name == name:
+        if g.gid == gid or (name and g.name == name):
+            storage.ldap_cache.set("groups", g.ldap_id, g)
             return g
         r.append(g)
-    return r if gid is None and name is None else None
+    if gid is None and name is None:
+        storage.ldap_cache.set_all("groups", {x.ldap_id: x for x in r})
+        return r
+    return None
+
+
+def bulk_add(entries, nthread=NotificationThread()):
+    """
+    Add many groups to LDAP at once.
+
+    Entries are dicts as returned by ``read_entries``. gidNumbers are
+    allocated for all entries in one pass, and the adds are pipelined over
+    a single LDAP connection. Entries that cannot be added are skipped and
+    reported, without stopping the others.
+
+    :param list entries: group entries to add
+    :param NotificationThread nthread: notification thread to use
+    :returns: tuple of list of added Groups and dict of failed names to errors
+    """
+    nthread.title = "Importing groups"
+    rootdn = config.get("general", "ldap_rootdn")
+    existing = get()
+    names = set(x.name for x in existing)
+    taken = set(x.gid for x in existing)
+    next_gid = max([get_next_gid()] + [x + 1 for x in taken])
+    failed, by_dn = {}, {}
+    for x in entries:
+        name = x.get("name")
+        if not name:
+            continue
+        elif name in names:
+            failed[name] = "A group named {0} already exists".format(name)
+            continue
+        try:
+            gid = int(x.get("gid") or 0)
+        except ValueError:
+            failed[name] = "Invalid group ID: {0}".format(x["gid"])
+            continue
+        if gid in taken:
+            failed[name] = "Group ID {0} is already in use".format(gid)
+            continue
+        elif not gid:
+            while next_gid in taken:
+                next_gid += 1
+            gid = next_gid
+        names.add(name)
+        taken.add(gid)
+        g = Group(name, gid, x.get("users") or [], rootdn)
+        by_dn[g.ldap_id] = g
+
+    msg = "Adding {0} groups...".format(len(by_dn))
+    nthread.update(Notification("info", "Groups", msg))
+    adds = []
+    for g in by_dn.values():
+        signals.emit("groups", "pre_add", g)
+        adds.append((g.ldap_id, ldap.modlist.addModlist(g._ldif())))
+    added = []
+    for i, (dn, e) in enumerate(ldap_add_many(conns.LDAP, adds), start=1):
+        g = by_dn[dn]
+        if e:
+            info = e.args[0] if e.args and isinstance(e.args[0], dict) \
+                else {}
+            failed[g.name] = info.get("desc", str(e))
+        else:
+            added.append(g)
+        if not i % 100 or i == len(adds):
+            msg = "Added {0} of {1} groups".format(i, len(adds))
+            nthread.update(Notification("info", "Groups", msg))
+    _invalidate(gids=[g.gid for g in added])
+
+    for g in added:
+        signals.emit("groups", "post_add", g)
+    msg = "{0} groups added, {1} failed".format(len(added), len(failed))
+    nthread.complete(Notification("success", "Groups", msg))
+    return (added, failed)
+
+
+def read_entries(f, fmt="csv"):
+    """
+    Read group entries to import from a CSV or LDIF file.
+
+    CSV files have a header row naming the ``CSV_FIELDS`` columns used.
+    Members are separated by spaces. LDIF files hold ``posixGroup``
+    entries.
+
+    :param file f: file object opened in text mode
+    :param str fmt: ``csv`` or ``ldif``
+    :returns: list of group entry dicts
+    """
+    entries = []
+    if fmt == "ldif":
+        from ldif import LDIFRecordList
+        records = LDIFRecordList(f)
+        records.parse()
+        for dn, attrs in records.all_records:
+            attrs = {x.lower(): [y.decode() for y in attrs[x]]
+                     for x in attrs}
+            if "posixgroup" not in \
+                    [x.lower() for x in attrs.get("objectclass", [])]:
+                continue
+            entries.append({
+                "name": attrs["cn"][0],
+                "gid": attrs.get("gidnumber", [0])[0],
+                "users": attrs.get("memberuid", [])
+            })
+    elif fmt == "csv":
+        for row in csv.DictReader(f):
+            entries.append({
+                "name": row.get("name"),
+                "gid": row.get("gid") or 0,
+                "users": (row.get("users") or "").split()
+            })
+    else:
+        raise errors.InvalidConfigError(
+            "Unknown import format: {0}".format(fmt))
+    return entries
+
+
+def write_entries(f, fmt="csv"):
+    """
+    Write all LDAP groups to a CSV or LDIF file.
+
+    :param file f: file object opened in text mode
+    :param str fmt: ``csv`` or ``ldif``
+    :returns: number of groups written
+    """
+    count = 0
+    if fmt == "ldif":
+        from ldif import LDIFWriter
+        writer = LDIFWriter(f)
+        rootdn = config.get("general", "ldap_rootdn")
+        for dn, attrs in ldap_search(
+                conns.LDAP, "ou=groups," + rootdn, ldap.SCOPE_SUBTREE,
+                "(objectClass=posixGroup)", GROUP_ATTRS + ["objectClass"]):
+            writer.unparse(dn, attrs)
+            count += 1
+    elif fmt == "csv":
+        writer = csv.DictWriter(f, CSV_FIELDS)
+        writer.writeheader()
+        for x in get():
+            writer.writerow(
+                {"name": x.name, "gid": x.gid, "users": " ".join(x.users)})
+            count += 1
+    else:
+        raise errors.InvalidConfigError(
+            "Unknown export format: {0}".format(fmt))
+    return count
+
+
+def _invalidate(dn=None, gids=[]):
+    """
+    Drop cached groups after a change to LDAP.
+
+    Users are dropped as well, as their admin flag comes from the admins
+    group. The system group index is rebuilt on next use, as it lists LDAP
+    groups too.
+
+    :param str dn: DN of the changed group (default all groups)
+    :param list gids: GIDs of added groups
+    """
+    storage.ldap_cache.invalidate("groups", dn)
+    storage.ldap_cache.invalidate("users")
+    with _index_lock:
+        _index["current"] = None
+        if _index["next"] and gids:
+            key, next_gid = _index["next"]
+            _index["next"] = (key, max([next_gid] + [int(x) + 1
+                                                     for x in gids]))
 
 
 def get_system(gid=None):
@@ -166,15 +365,88 @@ def get_system(gid=None):
     :returns: SystemGroup(s)
     :rtype: SystemGroup or list thereof
     """
-    r = []
-    for x in grp.getgrall():
-        g = SystemGroup(name=x.gr_name, gid=x.gr_gid, users=x.gr_mem)
-        if gid == g.name:
-            return g
-        r.append(g)
-    return r if not gid else None
+    index = _get_index()
+    if gid:
+        x = index["by_name"].get(gid)
+        return SystemGroup(x[0], x[1], list(x[2])) if x else None
+    return [SystemGroup(x[0], x[1], list(x[2])) for x in index["groups"]]
+
+
+def get_memberships():
+    """
+    Get the system groups each user is a member of.
+
+    The returned dict is shared, and must not be modified.
+
+    :returns: dict of usernames to lists of group names
+    """
+    return _get_index()["members"]
 
 
 def get_next_gid():
-    """Get the next available group ID number in sequence."""
-    return max([x.gid for x in get_system()]) + 1
+    """
+    Get the next available group ID number in sequence.
+
+    The highest GID of system and LDAP groups is looked up once, as the
+    system group database may not list new LDAP groups until nslcd
+    refreshes its cache. It is then kept current as groups are added here,
+    and looked up again when ``GROUP_FILE`` changes.
+    """
+    key = _file_key()
+    with _index_lock:
+        cached = _index["next"]
+        if cached and key is not None and cached[0] == key:
+            return cached[1]
+    gids = []
+    try:
+        rootdn = config.get("general", "ldap_rootdn")
+        for dn, attrs in ldap_search(
+                conns.LDAP, "ou=groups," + rootdn, ldap.SCOPE_SUBTREE,
+                "(objectClass=posixGroup)", ["gidNumber"]):
+            gids += [int(x) for x in attrs.get("gidNumber", [])]
+    except ldap.LDAPError as e:
+        logger.warning("Roles", "Could not read LDAP group IDs: {0}"
+                       .format(e))
+    next_gid = max([_get_index()["next_gid"]] + [x + 1 for x in gids])
+    with _index_lock:
+        _index["next"] = (key, next_gid)
+    return next_gid
+
+
+def _file_key():
+    """Return a key that changes whenever ``GROUP_FILE`` does."""
+    try:
+        st = os.stat(GROUP_FILE)
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
+
+def _get_index():
+    """
+    Get the index of system groups, rebuilding it if it is out of date.
+
+    The index is built in one pass over the group database, and reused
+    until ``GROUP_FILE`` is replaced or modified, or LDAP groups change.
+
+    :returns: dict with group tuples, lookups by name and user, next GID
+    """
+    key = _file_key()
+    with _index_lock:
+        index = _index["current"]
+        if index and key is not None and key == index["key"]:
+            return index
+        groups, by_name, members = [], {}, {}
+        for x in grp.getgrall():
+            g = (x.gr_name, x.gr_gid, tuple(x.gr_mem))
+            groups.append(g)
+            by_name.setdefault(x.gr_name, g)
+            for y in x.gr_mem:
+                members.setdefault(y, []).append(x.gr_name)
+        index = {
+            "key": key, "groups": groups, "by_name": by_name,
+            "members": members,
+            "next_gid": max([x[1] for x in groups] + [0]) + 1
+        }
+        _index["current"] = index
+        return index
@@ -7,15 +7,35 @@ Written by Jacob Cook
 Licensed under GPLv3, see LICENSE.md
 """
 
-import fcntl
-import netifaces
+import collections
+import ipaddress
+import math
 import os
 import psutil
 import socket
-import struct
+import threading
+import time
 
 from arkos import signals
-from arkos.utilities import errors, shell, netmask_to_cidr
+from arkos.utilities import errors, shell
+
+IFF_UP = 0x1
+
+# Seconds interface data is reused for
+INTERFACE_CACHE_TTL = 2
+
+# Seconds over which interface rates are smoothed
+RATE_SMOOTHING = 5
+
+# Number of rate samples kept per interface
+RATE_HISTORY = 60
+
+# Largest increase of a byte counter between samples taken as a wraparound
+COUNTER_WRAP_MARGIN = 2 ** 31
+
+_cache = {"data": None, "time": 0.0, "lock": threading.Lock()}
+_rates = {}
+_rates_lock = threading.Lock()
 
 
 class Connection:
@@ -140,6 +160,56 @@ class Connection:
         return self.as_dict
 
 
+class RateTracker:
+    """
+    Class to track the throughput of a network interface.
+
+    Rates are computed from successive byte counter samples and smoothed
+    with an exponentially weighted moving average over
+    ``RATE_SMOOTHING`` seconds. The unsmoothed rates of the last
+    ``RATE_HISTORY`` samples are kept as well.
+    """
+
+    def __init__(self):
+        """Initialize the rate tracker."""
+        self.last = None
+        self.rx_rate = None
+        self.tx_rate = None
+        self.history = collections.deque(maxlen=RATE_HISTORY)
+
+    def update(self, timestamp, rx, tx):
+        """
+        Add a byte counter sample.
+
+        :param float timestamp: Time of the sample
+        :param int rx: Number of bytes received
+        :param int tx: Number of bytes sent
+        """
+        if self.last:
+            delta = timestamp - self.last[0]
+            if delta <= 0:
+                return
+            rx_rate = _counter_delta(self.last[1], rx) / delta
+            tx_rate = _counter_delta(self.last[2], tx) / delta
+            self.history.append((timestamp, rx_rate, tx_rate))
+            if self.rx_rate is None:
+                self.rx_rate, self.tx_rate = rx_rate, tx_rate
+            else:
+                alpha = 1 - math.exp(-delta / RATE_SMOOTHING)
+                self.rx_rate += alpha * (rx_rate - self.rx_rate)
+                self.tx_rate += alpha * (tx_rate - self.tx_rate)
+        self.last = (timestamp, rx, tx)
+
+    @property
+    def as_dict(self):
+        """Return rates as dict."""
+        return {
+            "rx_rate": self.rx_rate,
+            "tx_rate": self.tx_rate,
+            "history": list(self.history)
+        }
+
+
 class Interface:
     """Class to represent a network connection."""
 
@@ -160,6 +230,8 @@ class Interface:
         self.ip = ip
         self.rx = rx
         self.tx = tx
+        self.rx_rate = None
+        self.tx_rate = None
 
     def bring_up(self):
         """Bring interface up."""
@@ -186,7 +258,9 @@ class Interface:
             "up": self.up,
             "ip": self.ip,
             "rx": self.rx,
-            "tx": self.tx
+            "tx": self.tx,
+            "rx_rate": self.rx_rate,
+            "tx_rate": self.tx_rate
         }
 
     @property
@@ -231,46 +305,23 @@ def get_interfaces(id=None):
     """
     Get list of network interfaces.
 
+    Interface data is read in a single pass and cached for
+    ``INTERFACE_CACHE_TTL`` seconds.
+
     :param str id: Filter by network interface name
     :returns: Interface(s)
     :rtype: Interface or list thereof
     """
     ifaces = []
-    for x in netifaces.interfaces():
-        # Classify the interface type
-        if x[:-1] in ["ppp", "wvdial"]:
-            itype = "ppp"
-        elif x[:2] in ["wl", "ra", "wi", "at"]:
-            itype = "wireless"
-        elif x[:2].lower() == "br":
-            itype = "bridge"
-        elif x[:2].lower() == "tu":
-            itype = "tunnel"
-        elif x.lower() == "lo":
-            itype = "loopback"
-        elif x[:2] in ["et", "en"]:
-            itype = "ethernet"
-        else:
-            itype = "unknown"
-        i = Interface(id=x, itype=itype)
-        # Get the total bytes in and out for this interface
-        data = psutil.net_io_counters(pernic=True)
-        data = data[x] if type(data) == dict else data
-        i.rx, i.tx = data[0], data[1]
-        addrs = netifaces.ifaddresses(x)
-        i.ip = addrs.get(netifaces.AF_INET, [])
-        i.ip6 = addrs.get(netifaces.AF_INET6, [])
+    for x, data in _read_interfaces().items():
+        i = Interface(id=x, itype=_interface_type(x), up=data["up"],
+                      ip=data["ip"], rx=data["rx"], tx=data["tx"])
+        i.ip6 = data["ip6"]
         if not i.ip and not i.ip6:
-            i.up = False
             continue
-        # Determine if the interface is up or not
-        s = socket.socket(socket.AF_INET if i.ip else socket.AF_INET6,
-                          socket.SOCK_DGRAM)
-        r = fcntl.ioctl(s.fileno(), 0x8913, i.id + ("\0"*256))
-        flags, = struct.unpack("H", r[16:18])
-        up = flags & 1
-        s.close()
-        i.up = up == 1
+        rates = get_rates(x)
+        if rates:
+            i.rx_rate, i.tx_rate = rates.rx_rate, rates.tx_rate
         if id == i.id:
             return i
         ifaces.append(i)
@@ -286,11 +337,129 @@ def get_active_ranges():
     ranges = []
     for x in get_interfaces():
         for y in x.ip:
-            if "127.0.0.1" in y["addr"] or "0.0.0.0" in y["addr"]:
+            # Point-to-point links may have no netmask
+            if not y["netmask"]:
+                continue
+            net = ipaddress.ip_interface(
+                "{0}/{1}".format(y["addr"], y["netmask"])).network
+            if net.is_loopback or net.network_address.is_unspecified:
                 continue
-            ri = y["addr"].split(".")
-            ri[3] = "0"
-            ri = ".".join(ri)
-            y = ri + "/" + str(netmask_to_cidr(y["netmask"]))
-            ranges.append(y)
+            if str(net) not in ranges:
+                ranges.append(str(net))
     return ranges
+
+
+def _interface_type(name):
+    """Classify the interface type by its name."""
+    if name[:-1] in ["ppp", "wvdial"]:
+        return "ppp"
+    elif name[:2] in ["wl", "ra", "wi", "at"]:
+        return "wireless"
+    elif name[:2].lower() == "br":
+        return "bridge"
+    elif name[:2].lower() == "tu":
+        return "tunnel"
+    elif name.lower() == "lo":
+        return "loopback"
+    elif name[:2] in ["et", "en"]:
+        return "ethernet"
+    return "unknown"
+
+
+def _read_interfaces():
+    """
+    Read counters, flags and addresses of all network interfaces.
+
+    Counters come from one read of ``/proc/net/dev``, addresses from one
+    ``getifaddrs`` call and flags from sysfs.
+
+    :returns: dict of interface names to data dicts
+    """
+    with _cache["lock"]:
+        if _cache["data"] is not None \
+                and time.time() - _cache["time"] < INTERFACE_CACHE_TTL:
+            return _cache["data"]
+        data = collections.OrderedDict()
+        for name, (rx, tx) in _read_counters().items():
+            data[name] = {"rx": rx, "tx": tx, "up": False, "ip": [],
+                          "ip6": []}
+        for name, addrs in psutil.net_if_addrs().items():
+            if name not in data:
+                continue
+            for x in addrs:
+                addr = {"addr": x.address, "netmask": x.netmask}
+                if x.broadcast:
+                    addr["broadcast"] = x.broadcast
+                if x.family == socket.AF_INET:
+                    data[name]["ip"].append(addr)
+                elif x.family == socket.AF_INET6:
+                    data[name]["ip6"].append(addr)
+        for name in data:
+            try:
+                with open("/sys/class/net/{0}/flags".format(name), "r") as f:
+                    data[name]["up"] = bool(int(f.read(), 16) & IFF_UP)
+            except (IOError, ValueError):
+                pass
+        _cache["data"], _cache["time"] = data, time.time()
+        return data
+
+
+def _read_counters():
+    """
+    Read byte counters of all network interfaces from ``/proc/net/dev``.
+
+    :returns: dict of interface names to (rx, tx) tuples
+    """
+    data = collections.OrderedDict()
+    with open("/proc/net/dev", "r") as f:
+        for line in f.readlines()[2:]:
+            name, counters = line.split(":", 1)
+            counters = counters.split()
+            data[name.strip()] = (int(counters[0]), int(counters[8]))
+    return data
+
+
+def sample_rates(timestamp=None):
+    """
+    Sample byte counters of all interfaces and update their rates.
+
+    This is called periodically by the statistics sampler.
+
+    :param float timestamp: Time of the sample (default now)
+    """
+    timestamp = timestamp or time.time()
+    counters = _read_counters()
+    with _rates_lock:
+        for x in [x for x in _rates if x not in counters]:
+            del _rates[x]
+        for x, (rx, tx) in counters.items():
+            if x not in _rates:
+                _rates[x] = RateTracker()
+            _rates[x].update(timestamp, rx, tx)
+
+
+def get_rates(id=None):
+    """
+    Get current throughput of network interfaces.
+
+    :param str id: Filter by network interface name
+    :returns: RateTracker, or dict of interface names to RateTrackers
+    """
+    with _rates_lock:
+        return _rates.get(id) if id else dict(_rates)
+
+
+def _counter_delta(old, new):
+    """
+    Get the increase of a byte counter, allowing for wraparound.
+
+    32-bit kernels wrap counters at 4 GiB. A counter going down is only
+    taken as wrapped if it was close enough to the limit; otherwise it was
+    reset, e.g. by the interface being recreated, and 0 is returned.
+    """
+    if new >= old:
+        return new - old
+    for limit in [2 ** 32, 2 ** 64]:
+        if old < limit and limit - old + new <= COUNTER_WRAP_MARGIN:
+            return limit - old + new
+    return 0
@@ -0,0 +1,229 @@
+"""
+Functions for sampling resource usage of arkOS-managed services.
+
+arkOS Core
+(c) 2016 CitizenWeb
+Written by Jacob Cook
+Licensed under GPLv3, see LICENSE.md
+"""
+
+import collections
+import os
+import threading
+import time
+
+import psutil
+
+from arkos import conns, storage
+from arkos.system import services
+from arkos.utilities import lazy_import
+
+dbus = lazy_import("dbus")
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+# Number of samples kept per unit
+HISTORY_SIZE = 120
+
+# systemd reports unavailable accounting values as the maximum uint64
+UNSET = 2 ** 64 - 1
+
+Sample = collections.namedtuple(
+    "Sample", ["time", "cpu", "memory", "io_read", "io_write"])
+
+_history = {}
+_lock = threading.Lock()
+
+
+def managed_units():
+    """
+    Get the services managed by arkOS.
+
+    These are the systemd services of installed apps, plus all Supervisor
+    programs, as arkOS manages those itself.
+
+    :returns: list of Services
+    """
+    names = set()
+    for app in storage.applications.values():
+        if not app.installed:
+            continue
+        for x in getattr(app, "services", []):
+            if x.get("type") == "system" and x.get("binary"):
+                names.add(x["binary"])
+    svcs = [services.get(x) for x in sorted(names)]
+    svcs = [x for x in svcs if x and x.stype != "supervisor"]
+    return svcs + [x for x in services.get() if x.stype == "supervisor"]
+
+
+def sample(svcs=None):
+    """
+    Take a sample of resource usage for a batch of services.
+
+    Systemd services are read from their cgroup v2 accounting files, or
+    from systemd over D-Bus where those are not available. Supervisor
+    programs are read from their main process.
+
+    :param list svcs: Services to sample (default all arkOS-managed units)
+    :returns: dict of service names to current usage and rates
+    """
+    svcs = managed_units() if svcs is None else svcs
+    pids = {}
+    if any(x.stype == "supervisor" for x in svcs):
+        pids = {x["name"]: x["pid"]
+                for x in conns.Supervisor.getAllProcessInfo()}
+    now = time.time()
+    results = {}
+    for x in svcs:
+        if x.stype == "supervisor":
+            data = _read_process(pids.get(x.name))
+        else:
+            data = _read_cgroup(x.sfname) or _read_dbus(x.sfname)
+        if not data:
+            continue
+        with _lock:
+            if x.name not in _history:
+                _history[x.name] = collections.deque(maxlen=HISTORY_SIZE)
+            _history[x.name].append(Sample(now, *data))
+            results[x.name] = _rates(x.name, _history[x.name])
+    return results
+
+
+def get(id=None):
+    """
+    Get current usage and rates from the last samples taken.
+
+    Samples are taken by the statistics sampler, which is started on first
+    use.
+
+    :param str id: Service name to fetch
+    :returns: usage dict, or dict of service names to usage dicts
+    """
+    from arkos.system import stats
+    if not stats.sampler_running():
+        stats.start_sampler()
+    with _lock:
+        if id:
+            samples = _history.get(id)
+            return _rates(id, samples) if samples else None
+        return {x: _rates(x, y) for x, y in _history.items() if y}
+
+
+def get_history(id):
+    """
+    Get all stored samples for a service, oldest first.
+
+    :param str id: Service name
+    :returns: list of Samples
+    """
+    with _lock:
+        return list(_history.get(id, []))
+
+
+def _rates(id, samples):
+    """Compute usage rates from the two most recent samples."""
+    last = samples[-1]
+    data = {
+        "id": id,
+        "time": last.time,
+        "memory": last.memory,
+        "cpu": None,
+        "io_read": None,
+        "io_write": None
+    }
+    if len(samples) < 2:
+        return data
+    prev = samples[-2]
+    delta = last.time - prev.time
+    if delta <= 0:
+        return data
+    if last.cpu is not None and prev.cpu is not None:
+        data["cpu"] = round(
+            max(last.cpu - prev.cpu, 0) / (delta * 1e9) * 100, 1)
+    for x in ["io_read", "io_write"]:
+        if getattr(last, x) is not None and getattr(prev, x) is not None:
+            data[x] = max(getattr(last, x) - getattr(prev, x), 0) / delta
+    return data
+
+
+def _read_cgroup(unit):
+    """
+    Read resource usage of a systemd unit from its cgroup v2 files.
+
+    :param str unit: Unit file name
+    :returns: tuple of CPU ns, memory bytes, IO read and write bytes
+    """
+    path = os.path.join(CGROUP_ROOT, "system.slice", unit)
+    if not os.path.exists(os.path.join(path, "cpu.stat")):
+        return None
+    cpu = memory = None
+    io_read = io_write = 0
+    with open(os.path.join(path, "cpu.stat"), "r") as f:
+        for line in f:
+            if line.startswith("usage_usec "):
+                cpu = int(line.split()[1]) * 1000
+    if os.path.exists(os.path.join(path, "memory.current")):
+        with open(os.path.join(path, "memory.current"), "r") as f:
+            memory = int(f.read())
+    if os.path.exists(os.path.join(path, "io.stat")):
+        with open(os.path.join(path, "io.stat"), "r") as f:
+            for line in f:
+                for x in line.split()[1:]:
+                    key, value = x.split("=", 1)
+                    if key == "rbytes":
+                        io_read += int(value)
+                    elif key == "wbytes":
+                        io_write += int(value)
+    return (cpu, memory, io_read, io_write)
+
+
+def _read_dbus(unit):
+    """
+    Read resource usage of a systemd unit from its D-Bus properties.
+
+    :param str unit: Unit file name
+    :returns: tuple of CPU ns, memory bytes, IO read and write bytes
+    """
+    try:
+        path = conns.SystemD.GetUnit(unit)
+        data = conns.SystemDConnect(path, "org.freedesktop.DBus.Properties")
+        data = data.GetAll("org.freedesktop.systemd1.Service")
+    except dbus.exceptions.DBusException:
+        return None
+    values = []
+    for x in ["CPUUsageNSec", "MemoryCurrent", "IOReadBytes", "IOWriteBytes"]:
+        value = data.get(x)
+        values.append(int(value) if value is not None and value != UNSET
+                      else None)
+    return tuple(values)
+
+
+def _read_process(pid):
+    """
+    Read resource usage of a process and its children.
+
+    :param int pid: Process ID
+    :returns: tuple of CPU ns, memory bytes, IO read and write bytes
+    """
+    if not pid:
+        return None
+    try:
+        proc = psutil.Process(pid)
+        procs = [proc] + proc.children(recursive=True)
+    except psutil.Error:
+        return None
+    cpu = memory = io_read = io_write = 0
+    for x in procs:
+        try:
+            times = x.cpu_times()
+            cpu += int((times.user + times.system) * 1e9)
+            memory += x.memory_info().rss
+        except psutil.Error:
+            continue
+        try:
+            io = x.io_counters()
+            io_read += io.read_bytes
+            io_write += io.write_bytes
+        except (psutil.Error, AttributeError):
+            pass
+    return (cpu, memory, io_read, io_write)
@@ -7,14 +7,56 @@ Written by Jacob Cook
 Licensed under GPLv3, see LICENSE.md
 """
 
+import collections
 import configparser
+import datetime
+import json
 import os
+import re
+import shlex
+import subprocess
+import threading
 import time
 
-from dbus.exceptions import DBusException
+from arkos import config, conns, signals
+from arkos.utilities import shell, lazy_import
 
-from arkos import conns, signals
-from arkos.utilities import shell
+dbus = lazy_import("dbus")
+
+UNIT_PATH = "/org/freedesktop/systemd1/unit/"
+
+# Supervisor XML-RPC fault codes
+SUPERVISOR_ALREADY_STARTED = 60
+SUPERVISOR_NOT_RUNNING = 70
+
+# systemd manager methods and resulting states for bulk actions
+BULK_ACTIONS = {
+    "start": ("StartUnit", "running"),
+    "stop": ("StopUnit", "stopped"),
+    "restart": ("ReloadOrRestartUnit", "running")
+}
+
+# Resource limits that can be set on services
+LIMIT_KEYS = ["CPUWeight", "MemoryMax", "TasksMax", "IOWeight"]
+LIMITS_DIR = "/etc/systemd/system/{0}.d"
+LIMITS_FILE = "50-arkos-limits.conf"
+
+# Bytes of Supervisor log to read per request
+LOG_CHUNK_SIZE = 65536
+
+# Seconds a successful Supervisor ping is trusted for
+SUPERVISOR_PING_TTL = 5
+
+# Known systemd service units by name, kept current by systemd signals
+# once a running main loop has been registered with watch_signals()
+_cache = {"units": None, "time": 0.0, "bus": None, "signals": False}
+_cache_lock = threading.RLock()
+
+# Events for systemd jobs being waited on, and results of finished jobs
+_jobs = {"waiting": {}, "done": collections.OrderedDict()}
+_jobs_lock = threading.Lock()
+
+_supervisor = {"checked": 0.0}
 
 
 class ActionError(Exception):
@@ -57,22 +99,28 @@ class Service:
         else:
             return "{0}.service".format(self.name)
 
-    def add(self, enable=True):
-        """Add a new Supervisor service."""
+    def add(self, enable=True, limits={}):
+        """
+        Add a new Supervisor service.
+
+        :param bool enable: Enable the service on boot
+        :param dict limits: Resource limits (see ``set_limits``)
+        """
         signals.emit("services", "pre_add", self)
-        title = "program:{0}".format(self.name)
-        c = configparser.RawConfigParser()
-        c.add_section(title)
-        for x in self.cfg:
-            c.set(title, x, self.cfg[x])
-        with open(os.path.join("/etc/supervisor.d", self.sfname), "w") as f:
-            c.write(f)
+        if limits:
+            self.cfg = _wrap_command(self.cfg, limits)
+        self._write_supervisor_config(
+            os.path.join("/etc/supervisor.d", self.sfname))
         if enable:
             self.enable()
         signals.emit("services", "post_add", self)
 
-    def start(self):
-        """Start service."""
+    def start(self, timeout=10):
+        """
+        Start service.
+
+        :param int timeout: Seconds to wait for the service to start
+        """
         signals.emit("services", "pre_start", self)
         if self.stype == "supervisor":
             supervisor_ping()
@@ -84,36 +132,15 @@ class Service:
                     "svc", "The service failed to start. Please check "
                     "`sudo arkosctl svc status {0}`".format(self.name))
         else:
-            # Send the start command to systemd
-            try:
-                path = conns.SystemD.LoadUnit(self.sfname)
-                conns.SystemD.StartUnit(self.sfname, "replace")
-            except DBusException as e:
-                raise ActionError("dbus", str(e))
-            timeout = 0
-            time.sleep(1)
-            # Wait for the service to start, raise exception if it fails
-            while timeout < 10:
-                data = conns.SystemDConnect(
-                    path, "org.freedesktop.DBus.Properties")
-                data = data.GetAll("org.freedesktop.systemd1.Unit")
-                if str(data["ActiveState"]) == "failed":
-                    raise ActionError(
-                        "svc", "The service failed to start. Please check "
-                        "`sudo arkosctl svc status {0}`".format(self.name))
-                elif str(data["ActiveState"]) == "active":
-                    self.state = "running"
-                    signals.emit("services", "post_start", self)
-                    break
-                timeout += 1
-                time.sleep(1)
-            else:
-                raise ActionError("svc", "The service start timed out. "
-                                  "Please check `sudo arkosctl svc status {0}`"
-                                  .format(self.sfname))
+            self._run_job("StartUnit", "start", "running", timeout)
+            signals.emit("services", "post_start", self)
+
+    def stop(self, timeout=10):
+        """
+        Stop service.
 
-    def stop(self):
-        """Stop service."""
+        :param int timeout: Seconds to wait for the service to stop
+        """
         signals.emit("services", "pre_stop", self)
         if self.stype == "supervisor":
             supervisor_ping()
@@ -121,32 +148,16 @@ class Service:
             signals.emit("services", "post_stop", self)
             self.state = "stopped"
         else:
-            # Send the stop command to systemd
-            try:
-                path = conns.SystemD.LoadUnit(self.sfname)
-                conns.SystemD.StopUnit(self.sfname, "replace")
-            except DBusException as e:
-                raise ActionError("dbus", str(e))
-            timeout = 0
-            time.sleep(1)
-            # Wait for the service to stop, raise exception if it fails
-            while timeout < 10:
-                data = conns.SystemDConnect(
-                    path, "org.freedesktop.DBus.Properties")
-                data = data.GetAll("org.freedesktop.systemd1.Unit")
-                if str(data["ActiveState"]) in ["inactive", "failed"]:
-                    self.state = "stopped"
-                    signals.emit("services", "post_stop", self)
-                    break
-                timeout + 1
-                time.sleep(1)
-            else:
-                raise ActionError("svc", "The service stop timed out. "
-                                  "Please check `sudo arkosctl svc status {0}`"
-                                  .format(self.sfname))
+            self._run_job("StopUnit", "stop", "stopped", timeout)
+            signals.emit("services", "post_stop", self)
 
-    def restart(self, real=False):
-        """Restart service."""
+    def restart(self, real=False, timeout=10):
+        """
+        Restart service.
+
+        :param bool real: Restart even if the service supports reloading
+        :param int timeout: Seconds to wait for the service to restart
+        """
         signals.emit("services", "pre_restart", self)
         if self.stype == "supervisor":
             supervisor_ping()
@@ -154,36 +165,103 @@ class Service:
             conns.Supervisor.startProcess(self.name)
             signals.emit("services", "post_restart", self)
         else:
-            # Send the restart command to systemd
-            try:
-                path = conns.SystemD.LoadUnit(self.sfname)
-                if real:
-                    conns.SystemD.RestartUnit(self.sfname, "replace")
-                else:
-                    conns.SystemD.ReloadOrRestartUnit(self.sfname, "replace")
-            except DBusException as e:
-                raise ActionError("dbus", str(e))
-            timeout = 0
-            time.sleep(1)
-            # Wait for the service to restart, raise exception if it fails
-            while timeout < 10:
-                data = conns.SystemDConnect(
-                    path, "org.freedesktop.DBus.Properties")
-                data = data.GetAll("org.freedesktop.systemd1.Unit")
-                if str(data["ActiveState"]) == "failed":
-                    raise ActionError(
-                        "svc", "The service failed to restart. Please check "
-                        "`sudo arkosctl svc status {0}`".format(self.name))
-                elif str(data["ActiveState"]) == "active":
-                    self.state = "running"
-                    signals.emit("services", "post_restart", self)
-                    break
-                timeout + 1
-                time.sleep(1)
+            method = "RestartUnit" if real else "ReloadOrRestartUnit"
+            self._run_job(method, "restart", "running", timeout)
+            signals.emit("services", "post_restart", self)
+
+    def _run_job(self, method, action, state, timeout):
+        """
+        Queue a systemd job for this unit and wait until it is finished.
+
+        :param str method: systemd manager method queueing the job
+        :param str action: action name for error messages
+        :param str state: service state expected once the job succeeds
+        :param int timeout: Seconds to wait for the job to finish
+        """
+        job = self._queue_job(method)
+        self._finish_job(job, action, state, time.time() + timeout)
+
+    def _queue_job(self, method):
+        """
+        Queue a systemd job for this unit without waiting for it.
+
+        :param str method: systemd manager method queueing the job
+        :returns: tuple of unit path, job path and whether signals are used
+        """
+        try:
+            path = conns.SystemD.LoadUnit(self.sfname)
+            watching = _subscribe()
+            job = str(getattr(conns.SystemD, method)(self.sfname, "replace"))
+        except dbus.exceptions.DBusException as e:
+            raise ActionError("dbus", str(e))
+        return (path, job, watching)
+
+    def _finish_job(self, job, action, state, end):
+        """
+        Wait until a queued systemd job for this unit is finished.
+
+        If signals are watched, systemd signals completion with
+        ``JobRemoved``. Otherwise, or if no signal arrives in time, the job
+        queue is polled, starting at 20 ms and backing off.
+
+        :param tuple job: unit path, job path and signal use from _queue_job
+        :param str action: action name for error messages
+        :param str state: service state expected once the job succeeds
+        :param float end: Time at which to give up waiting
+        """
+        path, job, watching = job
+        timeout = max(end - time.time(), 0)
+        try:
+            result = _wait_job(job, timeout) if watching else None
+            if result:
+                success = result == "done"
             else:
-                raise ActionError("svc", "The service restart timed out. "
-                                  "Please check `sudo arkosctl svc status {0}`"
-                                  .format(self.sfname))
+                # The main loop may have stopped delivering signals
+                result = _poll_job(job, max(end - time.time(), 0))
+                if result:
+                    data = conns.SystemDConnect(
+                        path, "org.freedesktop.DBus.Properties")
+                    active = str(data.Get("org.freedesktop.systemd1.Unit",
+                                          "ActiveState"))
+                    success = active in (["active"] if state == "running"
+                                         else ["inactive", "failed"])
+        except dbus.exceptions.DBusException as e:
+            raise ActionError("dbus", str(e))
+        if not result:
+            raise ActionError("svc", "The service {0} timed out. "
+                              "Please check `sudo arkosctl svc status {1}`"
+                              .format(action, self.sfname))
+        if not success:
+            raise ActionError(
+                "svc", "The service failed to {0}. Please check "
+                "`sudo arkosctl svc status {1}`".format(action, self.name))
+        self.state = state
+        _update_unit(self.name, state=state)
+
+    def iter_log(self, since=None, priority=None, cursor=None,
+                 follow=False, this_boot=False):
+        """
+        Iterate over service log entries, oldest first.
+
+        Systemd services are read from the journal. Entries are read as they
+        are consumed, so large logs are never loaded at once. Each entry
+        carries a cursor that can be passed back in to resume after it.
+
+        Supervisor logs have no timestamps or priorities, so ``since``,
+        ``priority`` and ``this_boot`` are ignored for them, and cursors are
+        byte offsets.
+
+        :param datetime since: Only show entries from this time onwards
+        :param int priority: Only show entries of this syslog level or more
+        :param cursor: Only show entries after the one with this cursor
+        :param bool follow: Keep waiting for new entries
+        :param bool this_boot: Only show entries since the system booted
+        :returns: generator of dicts with time, priority, message and cursor
+        """
+        if self.stype == "supervisor":
+            return _iter_supervisor_log(self.name, cursor or 0, follow)
+        return _iter_journal(self.sfname, since, priority, cursor, follow,
+                             this_boot)
 
     def get_log(self):
         """Get supervisor service logs."""
@@ -204,11 +282,13 @@ class Service:
                 os.rename(os.path.join("/etc/supervisor.d", disfsname),
                           os.path.join("/etc/supervisor.d", self.sfname))
             conns.Supervisor.restart()
+            _supervisor["checked"] = 0.0
         else:
             try:
                 conns.SystemD.EnableUnitFiles([self.sfname], False, True)
-            except DBusException as e:
+            except dbus.exceptions.DBusException as e:
                 raise ActionError("dbus", str(e))
+            _update_unit(self.name, enabled=True)
         self.enabled = True
 
     def disable(self):
@@ -223,8 +303,9 @@ class Service:
         else:
             try:
                 conns.SystemD.DisableUnitFiles([self.sfname], False)
-            except DBusException as e:
+            except dbus.exceptions.DBusException as e:
                 raise ActionError("dbus", str(e))
+            _update_unit(self.name, enabled=False)
         self.enabled = False
 
     def remove(self):
@@ -243,8 +324,81 @@ class Service:
             self.state = "stopped"
             self.enabled = False
             conns.Supervisor.restart()
+            _supervisor["checked"] = 0.0
             signals.emit("services", "post_remove", self)
 
+    def get_limits(self):
+        """
+        Get resource limits set for this service.
+
+        :returns: dict of limits by systemd property name
+        """
+        if self.stype == "supervisor":
+            return _unwrap_command(self.cfg)[2]
+        path = os.path.join(LIMITS_DIR.format(self.sfname), LIMITS_FILE)
+        c = configparser.RawConfigParser()
+        c.optionxform = str
+        c.read(path)
+        return dict(c.items("Service")) if c.has_section("Service") else {}
+
+    def set_limits(self, limits):
+        """
+        Set resource limits for this service, replacing any set before.
+
+        Systemd services get a drop-in unit file, which takes effect on
+        daemon reload. Supervisor programs are run in a transient systemd
+        scope carrying the limits, and are restarted to apply them.
+
+        :param dict limits: Limits by systemd property name (``CPUWeight``,
+            ``MemoryMax``, ``TasksMax`` or ``IOWeight``), empty to remove
+        """
+        for x in limits:
+            if x not in LIMIT_KEYS:
+                raise ActionError(
+                    "svc", "Unknown resource limit: {0}".format(x))
+        signals.emit("services", "pre_limits", self)
+        if self.stype == "supervisor":
+            self.cfg = _wrap_command(self.cfg, limits)
+            name = self.sfname if self.enabled \
+                else "{0}.disabled".format(self.sfname)
+            self._write_supervisor_config(
+                os.path.join("/etc/supervisor.d", name))
+            if self.enabled:
+                supervisor_ping()
+                conns.Supervisor.reloadConfig()
+                if self.state == "running":
+                    conns.Supervisor.stopProcess(self.name)
+                conns.Supervisor.removeProcessGroup(self.name)
+                conns.Supervisor.addProcessGroup(self.name)
+        else:
+            path = LIMITS_DIR.format(self.sfname)
+            if limits:
+                c = configparser.RawConfigParser()
+                c.optionxform = str
+                c.add_section("Service")
+                for x in sorted(limits):
+                    c.set("Service", x, str(limits[x]))
+                if not os.path.exists(path):
+                    os.makedirs(path)
+                with open(os.path.join(path, LIMITS_FILE), "w") as f:
+                    c.write(f, space_around_delimiters=False)
+            elif os.path.exists(os.path.join(path, LIMITS_FILE)):
+                os.unlink(os.path.join(path, LIMITS_FILE))
+            try:
+                conns.SystemD.Reload()
+            except dbus.exceptions.DBusException as e:
+                raise ActionError("dbus", str(e))
+        signals.emit("services", "post_limits", self)
+
+    def _write_supervisor_config(self, path):
+        title = "program:{0}".format(self.name)
+        c = configparser.RawConfigParser()
+        c.add_section(title)
+        for x in self.cfg:
+            c.set(title, x, self.cfg[x])
+        with open(path, "w") as f:
+            c.write(f)
+
     @property
     def as_dict(self):
         """Return service metadata as dict."""
@@ -272,28 +426,289 @@ def get(id=None):
     :returns: Service(s)
     :rtype: Service or list thereof
     """
-    svcs, files = [], {}
-
     if id and id.endswith(".service"):
         id = id.split(".service")[0]
 
+    units = _get_units()
+    if id:
+        if id in units and not id.endswith("@"):
+            return _systemd_service(id, units[id])
+        # If user requests a service with identifier and it's not
+        # running or enabled...
+        if "@" in id and (id.split("@")[0] + "@") in units:
+            return Service(id, "system", "stopped", False)
+        svcs = _get_supervisor(id)
+        return svcs[0] if svcs else None
+
+    svcs = [_systemd_service(x, units[x]) for x in units
+            if not x.endswith("@")]
+    svcs += _get_supervisor()
+    return sorted(svcs, key=lambda s: s.name)
+
+
+def _systemd_service(name, unit):
+    return Service(name, "system", unit["state"], unit["enabled"])
+
+
+def _get_supervisor(id=None):
+    """
+    Get Supervisor services from their config files.
+
+    If ID is specified, only that service's config files are read.
+
+    :param str id: Service ID to fetch
+    :returns: list of Services
+    """
+    if not os.path.exists("/etc/supervisor.d"):
+        os.mkdir("/etc/supervisor.d")
+    if id:
+        files = [x for x in ["{0}.ini".format(id),
+                             "{0}.ini.disabled".format(id)]
+                 if os.path.exists(os.path.join("/etc/supervisor.d", x))]
+    else:
+        files = os.listdir("/etc/supervisor.d")
+    if not files:
+        return []
+
+    # Get process info from Supervisor
+    svcs = []
+    supervisor_ping()
+    if id:
+        try:
+            procs = {id: conns.Supervisor.getProcessInfo(id)}
+        except:
+            procs = {}
+    else:
+        procs = {x["name"]: x for x in conns.Supervisor.getAllProcessInfo()}
+    for x in files:
+        name = x.split(".ini")[0]
+        if name not in procs:
+            continue
+        c = configparser.RawConfigParser()
+        c.read(os.path.join("/etc/supervisor.d", x))
+        cfg = {}
+        for y in c.items(c.sections()[0]):
+            cfg[y[0]] = y[1]
+        status = procs[name]["statename"].lower()\
+            if not x.endswith("disabled") else "stopped"
+        svcs.append(Service(name, "supervisor", status,
+                            not x.endswith("disabled"), cfg))
+    return svcs
+
+
+def _iter_journal(unit, since=None, priority=None, cursor=None,
+                  follow=False, this_boot=False):
+    """
+    Iterate over journal entries for a systemd unit.
+
+    The journal is read directly with python-systemd if installed, else
+    entries are streamed from ``journalctl``.
+
+    :param str unit: Unit file name
+    :param datetime since: Only show entries from this time onwards
+    :param int priority: Only show entries of this syslog level or more
+    :param str cursor: Only show entries after the one with this cursor
+    :param bool follow: Keep waiting for new entries
+    :param bool this_boot: Only show entries since the system booted
+    :returns: generator of log entry dicts
+    """
+    try:
+        from systemd import journal
+    except ImportError:
+        journal = None
+
+    if journal:
+        j = journal.Reader()
+        j.add_match(_SYSTEMD_UNIT=unit)
+        if this_boot:
+            j.this_boot()
+        if priority is not None:
+            j.log_level(priority)
+        if cursor:
+            j.seek_cursor(cursor)
+            # Seeking lands on the cursor entry itself, skip it
+            j.get_next()
+        elif since:
+            j.seek_realtime(since)
+        while True:
+            for x in j:
+                yield _journal_entry(x["__REALTIME_TIMESTAMP"],
+                                     x.get("PRIORITY"), x.get("MESSAGE"),
+                                     x["__CURSOR"])
+            if not follow:
+                break
+            j.wait()
+        return
+
+    cmd = ["journalctl", "--no-pager", "-o", "json", "-u", unit]
+    if this_boot:
+        cmd += ["-b", "0"]
+    if cursor:
+        cmd += ["--after-cursor", cursor]
+    elif since:
+        cmd += ["--since", since.strftime("%Y-%m-%d %H:%M:%S")]
+    if priority is not None:
+        cmd += ["-p", str(priority)]
+    if follow:
+        cmd.append("-f")
+    p = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                         stderr=subprocess.DEVNULL)
+    try:
+        for line in p.stdout:
+            x = json.loads(line.decode())
+            yield _journal_entry(
+                datetime.datetime.fromtimestamp(
+                    int(x["__REALTIME_TIMESTAMP"]) / 1000000.0),
+                x.get("PRIORITY"), x.get("MESSAGE"), x["__CURSOR"])
+    finally:
+        p.terminate()
+        p.wait()
+
+
+def _journal_entry(timestamp, priority, message, cursor):
+    # Messages with control characters are exported as byte arrays
+    if isinstance(message, list):
+        message = bytes(message).decode(errors="replace")
+    elif isinstance(message, bytes):
+        message = message.decode(errors="replace")
+    return {
+        "time": timestamp,
+        "priority": int(priority) if priority is not None else None,
+        "message": message or "",
+        "cursor": cursor
+    }
+
+
+def _iter_supervisor_log(name, offset=0, follow=False):
+    """
+    Iterate over lines of a Supervisor program's stdout log.
+
+    The log is paged from Supervisor by byte offset, one chunk at a time.
+
+    :param str name: Program name
+    :param int offset: Byte offset to start from
+    :param bool follow: Keep waiting for new lines
+    :returns: generator of log entry dicts
+    """
+    supervisor_ping()
+    offset, buf = int(offset), b""
+    while True:
+        data = conns.Supervisor.readProcessStdoutLog(
+            name, offset, LOG_CHUNK_SIZE)
+        data = data.encode() if isinstance(data, str) else data
+        if not data:
+            if not follow:
+                break
+            time.sleep(1)
+            continue
+        buf += data
+        offset += len(data)
+        lines = buf.split(b"\n")
+        buf = lines.pop()
+        pos = offset - len(buf) - sum(len(x) + 1 for x in lines)
+        for x in lines:
+            pos += len(x) + 1
+            yield {"time": None, "priority": None,
+                   "message": x.decode(errors="replace"), "cursor": pos}
+    if buf:
+        yield {"time": None, "priority": None,
+               "message": buf.decode(errors="replace"), "cursor": offset}
+
+
+def _wrap_command(cfg, limits):
+    """
+    Wrap a Supervisor program command to run it with resource limits.
+
+    The command is run in a transient systemd scope with the limits set as
+    its properties. The scope is started as root, so the program's user is
+    passed to systemd-run instead of Supervisor.
+
+    :param dict cfg: Supervisor program config
+    :param dict limits: Limits by systemd property name
+    :returns: new program config
+    """
+    command, user, _ = _unwrap_command(cfg)
+    cfg = cfg.copy()
+    cfg.pop("user", None)
+    if not limits:
+        cfg["command"] = command
+        if user:
+            cfg["user"] = user
+        return cfg
+    args = ["systemd-run", "--scope", "--quiet"]
+    if user:
+        args.append("--uid={0}".format(user))
+    for x in sorted(limits):
+        args += ["-p", "{0}={1}".format(x, limits[x])]
+    cfg["command"] = "{0} -- {1}".format(
+        " ".join(shlex.quote(x) for x in args), command)
+    return cfg
+
+
+def _unwrap_command(cfg):
+    """
+    Get the original command, user and limits of a Supervisor program.
+
+    :param dict cfg: Supervisor program config
+    :returns: tuple of command, user and dict of limits
+    """
+    command, user, limits = cfg.get("command", ""), cfg.get("user"), {}
+    if not command.startswith("systemd-run --scope ") \
+            or " -- " not in command:
+        return (command, user, limits)
+    prefix, command = command.split(" -- ", 1)
+    args = shlex.split(prefix)
+    for i, x in enumerate(args):
+        if x.startswith("--uid="):
+            user = x.split("=", 1)[1]
+        elif x == "-p" and i + 1 < len(args):
+            key, value = args[i + 1].split("=", 1)
+            limits[key] = value
+    return (command, user, limits)
+
+
+def _get_units():
+    """
+    Return the cached state of systemd service units, loading it if needed.
+
+    If signals are watched, the cache is kept current by systemd signals
+    and is only loaded once. Otherwise the cache is reloaded when older
+    than ``general.services_cache_ttl`` seconds. A copy is returned, as
+    signal callbacks may change the cache at any time.
+
+    :returns: dict of unit names to dicts with ``state`` and ``enabled``
+    """
+    with _cache_lock:
+        watching = _subscribe()
+        ttl = config.get("general", "services_cache_ttl", 5)
+        if _cache["units"] is None or \
+                (not watching and time.time() - _cache["time"] > ttl):
+            _cache["units"] = _load_units()
+            _cache["time"] = time.time()
+        return {k: dict(v) for k, v in _cache["units"].items()}
+
+
+def _load_units():
+    """Load the state of all systemd service units over D-Bus."""
+    files = {}
+
     # Get all unit files, loaded or not
     try:
         units = conns.SystemD.ListUnitFiles()
-    except DBusException as e:
+    except dbus.exceptions.DBusException as e:
         raise ActionError("dbus", str(e))
 
     for unit in units:
         if not unit[0].endswith(".service"):
             continue
         sname = os.path.splitext(os.path.split(unit[0])[-1])[0]
-        files[sname] = Service(sname, "system", "stopped",
-                               unit[1] == "enabled")
+        files[sname] = {"state": "stopped", "enabled": unit[1] == "enabled",
+                        "file": True}
 
     # Get all loaded services
     try:
         units = conns.SystemD.ListUnits()
-    except DBusException as e:
+    except dbus.exceptions.DBusException as e:
         raise ActionError("dbus", str(e))
 
     for unit in units:
@@ -301,57 +716,301 @@ def get(id=None):
             continue
         sname = unit[0].split(".service")[0]
         if sname not in files:
-            files[sname] = Service(sname, "system", "",
-                                   unit[1] == "enabled")
+            files[sname] = {"state": "", "enabled": False, "file": False}
         fsvc = files.get(sname.split("@")[0] + "@", None)
         if "@" in sname and fsvc:
-            files[sname].enabled = fsvc.enabled
-        files[sname].state = "running" if unit[3] == "active" else "stopped"
-
-    # If user requests a service with identifier and it's not
-    # running or enabled...
-    if id and "@" in id and id not in files \
-            and (id.split("@")[0] + "@") in files:
-        files[id] = Service(sname, "system", "stopped", False)
-        return files[id]
-
-    # Match up loaded services with their unit files and show state
-    for unit in files:
-        if id == unit:
-            return files[unit]
-        if unit.endswith("@"):
+            files[sname]["enabled"] = fsvc["enabled"]
+        files[sname]["state"] = \
+            "running" if str(unit[3]) == "active" else "stopped"
+    return files
+
+
+def watch_signals(running=True):
+    """
+    Use systemd signals to track units and jobs.
+
+    Only call this from a process running a D-Bus main loop (such as a GLib
+    main loop on another thread), and call it again with False once the
+    loop stops. Signals are never delivered otherwise, so by default units
+    and jobs are polled.
+
+    :param bool running: Is a D-Bus main loop running?
+    """
+    with _cache_lock:
+        _cache["signals"] = running
+        if not running:
+            # Signals may be missed from now on
+            _cache["units"] = None
+
+
+def _subscribe():
+    """
+    Subscribe to systemd unit signals on the current bus connection.
+
+    :returns: True if signals will be delivered, False if no main loop
+    """
+    if not _cache["signals"] or dbus.get_default_main_loop() is None:
+        return False
+    bus = conns.DBus
+    if _cache["bus"] is bus:
+        return True
+    manager = "org.freedesktop.systemd1.Manager"
+    try:
+        bus.add_signal_receiver(
+            _on_unit_new, "UnitNew", manager)
+        bus.add_signal_receiver(
+            _on_unit_removed, "UnitRemoved", manager)
+        bus.add_signal_receiver(
+            _on_unit_files_changed, "UnitFilesChanged", manager)
+        bus.add_signal_receiver(
+            _on_reloading, "Reloading", manager)
+        bus.add_signal_receiver(
+            _on_job_removed, "JobRemoved", manager)
+        bus.add_signal_receiver(
+            _on_properties_changed, "PropertiesChanged",
+            "org.freedesktop.DBus.Properties", "org.freedesktop.systemd1",
+            path_keyword="path")
+        conns.SystemD.Subscribe()
+    except dbus.exceptions.DBusException:
+        return False
+    # Signals sent before subscribing were missed, so reload
+    _cache["bus"] = bus
+    _cache["units"] = None
+    return True
+
+
+def _wait_job(job, timeout):
+    """
+    Wait for systemd to signal that a job has finished.
+
+    :param str job: D-Bus object path of the job
+    :param int timeout: Seconds to wait
+    :returns: job result (``done``, ``failed``...), or None on timeout
+    """
+    event = threading.Event()
+    with _jobs_lock:
+        # The job may have finished before its path was returned to us
+        if job in _jobs["done"]:
+            return _jobs["done"].pop(job)
+        _jobs["waiting"][job] = event
+    event.wait(timeout)
+    with _jobs_lock:
+        del _jobs["waiting"][job]
+        return _jobs["done"].pop(job, None)
+
+
+def _poll_job(job, timeout):
+    """
+    Poll the systemd job queue until a job has left it.
+
+    :param str job: D-Bus object path of the job
+    :param int timeout: Seconds to wait
+    :returns: True if the job finished, False on timeout
+    """
+    delay, end = 0.02, time.time() + timeout
+    while job in [str(x[4]) for x in conns.SystemD.ListJobs()]:
+        left = end - time.time()
+        if left <= 0:
+            return False
+        time.sleep(min(delay, left))
+        delay = min(delay * 2, 0.5)
+    return True
+
+
+def _on_job_removed(id, job, unit, result):
+    job = str(job)
+    with _jobs_lock:
+        _jobs["done"][job] = str(result)
+        # Only keep results of recent jobs that nobody waited for yet
+        while len(_jobs["done"]) > 64:
+            _jobs["done"].popitem(last=False)
+        event = _jobs["waiting"].get(job)
+    if event:
+        event.set()
+
+
+def _unit_name(path):
+    """Get a unit name from its escaped systemd object path."""
+    return re.sub("_([0-9a-f]{2})", lambda m: chr(int(m.group(1), 16)),
+                  path[len(UNIT_PATH):])
+
+
+def _update_unit(name, **kwargs):
+    """
+    Update the cached state of a systemd service unit.
+
+    :param str name: Unit name, with or without ``.service``
+    :param kwargs: ``state`` and/or ``enabled`` values to set
+    """
+    name = name.split(".service")[0]
+    with _cache_lock:
+        if _cache["units"] is None:
+            return
+        unit = _cache["units"].setdefault(
+            name, {"state": "stopped", "enabled": False, "file": False})
+        unit.update(kwargs)
+
+
+def _on_unit_new(id, path):
+    if not id.endswith(".service"):
+        return
+    name = id.split(".service")[0]
+    with _cache_lock:
+        units = _cache["units"]
+        if units is None or name in units:
+            return
+        tmpl = units.get(name.split("@")[0] + "@")
+        units[name] = {"state": "stopped", "file": False,
+                       "enabled": bool("@" in name and tmpl
+                                       and tmpl["enabled"])}
+
+
+def _on_unit_removed(id, path):
+    if not id.endswith(".service"):
+        return
+    name = id.split(".service")[0]
+    with _cache_lock:
+        units = _cache["units"]
+        if units is None or name not in units:
+            return
+        # Unloaded units with a unit file on disk are still listed
+        if units[name]["file"]:
+            units[name]["state"] = "stopped"
+        else:
+            del units[name]
+
+
+def _on_properties_changed(interface, changed, invalidated, path=""):
+    if interface != "org.freedesktop.systemd1.Unit" \
+            or "ActiveState" not in changed \
+            or not path.startswith(UNIT_PATH):
+        return
+    name = _unit_name(path)
+    if name.endswith(".service"):
+        state = str(changed["ActiveState"])
+        _update_unit(name, state="running" if state == "active"
+                     else "stopped")
+
+
+def _on_unit_files_changed():
+    # Enabled states and installed unit files may have changed
+    with _cache_lock:
+        _cache["units"] = None
+
+
+def _on_reloading(active):
+    if not active:
+        _on_unit_files_changed()
+
+
+def bulk(action, names, concurrency=4, timeout=10):
+    """
+    Start, stop or restart several services together.
+
+    Systemd jobs are queued for up to ``concurrency`` services at a time
+    before waiting on any of them, so the whole operation takes about as
+    long as the slowest service. Supervisor services are handled in a
+    single request.
+
+    :param str action: ``start``, ``stop`` or ``restart``
+    :param list names: Service IDs (or Services) to act on
+    :param int concurrency: Maximum number of systemd jobs queued at once
+    :param int timeout: Seconds to wait for each service
+    :returns: dict of the IDs given (or Service names) to error messages
+        (None on success)
+    """
+    if action not in BULK_ACTIONS:
+        raise ActionError("svc", "Unknown action: {0}".format(action))
+    method, state = BULK_ACTIONS[action]
+    results, svcs, sups, ids = {}, [], [], {}
+    for x in names:
+        svc = x if isinstance(x, Service) else get(x)
+        if not svc:
+            results[x] = "No such service"
+            continue
+        # IDs may be given with a ``.service`` suffix
+        ids[svc.name] = svc.name if svc is x else x
+        if svc.stype == "supervisor":
+            sups.append(svc)
+        else:
+            svcs.append(svc)
+    if sups:
+        results.update(supervisor_bulk(action, sups))
+
+    pending, queued = collections.deque(svcs), collections.deque()
+    while pending or queued:
+        while pending and len(queued) < concurrency:
+            svc = pending.popleft()
+            signals.emit("services", "pre_{0}".format(action), svc)
+            try:
+                job = svc._queue_job(method)
+                queued.append((svc, job, time.time() + timeout))
+            except ActionError as e:
+                results[svc.name] = e.emsg
+        if not queued:
             continue
-        svcs.append(files[unit])
+        # Wait for the oldest job to make room for the next one
+        svc, job, end = queued.popleft()
+        try:
+            svc._finish_job(job, action, state, end)
+            results[svc.name] = None
+            signals.emit("services", "post_{0}".format(action), svc)
+        except ActionError as e:
+            results[svc.name] = e.emsg
+    return {ids.get(x, x): y for x, y in results.items()}
 
-    # Get process info from Supervisor
+
+def supervisor_bulk(action, svcs):
+    """
+    Start, stop or restart several Supervisor services at once.
+
+    All actions are sent to Supervisor in one ``system.multicall`` request.
+    Starting a running service or stopping a stopped one is not an error.
+
+    :param str action: ``start``, ``stop`` or ``restart``
+    :param list svcs: Supervisor Services to act on
+    :returns: dict of service names to error messages (None on success)
+    """
+    if action not in ["start", "stop", "restart"]:
+        raise ActionError("svc", "Unknown action: {0}".format(action))
+    calls, names = [], []
+    if action in ["stop", "restart"]:
+        calls += [{"methodName": "supervisor.stopProcess",
+                   "params": [x.name, True]} for x in svcs]
+        names += [x.name for x in svcs]
+    if action in ["start", "restart"]:
+        calls += [{"methodName": "supervisor.startProcess",
+                   "params": [x.name, True]} for x in svcs]
+        names += [x.name for x in svcs]
+
+    for x in svcs:
+        signals.emit("services", "pre_{0}".format(action), x)
     supervisor_ping()
-    if not os.path.exists("/etc/supervisor.d"):
-        os.mkdir("/etc/supervisor.d")
-    for x in os.listdir("/etc/supervisor.d"):
-        c = configparser.RawConfigParser()
-        c.read(os.path.join("/etc/supervisor.d", x))
-        cfg = {}
-        for y in c.items(c.sections()[0]):
-            cfg[y[0]] = y[1]
-        name = x.split(".ini")[0]
-        try:
-            conns.Supervisor.getProcessInfo(name)
-        except:
-            continue
-        status = conns.Supervisor.getProcessInfo(name)["statename"].lower()\
-            if not x.endswith("disabled") else "stopped"
-        s = Service(name, "supervisor", status, not x.endswith("disabled"),
-                    cfg)
-        if id == s.name:
-            return s
-        svcs.append(s)
-    return sorted(svcs, key=lambda s: s.name) if not id else None
+    results = {x.name: None for x in svcs}
+    for name, r in zip(names, conns.SupervisorRPC.system.multicall(calls)):
+        if isinstance(r, dict) and r.get("faultCode") not in \
+                [None, SUPERVISOR_ALREADY_STARTED, SUPERVISOR_NOT_RUNNING]:
+            results[name] = r["faultString"]
+    for x in svcs:
+        if results[x.name] is None:
+            x.state = "stopped" if action == "stop" else "running"
+            signals.emit("services", "post_{0}".format(action), x)
+    return results
 
 
 def supervisor_ping():
-    """Check to make sure Supervisor API connection is functional."""
+    """
+    Check to make sure Supervisor API connection is functional.
+
+    A successful check is trusted for a few seconds, so runs of Supervisor
+    actions do not each pay for an extra round-trip.
+    """
+    if time.time() - _supervisor["checked"] < SUPERVISOR_PING_TTL:
+        return
     try:
         conns.Supervisor.getState()
     except:
         s = get("supervisord")
         s.restart()
+    else:
+        _supervisor["checked"] = time.time()
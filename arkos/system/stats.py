@@ -8,24 +8,300 @@ Written by Jacob Cook
 Licensed under GPLv3, see LICENSE.md
 """
 
+import array
+import atexit
 import datetime
 import os
 import psutil
+import threading
+import time
 
-from arkos import config
+from arkos import config, logger
+from arkos.system import archive, network, resources
+
+# Resolutions (seconds per slot) and sizes of each history tier.
+# Covers 5 minutes at 1 s, a day at 1 min and a month at 1 h.
+TIERS = [(1, 300), (60, 1440), (3600, 720)]
+
+_sampler = {"thread": None, "stop": None, "latest": None, "atexit": False}
+_series = {}
+_lock = threading.Lock()
+
+
+class RingBuffer:
+    """
+    A fixed-size ring buffer of consolidated samples.
+
+    Each slot holds a timestamp and the average, minimum and maximum values
+    seen in it. Data is kept in flat arrays, so memory use is fixed and
+    small regardless of how long the buffer has been written to.
+    """
+
+    def __init__(self, size):
+        """
+        Initialize the buffer.
+
+        :param int size: Number of slots
+        """
+        self.size = size
+        self.pos = 0
+        self.count = 0
+        self.times = array.array("d", [0.0]) * size
+        self.avg = array.array("f", [0.0]) * size
+        self.min = array.array("f", [0.0]) * size
+        self.max = array.array("f", [0.0]) * size
+
+    def append(self, timestamp, avg, low, high):
+        """
+        Add a slot, overwriting the oldest one if the buffer is full.
+
+        :param float timestamp: Slot start time
+        :param float avg: Average value
+        :param float low: Minimum value
+        :param float high: Maximum value
+        """
+        self.times[self.pos] = timestamp
+        self.avg[self.pos] = avg
+        self.min[self.pos] = low
+        self.max[self.pos] = high
+        self.pos = (self.pos + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def range(self, start=0, end=None):
+        """
+        Get slots in a time range, oldest first.
+
+        :param float start: Start time
+        :param float end: End time (default now)
+        :returns: list of (time, avg, min, max) tuples
+        """
+        end = end or time.time()
+        result = []
+        for i in range(self.count):
+            x = (self.pos - self.count + i) % self.size
+            if start <= self.times[x] <= end:
+                result.append((self.times[x], self.avg[x], self.min[x],
+                               self.max[x]))
+        return result
+
+    @property
+    def oldest(self):
+        """Return the time of the oldest slot, or None if empty."""
+        if not self.count:
+            return None
+        return self.times[(self.pos - self.count) % self.size]
+
+
+class Series:
+    """
+    A metric recorded at several resolutions.
+
+    Every value goes into the finest tier as is. Coarser tiers accumulate
+    values for the current slot and store their average, minimum and
+    maximum once the slot is over.
+    """
+
+    def __init__(self, tiers=TIERS):
+        """
+        Initialize the series.
+
+        :param list tiers: (resolution, size) for each tier, finest first
+        """
+        self.steps = [x[0] for x in tiers]
+        self.tiers = [RingBuffer(x[1]) for x in tiers]
+        self.pending = [None for x in tiers]
+
+    def add(self, timestamp, value):
+        """
+        Record a value.
+
+        :param float timestamp: Time of the value
+        :param float value: Value
+        """
+        for i, step in enumerate(self.steps):
+            slot = timestamp - timestamp % step
+            acc = self.pending[i]
+            if acc and acc[0] != slot:
+                self.tiers[i].append(acc[0], acc[1] / acc[2], acc[3], acc[4])
+                acc = None
+            if acc:
+                acc[1] += value
+                acc[2] += 1
+                acc[3] = min(acc[3], value)
+                acc[4] = max(acc[4], value)
+            else:
+                self.pending[i] = [slot, value, 1, value, value]
+
+    def covers(self, start):
+        """
+        Check whether any tier holds values from as far back as a time.
+
+        :param float start: Time
+        :returns: True if so
+        """
+        return any(x.oldest is not None and x.oldest <= start
+                   for x in self.tiers)
+
+    def range(self, start=0, end=None, step=None):
+        """
+        Get recorded values in a time range.
+
+        The finest tier that reaches back to ``start`` is used, unless a
+        coarser ``step`` is requested. The slot currently being filled is
+        included as well.
+
+        :param float start: Start time
+        :param float end: End time (default now)
+        :param int step: Minimum resolution in seconds
+        :returns: list of (time, avg, min, max) tuples, oldest first
+        """
+        end = end or time.time()
+        tiers = [i for i, x in enumerate(self.steps) if x >= (step or 0)]
+        tiers = tiers or [len(self.steps) - 1]
+        covering = [i for i in tiers if self.tiers[i].oldest is not None
+                    and self.tiers[i].oldest <= start]
+        i = covering[0] if covering else tiers[0]
+        # Include the slot that start falls in
+        start -= start % self.steps[i]
+        result = self.tiers[i].range(start, end)
+        acc = self.pending[i]
+        if acc and start <= acc[0] <= end:
+            result.append((acc[0], acc[1] / acc[2], acc[3], acc[4]))
+        return result
 
 
 def get_all():
-    """Get all available statistics."""
-    return {
+    """
+    Get all available statistics.
+
+    Values come from the background sampler, which is started on first
+    use, so this returns without waiting on any measurement.
+    """
+    if not sampler_running():
+        start_sampler()
+    with _lock:
+        return dict(_sampler["latest"])
+
+
+def start_sampler(interval=1):
+    """
+    Start the background statistics sampler.
+
+    A first sample is taken before returning, so values are available
+    straight away.
+
+    Resource usage of arkOS-managed services is also sampled, every
+    ``general.resources_interval`` seconds (0 to disable).
+
+    :param int interval: Seconds between samples
+    """
+    with _lock:
+        if sampler_running():
+            return
+        # Prime CPU measurement, later calls compare to the previous one
+        psutil.cpu_percent(interval=0.1)
+        _take_sample()
+        if not _sampler["atexit"]:
+            atexit.register(archive.close)
+            _sampler["atexit"] = True
+        stop = threading.Event()
+        thread = threading.Thread(target=_run_sampler, args=(stop, interval),
+                                  name="stats-sampler", daemon=True)
+        _sampler.update(thread=thread, stop=stop)
+        thread.start()
+
+
+def stop_sampler():
+    """Stop the background statistics sampler."""
+    if sampler_running():
+        _sampler["stop"].set()
+        _sampler["thread"].join()
+    _sampler.update(thread=None, stop=None)
+    archive.flush()
+
+
+def sampler_running():
+    """Return True if the background sampler is running."""
+    return _sampler["thread"] is not None and _sampler["thread"].is_alive()
+
+
+def get_history(metric, start=None, end=None, step=None):
+    """
+    Get recorded history for a metric.
+
+    Metrics are ``load``, ``cpu``, ``ram``, ``swap``, ``temp`` and
+    ``disk:<id>`` (percent used of each disk).
+
+    History older than what is kept in memory is read from the on-disk
+    archive, if enabled.
+
+    :param str metric: Metric name
+    :param float start: Start time (default one hour ago)
+    :param float end: End time (default now)
+    :param int step: Minimum resolution in seconds
+    :returns: list of (time, avg, min, max) tuples, oldest first
+    """
+    start = start if start is not None else time.time() - 3600
+    with _lock:
+        series = _series.get(metric)
+        if series and series.covers(start):
+            return series.range(start, end, step)
+    store = archive.get(metric)
+    if store:
+        return store.range(start, end, step)
+    return series.range(start, end, step) if series else []
+
+
+def _run_sampler(stop, interval):
+    next_resources = 0.0
+    while not stop.wait(interval - time.time() % interval):
+        with _lock:
+            _take_sample()
+        # Services are sampled less often, they take a D-Bus call each
+        every = config.get("general", "resources_interval", 10)
+        if every and time.time() >= next_resources:
+            next_resources = time.time() + every
+            _sample_resources()
+
+
+def _sample_resources():
+    """Sample resource usage of arkOS-managed services."""
+    try:
+        resources.sample()
+    except Exception as e:
+        logger.warning(
+            "Stats", "Could not sample service resources: {0}".format(e))
+
+
+def _take_sample():
+    """Measure all statistics and record them. Caller holds the lock."""
+    now = time.time()
+    data = {
         "load": get_load(),
         "temp": get_temp(),
         "ram": get_ram(),
-        "cpu": get_cpu(),
+        "cpu": psutil.cpu_percent(interval=None),
         "swap": get_swap(),
         "disks": get_space(),
         "uptime": get_uptime()
     }
+    _sampler["latest"] = data
+    network.sample_rates(now)
+    values = {
+        "load": data["load"][0],
+        "cpu": data["cpu"],
+        "ram": data["ram"][2],
+        "swap": data["swap"][0],
+        "temp": _read_temp()
+    }
+    for x in data["disks"]:
+        values["disk:{0}".format(x["id"])] = x["percent"]
+    values = {x: y for x, y in values.items() if y is not None}
+    for x, value in values.items():
+        if x not in _series:
+            _series[x] = Series()
+        _series[x].add(now, value)
+    archive.record(now, values)
 
 
 def get_load():
@@ -35,15 +311,21 @@ def get_load():
 
 def get_temp():
     """Get CPU temperature readings."""
+    temp = _read_temp()
+    return "{:3.1f}°C".format(temp) if temp is not None else ""
+
+
+def _read_temp():
+    """Read CPU temperature in degrees Celsius, or None if unavailable."""
     # TODO: replace this with libsensors.so / PySensors
     if config.get("enviro", "board", "Unknown").startswith("Raspberry Pi"):
-        with open("/sys/class/thermal/thermal_zone0/temp", "r") as f:
-            return "{:3.1f}°C".format(float(f.read().rstrip("\n"))/1000)
+        path = "/sys/class/thermal/thermal_zone0/temp"
     else:
-        if os.path.exists("/sys/class/hwmon/hwmon1/temp1_input"):
-            with open("/sys/class/hwmon/hwmon1/temp1_input", "r") as f:
-                return "{:3.1}f°C".format(float(f.read().rstrip("\n"))/1000)
-    return ""
+        path = "/sys/class/hwmon/hwmon1/temp1_input"
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return float(f.read().rstrip("\n"))/1000
 
 
 def get_ram():
@@ -54,7 +336,10 @@ def get_ram():
 
 def get_cpu():
     """Get current CPU use percentage."""
-    return psutil.cpu_percent(interval=1)
+    if not sampler_running():
+        start_sampler()
+    with _lock:
+        return _sampler["latest"]["cpu"]
 
 
 def get_swap():
@@ -7,18 +7,37 @@ Written by Jacob Cook
 Licensed under GPLv3, see LICENSE.md
 """
 
-import ldap
-import ldap.modlist
+import csv
 import os
 import pwd
 import shutil
+import threading
 
 from passlib.hash import nthash, ldap_sha512_crypt
 
 from . import groups, sysconfig
 
-from arkos import conns, config, logger, signals
-from arkos.utilities import b, errors, shell
+from arkos import conns, config, logger, signals, storage
+from arkos.connections import ldap_add_many, ldap_search
+from arkos.messages import Notification, NotificationThread
+from arkos.utilities import b, errors, shell, lazy_import
+
+ldap = lazy_import("ldap")
+
+# Attributes read from LDAP to build User objects
+USER_ATTRS = ["uid", "givenName", "sn", "uidNumber", "mail"]
+
+# Columns of user CSV files
+CSV_FIELDS = ["name", "first_name", "last_name", "uid", "domain", "mail",
+              "admin", "sudo", "password", "password_hash"]
+
+# CSV values taken as true for admin and sudo columns
+TRUE_VALUES = ["1", "true", "yes", "y"]
+
+PASSWD_FILE = "/etc/passwd"
+
+_index = {"current": None, "next": None}
+_index_lock = threading.Lock()
 
 
 class User:
@@ -79,25 +98,13 @@ class User:
             pass
 
         # Create LDAP user with proper metadata
-        ldif = {
-            "objectClass": [b"mailAccount", b"inetOrgPerson", b"posixAccount"],
-            "givenName": [b(self.first_name)],
-            "sn": [b(self.last_name)] if self.last_name else [b"NONE"],
-            "displayName": [b(self.full_name)],
-            "cn": [b(self.full_name)],
-            "uid": [b(self.name)],
-            "mail": [b(self.name + "@" + self.domain)],
-            "maildrop": [b(self.name)],
-            "userPassword": [b(ldap_sha512_crypt.encrypt(passwd))],
-            "gidNumber": [b"100"],
-            "uidNumber": [b(str(self.uid))],
-            "homeDirectory": [b("/home/" + self.name)],
-            "loginShell": [b"/usr/bin/bash"]
-            }
+        ldif = self._ldif(ldap_sha512_crypt.encrypt(passwd),
+                          [self.name + "@" + self.domain])
         ldif = ldap.modlist.addModlist(ldif)
         signals.emit("users", "pre_add", self)
         logger.debug("Roles", "Adding user: {0}".format(self.ldap_id))
         conns.LDAP.add_s(self.ldap_id, ldif)
+        _index_added([self.uid])
         modes = ["admin" if self.admin else "", "sudo" if self.sudo else ""]
         msg = "Setting user modes: {0}".format(", ".join(modes))
         logger.debug("Roles", msg)
@@ -107,6 +114,30 @@ class User:
 
         signals.emit("users", "post_add", {"user": self, "passwd": passwd})
 
+    def _ldif(self, passwd_hash, mail):
+        """
+        Build the LDAP attributes of a new user.
+
+        :param str passwd_hash: hashed password to set
+        :param list mail: mail addresses to set
+        :returns: dict of LDAP attributes
+        """
+        return {
+            "objectClass": [b"mailAccount", b"inetOrgPerson", b"posixAccount"],
+            "givenName": [b(self.first_name)],
+            "sn": [b(self.last_name)] if self.last_name else [b"NONE"],
+            "displayName": [b(self.full_name)],
+            "cn": [b(self.full_name)],
+            "uid": [b(self.name)],
+            "mail": [b(x) for x in mail],
+            "maildrop": [b(self.name)],
+            "userPassword": [b(passwd_hash)],
+            "gidNumber": [b"100"],
+            "uidNumber": [b(str(self.uid))],
+            "homeDirectory": [b("/home/" + self.name)],
+            "loginShell": [b"/usr/bin/bash"]
+            }
+
     def update(self, newpasswd=""):
         """
         Update a user's object in LDAP. Change params on the object first.
@@ -176,65 +207,17 @@ class User:
             is_sudo = False
 
         if self.sudo and not is_sudo:
-            nldif = {
-                "objectClass": [b"sudoRole", b"top"],
-                "cn": [b(self.name)],
-                "sudoHost": b"ALL",
-                "sudoCommand": b"ALL",
-                "sudoUser": [b(self.name)],
-                "sudoOption": b"authenticate"
-            }
-            nldif = ldap.modlist.addModlist(nldif)
-            conns.LDAP.add_s(
-                "cn=" + self.name + ",ou=sudo," + self.rootdn, nldif)
+            conns.LDAP.add_s(*_sudo_role(self.name, self.rootdn))
         elif not self.sudo and is_sudo:
             conns.LDAP.delete_s(
                 "cn=" + self.name + ",ou=sudo," + self.rootdn)
+        storage.ldap_cache.invalidate("users", self.ldap_id)
+        storage.ldap_cache.invalidate(
+            "groups", "cn=admins,ou=groups,{0}".format(self.rootdn))
 
     def update_samba(self, passwd=""):
         """Update Samba values in LDAP."""
-        try:
-            domain = conns.LDAP.search_s(
-                self.rootdn, ldap.SCOPE_SUBTREE,
-                "objectClass=sambaDomain", None)
-        except ldap.NO_SUCH_OBJECT:
-            domain = None
-        if not domain:
-            hostname = sysconfig.get_hostname().upper()
-            sambaSID = "S-1-5-21-0-0-0"
-            dldif = {
-                "objectClass": [b"sambaDomain"],
-                "sambaDomainName": [b(hostname)],
-                "sambaSID": [b(sambaSID)],
-                "sambaAlgorithmicRidBase": [b"1000"],
-                "sambaNextUserRid": [b"1000"],
-                "sambaMinPwdLength": [b"5"],
-                "sambaPwdHistoryLength": [b"0"],
-                "sambaLogonToChgPwd": [b"0"],
-                "sambaMaxPwdAge": [b"-1"],
-                "sambaMinPwdAge": [b"0"],
-                "sambaLockoutDuration": [b"30"],
-                "sambaLockoutObservationWindow": [b"30"],
-                "sambaLockoutThreshold": [b"0"],
-                "sambaForceLogoff": [b"-1"],
-                "sambaRefuseMachinePwdChange": [b"0"],
-                "sambaNextRid": [b(str(get_next_uid()))]
-            }
-            dldif = ldap.modlist.addModlist(dldif)
-            try:
-                conns.LDAP.add_s(
-                    "sambaDomainName={0},{1}".format(hostname, self.rootdn),
-                    dldif)
-            except ldap.ALREADY_EXISTS:
-                pass
-        else:
-            sambaSID = domain[0][1]["sambaSID"][0].decode()
-            attrs = {
-                "sambaNextRid": [b(str(get_next_uid()))]
-            }
-            dldif = ldap.modlist.modifyModlist(
-                domain[0][1], attrs, ignore_oldexistent=1)
-            conns.LDAP.modify_s(domain[0][0], dldif)
+        sambaSID = _update_samba_domain(self.rootdn, get_next_uid())
         if passwd:
             try:
                 uldif = conns.LDAP.search_s(
@@ -243,15 +226,7 @@ class User:
                 raise errors.InvalidConfigError(
                     "Users", "This user does not exist")
             uldif = uldif[0][1]
-            attrs = {
-                "objectClass": [
-                    b"mailAccount", b"inetOrgPerson", b"posixAccount",
-                    b"sambaSamAccount"
-                ],
-                "sambaSID": [b("{0}-{1}".format(sambaSID, self.uid))],
-                "sambaAcctFlags": [b"[UX         ]"],
-                "sambaNTPassword": [b(nthash.encrypt(passwd).upper())]
-            }
+            attrs = _samba_attrs(sambaSID, self.uid, passwd)
             nldif = ldap.modlist.modifyModlist(
                 uldif, attrs, ignore_oldexistent=1)
             conns.LDAP.modify_s(self.ldap_id, nldif)
@@ -290,6 +265,8 @@ class User:
             if os.path.exists(hdir):
                 shutil.rmtree(hdir)
         conns.LDAP.delete_s(self.ldap_id)
+        storage.ldap_cache.invalidate("users", self.ldap_id)
+        _index["current"] = None
         signals.emit("users", "post_remove", self)
 
     @property
@@ -377,13 +354,31 @@ def get(uid=None, name=None):
     """
     r = []
     rootdn = config.get("general", "ldap_rootdn")
-    ldap_users = conns.LDAP.search_s("ou=users," + rootdn, ldap.SCOPE_SUBTREE,
-                                     "(objectClass=inetOrgPerson)", None)
+    if uid is not None:
+        u = storage.ldap_cache.find("users", lambda x: x.uid == uid)
+    elif name:
+        u = storage.ldap_cache.get(
+            "users", "uid={0},ou=users,{1}".format(name, rootdn))
+    else:
+        u = storage.ldap_cache.get_all("users")
+    if u is not None:
+        return u
+    qry = "(objectClass=inetOrgPerson)"
+    if uid is not None:
+        qry = "(&{0}(uidNumber={1}))".format(qry, int(uid))
+    elif name:
+        qry = "(&{0}(uid={1}))".format(
+            qry, ldap.filter.escape_filter_chars(name))
+    # Admin and sudo memberships are fetched once, before the search holds
+    # a pooled connection
+    admins, sudoers = _get_adminsudo(rootdn)
+    ldap_users = ldap_search(conns.LDAP, "ou=users," + rootdn,
+                             ldap.SCOPE_SUBTREE, qry, USER_ATTRS)
     for x in ldap_users:
         for y in x[1]:
             if y == "mail":
                 continue
-            if type(x[1][y]) == list and len(x[1][y]) == 1:
+            if isinstance(x[1][y], list) and len(x[1][y]) == 1:
                 x[1][y] = x[1][y][0]
         u = User(x[1]["uid"].decode(), x[1]["givenName"].decode(),
                  x[1]["sn"].decode() if x[1]["sn"] != b"NONE" else None,
@@ -393,26 +388,343 @@ def get(uid=None, name=None):
                  [z.decode() for z in x[1]["mail"]])
 
         # Check if the user is a member of the admin or sudo groups
-        try:
-            conns.LDAP.search_s("cn={0},ou=sudo,{1}".format(u.name, u.rootdn),
-                                ldap.SCOPE_SUBTREE, "(objectClass=*)", None)
-            u.sudo = True
-        except ldap.NO_SUCH_OBJECT:
-            u.sudo = False
-        memlist = conns.LDAP.search_s("cn=admins,ou=groups,{0}"
-                                      .format(u.rootdn), ldap.SCOPE_SUBTREE,
-                                      "(objectClass=*)", None)[0][1]["member"]
-        if b("uid={0},ou=users,{1}".format(u.name, u.rootdn)) in memlist:
-            u.admin = True
-        else:
-            u.admin = False
+        u.admin = b(u.ldap_id) in admins
+        u.sudo = u.name in sudoers
 
-        if u.uid == uid:
-            return u
-        elif name and u.name == name:
+        if u.uid == uid or (name and u.name == name):
+            storage.ldap_cache.set("users", u.ldap_id, u)
             return u
         r.append(u)
-    return r if uid is None and name is None else None
+    if uid is None and name is None:
+        storage.ldap_cache.set_all("users", {x.ldap_id: x for x in r})
+        return r
+    return None
+
+
+def _get_adminsudo(rootdn):
+    """
+    Get admin group members and sudo role names for a root DN.
+
+    :param str rootdn: Root DN in LDAP
+    :returns: tuple of set of admin member DNs and set of sudo user names
+    """
+    try:
+        admins = conns.LDAP.search_s(
+            "cn=admins,ou=groups,{0}".format(rootdn), ldap.SCOPE_BASE,
+            "(objectClass=*)", ["member"])[0][1].get("member", [])
+    except ldap.NO_SUCH_OBJECT:
+        admins = []
+    try:
+        roles = ldap_search(
+            conns.LDAP, "ou=sudo,{0}".format(rootdn), ldap.SCOPE_ONELEVEL,
+            "(objectClass=sudoRole)", ["cn"])
+        sudoers = set(
+            ldap.dn.explode_dn(x[0], notypes=True)[0] for x in roles)
+    except ldap.NO_SUCH_OBJECT:
+        sudoers = set()
+    return (set(admins), sudoers)
+
+
+def _sudo_role(name, rootdn):
+    """
+    Build the LDAP entry of a user's sudo role.
+
+    :param str name: Username
+    :param str rootdn: Root DN in LDAP
+    :returns: tuple of DN and modlist
+    """
+    ldif = {
+        "objectClass": [b"sudoRole", b"top"],
+        "cn": [b(name)],
+        "sudoHost": b"ALL",
+        "sudoCommand": b"ALL",
+        "sudoUser": [b(name)],
+        "sudoOption": b"authenticate"
+    }
+    return ("cn={0},ou=sudo,{1}".format(name, rootdn),
+            ldap.modlist.addModlist(ldif))
+
+
+def _samba_attrs(sambaSID, uid, passwd):
+    """
+    Build the Samba account attributes of a user.
+
+    :param str sambaSID: SID of the Samba domain
+    :param int uid: user ID number
+    :param str passwd: user password
+    :returns: dict of LDAP attributes
+    """
+    return {
+        "objectClass": [
+            b"mailAccount", b"inetOrgPerson", b"posixAccount",
+            b"sambaSamAccount"
+        ],
+        "sambaSID": [b("{0}-{1}".format(sambaSID, uid))],
+        "sambaAcctFlags": [b"[UX         ]"],
+        "sambaNTPassword": [b(nthash.encrypt(passwd).upper())]
+    }
+
+
+def _update_samba_domain(rootdn, next_rid):
+    """
+    Set the next RID of the Samba domain, creating the domain if needed.
+
+    :param str rootdn: Root DN in LDAP
+    :param int next_rid: next RID to hand out
+    :returns: SID of the Samba domain
+    """
+    try:
+        domain = conns.LDAP.search_s(
+            rootdn, ldap.SCOPE_SUBTREE, "objectClass=sambaDomain", None)
+    except ldap.NO_SUCH_OBJECT:
+        domain = None
+    if not domain:
+        hostname = sysconfig.get_hostname().upper()
+        sambaSID = "S-1-5-21-0-0-0"
+        dldif = {
+            "objectClass": [b"sambaDomain"],
+            "sambaDomainName": [b(hostname)],
+            "sambaSID": [b(sambaSID)],
+            "sambaAlgorithmicRidBase": [b"1000"],
+            "sambaNextUserRid": [b"1000"],
+            "sambaMinPwdLength": [b"5"],
+            "sambaPwdHistoryLength": [b"0"],
+            "sambaLogonToChgPwd": [b"0"],
+            "sambaMaxPwdAge": [b"-1"],
+            "sambaMinPwdAge": [b"0"],
+            "sambaLockoutDuration": [b"30"],
+            "sambaLockoutObservationWindow": [b"30"],
+            "sambaLockoutThreshold": [b"0"],
+            "sambaForceLogoff": [b"-1"],
+            "sambaRefuseMachinePwdChange": [b"0"],
+            "sambaNextRid": [b(str(next_rid))]
+        }
+        dldif = ldap.modlist.addModlist(dldif)
+        try:
+            conns.LDAP.add_s(
+                "sambaDomainName={0},{1}".format(hostname, rootdn), dldif)
+        except ldap.ALREADY_EXISTS:
+            pass
+    else:
+        sambaSID = domain[0][1]["sambaSID"][0].decode()
+        attrs = {
+            "sambaNextRid": [b(str(next_rid))]
+        }
+        dldif = ldap.modlist.modifyModlist(
+            domain[0][1], attrs, ignore_oldexistent=1)
+        conns.LDAP.modify_s(domain[0][0], dldif)
+    return sambaSID
+
+
+def bulk_add(entries, nthread=NotificationThread()):
+    """
+    Add many users to LDAP at once.
+
+    Entries are dicts as returned by ``read_entries``. uidNumbers are
+    allocated for all entries in one pass, and the adds are pipelined over
+    a single LDAP connection. Entries that cannot be added are skipped and
+    reported, without stopping the others.
+
+    :param list entries: user entries to add
+    :param NotificationThread nthread: notification thread to use
+    :returns: tuple of list of added Users and dict of failed names to errors
+    """
+    nthread.title = "Importing users"
+    rootdn = config.get("general", "ldap_rootdn")
+    existing = get()
+    names = set(x.name for x in existing)
+    taken = set(x.uid for x in existing)
+    next_uid = max([get_next_uid()] + [x + 1 for x in taken])
+    failed, todo = {}, []
+
+    # Validate entries and allocate uidNumbers
+    for x in entries:
+        name = x.get("name")
+        mail = x.get("mail") or []
+        domain = x.get("domain") or \
+            (mail[0].split("@")[-1] if mail else "")
+        if not name:
+            continue
+        elif name in names:
+            failed[name] = "A user named {0} already exists".format(name)
+            continue
+        elif not domain:
+            failed[name] = "No domain given"
+            continue
+        elif not x.get("password") and not x.get("password_hash"):
+            failed[name] = "No password given"
+            continue
+        try:
+            uid = int(x.get("uid") or 0)
+        except ValueError:
+            failed[name] = "Invalid user ID: {0}".format(x["uid"])
+            continue
+        if uid in taken:
+            failed[name] = "User ID {0} is already in use".format(uid)
+            continue
+        elif not uid:
+            while next_uid in taken:
+                next_uid += 1
+            uid = next_uid
+        names.add(name)
+        taken.add(uid)
+        u = User(name, x.get("first_name") or name, x.get("last_name"), uid,
+                 domain, rootdn, mail or [name + "@" + domain],
+                 x.get("admin", False), x.get("sudo", False))
+        todo.append((u, x))
+
+    msg = "Adding {0} users...".format(len(todo))
+    nthread.update(Notification("info", "Users", msg))
+    sambaSID = None
+    if any(x.get("password") for u, x in todo):
+        sambaSID = _update_samba_domain(rootdn, max(taken) + 1)
+    adds, by_dn = [], {}
+    for u, x in todo:
+        signals.emit("users", "pre_add", u)
+        ldif = u._ldif(x.get("password_hash")
+                       or ldap_sha512_crypt.encrypt(x["password"]), u.mail)
+        if x.get("password"):
+            ldif.update(_samba_attrs(sambaSID, u.uid, x["password"]))
+        adds.append((u.ldap_id, ldap.modlist.addModlist(ldif)))
+        by_dn[u.ldap_id] = (u, x)
+
+    added = []
+    results = ldap_add_many(conns.LDAP, adds)
+    for i, (dn, e) in enumerate(results, start=1):
+        u = by_dn[dn][0]
+        if e:
+            info = e.args[0] if e.args and isinstance(e.args[0], dict) \
+                else {}
+            failed[u.name] = info.get("desc", str(e))
+        else:
+            added.append(u)
+        if not i % 100 or i == len(adds):
+            msg = "Added {0} of {1} users".format(i, len(adds))
+            nthread.update(Notification("info", "Users", msg))
+
+    # Set admin and sudo modes for all new users together
+    admins = [b(x.ldap_id) for x in added if x.admin]
+    if admins:
+        conns.LDAP.modify_s("cn=admins,ou=groups,{0}".format(rootdn),
+                            [(ldap.MOD_ADD, "member", admins)])
+    sudoers = [_sudo_role(x.name, rootdn) for x in added if x.sudo]
+    for dn, e in ldap_add_many(conns.LDAP, sudoers):
+        if e:
+            logger.warning("Roles", "Could not add sudo role {0}: {1}"
+                           .format(dn, e))
+    storage.ldap_cache.invalidate("users")
+    storage.ldap_cache.invalidate(
+        "groups", "cn=admins,ou=groups,{0}".format(rootdn))
+    _index_added([x.uid for x in added])
+
+    for u in added:
+        passwd = by_dn[u.ldap_id][1].get("password")
+        signals.emit("users", "post_add", {"user": u, "passwd": passwd})
+    msg = "{0} users added, {1} failed".format(len(added), len(failed))
+    nthread.complete(Notification("success", "Users", msg))
+    return (added, failed)
+
+
+def read_entries(f, fmt="csv"):
+    """
+    Read user entries to import from a CSV or LDIF file.
+
+    CSV files have a header row naming the ``CSV_FIELDS`` columns used.
+    Multiple mail addresses are separated by spaces. Each row needs either
+    a ``password`` or the ``password_hash`` of an exported user. LDIF files
+    hold ``inetOrgPerson`` entries, whose password hashes are kept as they
+    are.
+
+    :param file f: file object opened in text mode
+    :param str fmt: ``csv`` or ``ldif``
+    :returns: list of user entry dicts
+    """
+    entries = []
+    if fmt == "ldif":
+        from ldif import LDIFRecordList
+        records = LDIFRecordList(f)
+        records.parse()
+        for dn, attrs in records.all_records:
+            attrs = {x.lower(): [y.decode() for y in attrs[x]]
+                     for x in attrs}
+            if "inetorgperson" not in \
+                    [x.lower() for x in attrs.get("objectclass", [])]:
+                continue
+            sn = attrs.get("sn", [None])[0]
+            entries.append({
+                "name": attrs["uid"][0],
+                "first_name": attrs.get("givenname", [""])[0],
+                "last_name": sn if sn != "NONE" else None,
+                "uid": attrs.get("uidnumber", [0])[0],
+                "mail": attrs.get("mail", []),
+                "password_hash": attrs.get("userpassword", [None])[0]
+            })
+    elif fmt == "csv":
+        for row in csv.DictReader(f):
+            entries.append({
+                "name": row.get("name"),
+                "first_name": row.get("first_name"),
+                "last_name": row.get("last_name") or None,
+                "uid": row.get("uid") or 0,
+                "domain": row.get("domain"),
+                "mail": (row.get("mail") or "").split(),
+                "admin": (row.get("admin") or "").lower() in TRUE_VALUES,
+                "sudo": (row.get("sudo") or "").lower() in TRUE_VALUES,
+                "password": row.get("password"),
+                "password_hash": row.get("password_hash")
+            })
+    else:
+        raise errors.InvalidConfigError(
+            "Unknown import format: {0}".format(fmt))
+    return entries
+
+
+def write_entries(f, fmt="csv"):
+    """
+    Write all LDAP users to a CSV or LDIF file.
+
+    Both formats include password hashes, so users can be imported
+    elsewhere with ``read_entries``. Samba passwords can not be rebuilt
+    from hashes, and are set again on the next password change.
+
+    :param file f: file object opened in text mode
+    :param str fmt: ``csv`` or ``ldif``
+    :returns: number of users written
+    """
+    count = 0
+    if fmt == "ldif":
+        from ldif import LDIFWriter
+        writer = LDIFWriter(f)
+        rootdn = config.get("general", "ldap_rootdn")
+        for dn, attrs in ldap_search(
+                conns.LDAP, "ou=users," + rootdn, ldap.SCOPE_SUBTREE,
+                "(objectClass=inetOrgPerson)",
+                USER_ATTRS + ["objectClass", "userPassword"]):
+            writer.unparse(dn, attrs)
+            count += 1
+    elif fmt == "csv":
+        rootdn = config.get("general", "ldap_rootdn")
+        hashes = {dn.lower(): attrs["userPassword"][0].decode()
+                  for dn, attrs in ldap_search(
+                      conns.LDAP, "ou=users," + rootdn, ldap.SCOPE_SUBTREE,
+                      "(objectClass=inetOrgPerson)", ["userPassword"])
+                  if attrs.get("userPassword")}
+        writer = csv.DictWriter(f, CSV_FIELDS)
+        writer.writeheader()
+        for x in get():
+            writer.writerow({
+                "name": x.name, "first_name": x.first_name,
+                "last_name": x.last_name or "", "uid": x.uid,
+                "domain": x.domain, "mail": " ".join(x.mail),
+                "admin": "yes" if x.admin else "no",
+                "sudo": "yes" if x.sudo else "no", "password": "",
+                "password_hash": hashes.get(x.ldap_id.lower(), "")
+            })
+            count += 1
+    else:
+        raise errors.InvalidConfigError(
+            "Unknown export format: {0}".format(fmt))
+    return count
 
 
 def get_system(uid=None):
@@ -424,21 +736,91 @@ def get_system(uid=None):
     :returns: SystemUser(s)
     :rtype: SystemUser or list thereof
     """
-    r = []
-    grps = groups.get_system()
-    for x in pwd.getpwall():
-        if x.pw_name == "root":
-            continue
-        su = SystemUser(name=x.pw_name, uid=x.pw_uid)
-        for y in grps:
-            if su.name in y.users:
-                su.groups.append(y.name)
-        if uid == su.name:
-            return su
-        r.append(su)
-    return sorted(r, key=lambda x: x.uid) if not uid else None
+    index = _get_index()
+    members = groups.get_memberships()
+    if uid:
+        x = index["by_name"].get(uid)
+        if not x:
+            return None
+        return SystemUser(x[0], x[1], list(members.get(x[0], [])))
+    return [SystemUser(x[0], x[1], list(members.get(x[0], [])))
+            for x in index["users"]]
 
 
 def get_next_uid():
-    """Get the next available user ID number in sequence."""
-    return max([x.uid for x in get_system()]) + 1
+    """
+    Get the next available user ID number in sequence.
+
+    The highest UID of system and LDAP users is looked up once, as the
+    system user database may not list new LDAP users until nslcd refreshes
+    its cache. It is then kept current as users are added here, and looked
+    up again when ``PASSWD_FILE`` changes.
+    """
+    key = _file_key()
+    with _index_lock:
+        cached = _index["next"]
+        if cached and key is not None and cached[0] == key:
+            return cached[1]
+    uids = []
+    try:
+        rootdn = config.get("general", "ldap_rootdn")
+        for dn, attrs in ldap_search(
+                conns.LDAP, "ou=users," + rootdn, ldap.SCOPE_SUBTREE,
+                "(objectClass=posixAccount)", ["uidNumber"]):
+            uids += [int(x) for x in attrs.get("uidNumber", [])]
+    except ldap.LDAPError as e:
+        logger.warning("Roles", "Could not read LDAP user IDs: {0}"
+                       .format(e))
+    next_uid = max([_get_index()["next_uid"]] + [x + 1 for x in uids])
+    with _index_lock:
+        _index["next"] = (key, next_uid)
+    return next_uid
+
+
+def _index_added(uids):
+    """
+    Update the user index after users were added to LDAP.
+
+    :param list uids: UIDs of the added users
+    """
+    with _index_lock:
+        _index["current"] = None
+        if _index["next"] and uids:
+            key, next_uid = _index["next"]
+            _index["next"] = (key, max([next_uid] + [int(x) + 1
+                                                     for x in uids]))
+
+
+def _file_key():
+    """Return a key that changes whenever ``PASSWD_FILE`` does."""
+    try:
+        st = os.stat(PASSWD_FILE)
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
+
+def _get_index():
+    """
+    Get the index of system users, rebuilding it if it is out of date.
+
+    The index is built in one pass over the user database, and reused
+    until ``PASSWD_FILE`` is replaced or modified, or LDAP users are added
+    or removed.
+
+    :returns: dict with user tuples sorted by UID, lookup by name, next UID
+    """
+    key = _file_key()
+    with _index_lock:
+        index = _index["current"]
+        if index and key is not None and key == index["key"]:
+            return index
+        users = sorted(((x.pw_name, x.pw_uid) for x in pwd.getpwall()
+                        if x.pw_name != "root"), key=lambda x: x[1])
+        index = {
+            "key": key, "users": users,
+            "by_name": {x[0]: x for x in users},
+            "next_uid": (users[-1][1] if users else 0) + 1
+        }
+        _index["current"] = index
+        return index
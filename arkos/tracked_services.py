@@ -7,16 +7,21 @@ Written by Jacob Cook
 Licensed under GPLv3, see LICENSE.md
 """
 
+import contextlib
 import glob
-import miniupnpc
 import random
+import threading
 
 from arkos import config, logger, policies, signals, storage, security
 from arkos.messages import Notification
-from arkos.utilities import errors, test_port
+from arkos.utilities import errors, test_port, lazy_import
+
+miniupnpc = lazy_import("miniupnpc")
 
 COMMON_PORTS = [3000, 3306, 5222, 5223, 5232]
 
+_batch = threading.local()
+
 
 class SecurityPolicy:
     """
@@ -70,10 +75,10 @@ class SecurityPolicy:
             )
         else:
             policies.set(self.type, self.id, self.policy)
-        policies.save()
+        save_policies()
         storage.policies[self.id] = self
-        if config.get("general", "firewall") and fw:
-            security.regenerate_firewall(get())
+        if fw:
+            regenerate_firewall()
 
     def remove(self, fw=True):
         """
@@ -90,11 +95,11 @@ class SecurityPolicy:
                     break
         else:
             policies.remove(self.type, self.id)
-        policies.save()
+        save_policies()
         if self.id in storage.policies:
             del storage.policies[self.id]
-        if config.get("general", "firewall") and fw:
-            security.regenerate_firewall(get())
+        if fw:
+            regenerate_firewall()
 
     @property
     def as_dict(self):
@@ -190,8 +195,8 @@ def deregister(type, id="", fw=True):
         elif x.id == id:
             x.remove(fw=False)
             break
-    if config.get("general", "firewall") and fw:
-        security.regenerate_firewall(get())
+    if fw:
+        regenerate_firewall()
 
 
 def refresh_policies():
@@ -209,9 +214,81 @@ def refresh_policies():
                     if s == y.id:
                         newpolicies[x][s] = policies.get(x, s)
     policies.config = newpolicies
+    save_policies()
+
+
+@contextlib.contextmanager
+def batch(join=None):
+    """
+    Coalesce policy file writes and firewall regeneration.
+
+    While inside this context, saving or removing security policies only
+    marks the policy file and firewall as out of date. When the outermost
+    ``batch()`` exits, the policies are written and the firewall is
+    regenerated once, if anything asked for it.
+
+        with tracked_services.batch():
+            for site in sites:
+                register_website(site)
+
+    Batches only apply to the thread that opened them. Worker threads can
+    take part in another thread's batch by passing the object it yields as
+    ``join``; the batch is then flushed once all of them have exited.
+
+    :param dict join: Batch state yielded by a ``batch()`` in another thread
+    """
+    prev = getattr(_batch, "state", None)
+    state = prev or join or {
+        "depth": 0, "save": False, "regen": False, "lock": threading.Lock()
+    }
+    _batch.state = state
+    with state["lock"]:
+        state["depth"] += 1
+    try:
+        yield state
+    finally:
+        _batch.state = prev
+        with state["lock"]:
+            state["depth"] -= 1
+            flush = state["depth"] == 0
+            save = flush and state["save"]
+            regen = flush and state["regen"]
+            if flush:
+                state["save"] = state["regen"] = False
+        if save:
+            policies.save()
+        if regen:
+            security.regenerate_firewall(get())
+
+
+def _defer(action):
+    """Mark an action as pending in this thread's batch, if there is one."""
+    state = getattr(_batch, "state", None)
+    if not state:
+        return False
+    with state["lock"]:
+        if not state["depth"]:
+            return False
+        state[action] = True
+    return True
+
+
+def save_policies():
+    """Write security policies to disk, or defer it to the current batch."""
+    if _defer("save"):
+        return
     policies.save()
 
 
+def regenerate_firewall():
+    """Regenerate the firewall, or defer it to the current batch."""
+    if not config.get("general", "firewall"):
+        return
+    if _defer("regen"):
+        return
+    security.regenerate_firewall(get())
+
+
 def is_open_port(port, domain=None, ignore_common=False):
     """
     Check if the specified port is taken by a tracked service or not.
@@ -457,6 +534,8 @@ def close_upnp_site(site):
 
 signals.add("tracked_services", "websites", "site_loaded", register_website)
 signals.add("tracked_services", "websites", "site_installed", register_website)
-signals.add("tracked_services", "websites", "site_installed", open_upnp_site)
+signals.add("tracked_services", "websites", "site_installed", open_upnp_site,
+            background=True)
 signals.add("tracked_services", "websites", "site_removed", deregister_website)
-signals.add("tracked_services", "websites", "site_removed", close_upnp_site)
+signals.add("tracked_services", "websites", "site_removed", close_upnp_site,
+            background=True)
@@ -8,11 +8,12 @@ Licensed under GPLv3, see LICENSE.md
 """
 
 import json
-import gnupg
 
 from arkos import config, logger, storage, signals
 from arkos.messages import Notification, NotificationThread
-from arkos.utilities import api, download, shell
+from arkos.utilities import api, download, shell, lazy_import
+
+gnupg = lazy_import("gnupg")
 
 
 def check_updates():
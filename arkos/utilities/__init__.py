@@ -10,6 +10,7 @@ Licensed under GPLv3, see LICENSE.md
 from .detect import *
 from .utils import *
 from .logs import *
+from .lazy import lazy_import
 
 __all__ = [
     "path_to_b64",
@@ -33,5 +34,6 @@ __all__ = [
     "test_port",
     "detect_architecture",
     "detect_platform",
-    "NotificationFilter"
+    "NotificationFilter",
+    "lazy_import"
 ]
@@ -0,0 +1,113 @@
+"""
+Helpers for deferring imports of heavy dependencies until first use.
+
+arkOS Core
+(c) 2016 CitizenWeb
+Written by Jacob Cook
+Licensed under GPLv3, see LICENSE.md
+"""
+
+import importlib
+import sys
+import types
+
+
+class LazyModule(types.ModuleType):
+    """
+    A stand-in for a module that is imported on first attribute access.
+
+    Submodules that the real module does not import by itself (such as
+    ``ldap.modlist``) are imported on access as well.
+    """
+
+    def __init__(self, name):
+        """
+        Initialize the lazy module.
+
+        :param str name: full name of the module to import
+        """
+        super(LazyModule, self).__init__(name)
+        self.__dict__["_lazy_target"] = None
+
+    def _load(self):
+        module = self.__dict__["_lazy_target"]
+        if module is None:
+            module = importlib.import_module(self.__name__)
+            self.__dict__["_lazy_target"] = module
+        return module
+
+    def __getattr__(self, attr):
+        """Resolve an attribute from the real module, importing it first."""
+        module = self._load()
+        try:
+            return getattr(module, attr)
+        except AttributeError:
+            if attr.startswith("__"):
+                raise
+            try:
+                return importlib.import_module(
+                    "{0}.{1}".format(self.__name__, attr))
+            except ImportError:
+                raise AttributeError(
+                    "module '{0}' has no attribute '{1}'"
+                    .format(self.__name__, attr))
+
+    def __dir__(self):
+        """List attributes of the real module."""
+        return dir(self._load())
+
+    def __repr__(self):
+        """Module representation."""
+        if self.__dict__["_lazy_target"] is None:
+            return "<lazy module '{0}'>".format(self.__name__)
+        return repr(self.__dict__["_lazy_target"])
+
+
+class LazyAttribute:
+    """
+    A stand-in for a function or namespace object from a lazy module.
+
+    Calls and attribute lookups are forwarded to the real object. This can
+    not stand in for classes used with ``isinstance`` or ``except``; use the
+    module itself for those.
+    """
+
+    def __init__(self, module, attr):
+        """
+        Initialize the lazy attribute.
+
+        :param LazyModule module: module the attribute belongs to
+        :param str attr: attribute name
+        """
+        self._module = module
+        self._attr = attr
+
+    def _load(self):
+        return getattr(self._module, self._attr)
+
+    def __getattr__(self, attr):
+        """Resolve an attribute of the real object."""
+        return getattr(self._load(), attr)
+
+    def __call__(self, *args, **kwargs):
+        """Call the real object."""
+        return self._load()(*args, **kwargs)
+
+
+def lazy_import(name, attr=None):
+    """
+    Import a module (or an attribute from one) on first use.
+
+    If the module has already been imported, its stand-in uses it straight
+    away, but still imports submodules on access.
+
+    :param str name: full name of the module to import
+    :param str attr: name of an attribute to take from the module
+    :returns: lazy stand-in for the module, or the attribute
+    """
+    module = LazyModule(name)
+    loaded = sys.modules.get(name)
+    if loaded is not None:
+        module.__dict__["_lazy_target"] = loaded
+        return getattr(module, attr) if attr else module
+    return LazyAttribute(module, attr) if attr else module
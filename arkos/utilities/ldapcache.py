@@ -0,0 +1,247 @@
+"""
+Classes for caching objects read from LDAP.
+
+arkOS Core
+(c) 2016 CitizenWeb
+Written by Jacob Cook
+Licensed under GPLv3, see LICENSE.md
+"""
+
+import copy
+import threading
+import time
+
+from .lazy import lazy_import
+
+ldap = lazy_import("ldap")
+
+# LDAP organizational units and the cache sections their entries belong to
+SECTIONS = {"users": "users", "groups": "groups", "domains": "domains",
+            "sudo": "users"}
+
+
+class LDAPCache:
+    """
+    A per-process cache of objects parsed from LDAP, keyed by DN.
+
+    Objects are grouped by section (``users``, ``groups``, ``domains``). A
+    section can also be marked complete once all of its objects have been
+    loaded, so listings can be served from the cache. Copies of cached
+    objects are returned, so changes made to them are not seen by others
+    until they are saved.
+
+    Methods writing to LDAP must invalidate the entries they change. Changes
+    made outside of arkOS are picked up when entries expire after ``ttl``
+    seconds, or straight away if a syncrepl consumer is running.
+    """
+
+    def __init__(self):
+        """Initialize an empty, disabled cache."""
+        self.enabled = False
+        self.ttl = 0
+        self.sections = {}
+        self._lock = threading.Lock()
+        self._sync = None
+
+    def configure(self, enabled=True, ttl=0):
+        """
+        Enable or disable the cache.
+
+        :param bool enabled: Cache objects?
+        :param int ttl: Seconds objects stay valid (0 for no expiry)
+        """
+        self.enabled = enabled
+        self.ttl = ttl
+        self.clear()
+
+    def get(self, section, dn):
+        """
+        Get a cached object.
+
+        :param str section: Section name
+        :param str dn: DN of the object
+        :returns: copy of the object, or None if not cached
+        """
+        with self._lock:
+            data = self._section(section)
+            if data is None or dn not in data["items"]:
+                return None
+            return copy.deepcopy(data["items"][dn])
+
+    def get_all(self, section):
+        """
+        Get all objects in a section, if the section is complete.
+
+        :param str section: Section name
+        :returns: list of object copies, or None if not fully cached
+        """
+        with self._lock:
+            data = self._section(section)
+            if data is None or not data["complete"]:
+                return None
+            return copy.deepcopy(list(data["items"].values()))
+
+    def find(self, section, func):
+        """
+        Find a cached object matching a condition.
+
+        :param str section: Section name
+        :param func: Function taking an object and returning True on match
+        :returns: copy of the first matching object, or None
+        """
+        with self._lock:
+            data = self._section(section)
+            for x in (data["items"].values() if data else []):
+                if func(x):
+                    return copy.deepcopy(x)
+        return None
+
+    def set(self, section, dn, obj):
+        """
+        Cache an object.
+
+        :param str section: Section name
+        :param str dn: DN of the object
+        :param obj: Object to cache
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            data = self._section(section, create=True)
+            data["items"][dn] = copy.deepcopy(obj)
+
+    def set_all(self, section, objs):
+        """
+        Cache all objects in a section, replacing those cached before.
+
+        :param str section: Section name
+        :param dict objs: Objects by DN
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self.sections[section] = {
+                "items": copy.deepcopy(objs), "complete": True,
+                "time": time.time()
+            }
+
+    def invalidate(self, section, dn=None):
+        """
+        Drop cached data that has changed.
+
+        The section is no longer complete afterwards, so the next listing is
+        loaded from LDAP again.
+
+        :param str section: Section name
+        :param str dn: DN of the changed object (default all in section)
+        """
+        with self._lock:
+            data = self.sections.get(section)
+            if not data:
+                return
+            if dn is None:
+                del self.sections[section]
+                return
+            data["items"].pop(dn, None)
+            data["complete"] = False
+
+    def invalidate_dn(self, dn):
+        """
+        Drop cached data for an LDAP entry changed outside of arkOS.
+
+        :param str dn: DN of the changed entry
+        """
+        parts = [x.lower() for x in dn.split(",")]
+        if parts and parts[0] == "cn=admins":
+            # Admin group membership is part of user objects
+            self.invalidate("users")
+        for x in parts:
+            if x.startswith("ou=") and x[3:] in SECTIONS:
+                section = SECTIONS[x[3:]]
+                self.invalidate(section, dn if section == x[3:] else None)
+                break
+
+    def clear(self):
+        """Drop all cached data."""
+        with self._lock:
+            self.sections = {}
+
+    def start_sync(self, uri, binddn, passwd, rootdn):
+        """
+        Watch LDAP for changes made outside of arkOS.
+
+        A syncrepl consumer is run in refreshAndPersist mode on a background
+        thread, and invalidates entries as they change. This needs the
+        ``syncprov`` overlay to be enabled on the LDAP server.
+
+        :param str uri: LDAP host URI
+        :param str binddn: DN to bind as
+        :param str passwd: Password to bind with
+        :param str rootdn: Root DN to watch
+        """
+        if self._sync and self._sync.is_alive():
+            return
+        self._sync = threading.Thread(
+            target=_run_sync, args=(self, uri, binddn, passwd, rootdn),
+            name="ldap-syncrepl", daemon=True)
+        self._sync.start()
+
+    def _section(self, section, create=False):
+        data = self.sections.get(section)
+        if data and self.ttl and time.time() - data["time"] > self.ttl:
+            del self.sections[section]
+            data = None
+        if data is None and create:
+            data = {"items": {}, "complete": False, "time": time.time()}
+            self.sections[section] = data
+        return data if self.enabled else None
+
+
+def _run_sync(cache, uri, binddn, passwd, rootdn):
+    """Run a syncrepl consumer invalidating a cache, reconnecting on errors."""
+    from ldap.ldapobject import ReconnectLDAPObject
+    from ldap.syncrepl import SyncreplConsumer
+    from arkos import logger
+
+    class Consumer(ReconnectLDAPObject, SyncreplConsumer):
+        def __init__(self, *args, **kwargs):
+            super(Consumer, self).__init__(*args, **kwargs)
+            self.cookie = None
+            self.uuids = {}
+
+        def syncrepl_get_cookie(self):
+            return self.cookie
+
+        def syncrepl_set_cookie(self, cookie):
+            self.cookie = cookie
+
+        def syncrepl_entry(self, dn, attributes, uuid):
+            self.uuids[uuid] = dn
+            cache.invalidate_dn(dn)
+
+        def syncrepl_delete(self, uuids):
+            for x in uuids:
+                if x in self.uuids:
+                    cache.invalidate_dn(self.uuids.pop(x))
+
+        def syncrepl_present(self, uuids, refreshDeletes=False):
+            pass
+
+        def syncrepl_refreshdone(self):
+            pass
+
+    while True:
+        try:
+            conn = Consumer(uri)
+            conn.simple_bind_s(binddn, passwd)
+            msgid = conn.syncrepl_search(
+                rootdn, ldap.SCOPE_SUBTREE, mode="refreshAndPersist",
+                filterstr="(objectClass=*)", attrlist=["1.1"])
+            while conn.syncrepl_poll(msgid=msgid, all=1):
+                pass
+        except Exception as e:
+            logger.warning(
+                "LDAP", "Change watch failed, retrying: {0}".format(e))
+            # Changes may have been missed while disconnected
+            cache.clear()
+        time.sleep(10)
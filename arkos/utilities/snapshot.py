@@ -0,0 +1,135 @@
+"""
+Classes for keeping a warm-start snapshot of scanned arkOS objects.
+
+arkOS Core
+(c) 2016 CitizenWeb
+Written by Jacob Cook
+Licensed under GPLv3, see LICENSE.md
+"""
+
+import json
+import os
+import threading
+
+
+def file_key(paths):
+    """
+    Compute a validation key for a set of files.
+
+    The key changes whenever any of the files is modified, replaced, resized
+    or removed, so it can be compared against a stored key to find out if
+    data derived from those files is still current.
+
+    :param list paths: paths of files to include in the key
+    :returns: validation key
+    :rtype: list
+    """
+    key = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            key.append([path, None])
+            continue
+        key.append([path, st.st_mtime_ns, st.st_ino, st.st_size])
+    return key
+
+
+class Snapshot:
+    """
+    An on-disk snapshot of data parsed during arkOS scans.
+
+    Entries are grouped by section (``certificates``, ``websites``, etc) and
+    each one stores the validation key of the files it was parsed from. On
+    the next start, scans can fetch an entry and only parse the source files
+    again if their key has changed.
+    """
+
+    VERSION = 1
+
+    def __init__(self):
+        """Initialize an empty snapshot."""
+        self.path = ""
+        self.release = ""
+        self.entries = {}
+        self.seen = {}
+        self._lock = threading.Lock()
+
+    def load(self, path, release=""):
+        """
+        Load the snapshot from file.
+
+        Snapshots written by a different format version or arkOS release are
+        discarded.
+
+        :param str path: Path to snapshot file on disk
+        :param str release: Current arkOS version
+        """
+        self.path = path
+        self.release = release
+        self.entries, self.seen = {}, {}
+        if not path or not os.path.exists(path):
+            return
+        try:
+            with open(path, "r") as f:
+                data = json.loads(f.read())
+        except (IOError, ValueError):
+            return
+        if data.get("version") != self.VERSION \
+                or data.get("release") != release:
+            return
+        self.entries = data.get("entries", {})
+
+    def get(self, section, id, paths):
+        """
+        Fetch the data stored for an entry if it is still valid.
+
+        :param str section: Section name
+        :param str id: Entry identifier
+        :param list paths: paths of files the entry was parsed from
+        :returns: stored data, or None if missing or outdated
+        """
+        with self._lock:
+            self.seen.setdefault(section, set()).add(id)
+            entry = self.entries.get(section, {}).get(id)
+        if not entry or entry["key"] != file_key(paths):
+            return None
+        return entry["data"]
+
+    def set(self, section, id, paths, data):
+        """
+        Store the data for an entry along with its validation key.
+
+        :param str section: Section name
+        :param str id: Entry identifier
+        :param list paths: paths of files the entry was parsed from
+        :param dict data: JSON-serializable data to store
+        """
+        entry = {"key": file_key(paths), "data": data}
+        with self._lock:
+            self.seen.setdefault(section, set()).add(id)
+            self.entries.setdefault(section, {})[id] = entry
+
+    def save(self):
+        """
+        Save the snapshot to disk.
+
+        Entries that were not looked up in a section scanned since the last
+        save are dropped, so removed objects do not linger.
+        """
+        if not self.path:
+            return
+        with self._lock:
+            for section, ids in self.seen.items():
+                entries = self.entries.get(section, {})
+                for id in [x for x in entries if x not in ids]:
+                    del entries[id]
+            self.seen = {}
+            data = {"version": self.VERSION, "release": self.release,
+                    "entries": self.entries}
+            if not os.path.exists(os.path.dirname(self.path)):
+                os.makedirs(os.path.dirname(self.path))
+            tmp = "{0}.tmp".format(self.path)
+            with open(tmp, "w") as f:
+                f.write(json.dumps(data))
+            os.rename(tmp, self.path)
@@ -9,11 +9,10 @@ Licensed under GPLv3, see LICENSE.md
 
 import bz2
 import base64
+import functools
 import gzip
 import os
 import random
-import requests
-import semantic_version
 import shlex
 import socket
 import string
@@ -23,10 +22,14 @@ import tempfile
 import time
 import zipfile
 
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import hashes
-
 from . import errors
+from .lazy import lazy_import
+
+requests = lazy_import("requests")
+semantic_version = lazy_import("semantic_version")
+default_backend = lazy_import(
+    "cryptography.hazmat.backends", "default_backend")
+hashes = lazy_import("cryptography.hazmat.primitives.hashes")
 
 
 def b(text):
@@ -60,6 +63,22 @@ def genAPIKey():
     return base64.b64encode(final, rep).decode('utf-8').rstrip('==')
 
 
+@functools.lru_cache(maxsize=4096)
+def _parse_version(version):
+    """
+    Parse a version string, caching the result.
+
+    :param str version: version string or bytes
+    :returns: semantic_version.Version, or None if it cannot be coerced
+    """
+    if isinstance(version, bytes):
+        version = version.decode()
+    try:
+        return semantic_version.Version.coerce(version)
+    except ValueError:
+        return None
+
+
 def compare_versions(v1, op, v2):
     """
     Compare two versions.
@@ -69,14 +88,8 @@ def compare_versions(v1, op, v2):
 
     `op` choices: gt, gte, lt, lte, eq
     """
-    if type(v1) == bytes:
-        v1 = v1.decode()
-    if type(v2) == bytes:
-        v2 = v2.decode()
-    try:
-        v1 = semantic_version.Version.coerce(v1)
-        v2 = semantic_version.Version.coerce(v2)
-    except ValueError:
+    v1, v2 = _parse_version(v1), _parse_version(v2)
+    if v1 is None or v2 is None:
         return None
     if op == "gt":
         return v1 > v2
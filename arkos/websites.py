@@ -8,9 +8,7 @@ Licensed under GPLv3, see LICENSE.md
 """
 
 import configparser
-import git
 import os
-import nginx
 import re
 import shutil
 import tarfile
@@ -21,7 +19,10 @@ from arkos import tracked_services
 from arkos.messages import Notification, NotificationThread
 from arkos.languages import php
 from arkos.system import users, groups, services
-from arkos.utilities import download, errors, random_string
+from arkos.utilities import download, errors, random_string, lazy_import
+
+git = lazy_import("git")
+nginx = lazy_import("nginx")
 
 
 # If no cipher preferences set, use the default ones
@@ -935,82 +936,110 @@ def get(id=None, type=None, force=False):
 
 def scan():
     """Search website directories for sites, load them and store metadata."""
-    from arkos import certificates
-
     logger.debug("Webs", "Scanning for websites")
-    for x in os.listdir("/etc/nginx/sites-available"):
-        path = os.path.join("/srv/http/webapps", x)
-        if not os.path.exists(path):
-            continue
+    with tracked_services.batch():
+        for x in os.listdir("/etc/nginx/sites-available"):
+            _scan_site(x)
+    return storage.websites
 
-        # Read metadata
-        meta = configparser.SafeConfigParser()
-        if not meta.read(os.path.join(path, ".arkos")):
-            continue
-
-        # Create the proper type of website object
-        app = None
-        app_type = meta.get("website", "app")
-        app = applications.get(app_type)
-        if app and app.type == "website":
-            # If it's a regular website, initialize its class, metadata, etc
-            if not app or not app.loadable or not app.installed:
-                logger.debug(
-                    "Webs", "Website found but could not be loaded: {0}"
-                    .format(meta.get("website", "id")))
-                continue
-            site = app._website(id=meta.get("website", "id"))
-            site.app = app
-            site.data_path = (meta.get("website", "data_path") or "") \
-                if meta.has_option("website", "data_path") else ""
-            site.db = databases.get(site.id) \
-                if meta.has_option("website", "dbengine") else None
-        elif app:
-            # If it's a reverse proxy, follow a simplified procedure
-            site = ReverseProxy(id=meta.get("website", "id"))
-            site.app = app
-        else:
-            # Unknown website type.
+
+def _scan_site(x):
+    """
+    Load a website and its metadata from its nginx serverblock name.
+
+    :param str x: serverblock file name in ``sites-available``
+    """
+    from arkos import certificates
+
+    path = os.path.join("/srv/http/webapps", x)
+    if not os.path.exists(path):
+        return
+
+    # Read metadata
+    meta = configparser.SafeConfigParser()
+    if not meta.read(os.path.join(path, ".arkos")):
+        return
+
+    # Create the proper type of website object
+    app = None
+    app_type = meta.get("website", "app")
+    app = applications.get(app_type)
+    if app and app.type == "website":
+        # If it's a regular website, initialize its class, metadata, etc
+        if not app or not app.loadable or not app.installed:
             logger.debug(
-                "Webs", "Unknown website found and ignoring, id {0}"
-                .format(meta.get("website", "id"))
-            )
-            continue
-        certname = meta.get("website", "ssl", fallback="None")
-        site.cert = certificates.get(certname) if certname != "None" else None
-        if site.cert:
-            site.cert.assigns.append({
-                "type": "website", "id": site.id,
-                "name": site.id if site.app else site.name
-            })
-        site.version = meta.get("website", "version", fallback=None)
-        site.enabled = os.path.exists(
-            os.path.join("/etc/nginx/sites-enabled", x)
+                "Webs", "Website found but could not be loaded: {0}"
+                .format(meta.get("website", "id")))
+            return
+        site = app._website(id=meta.get("website", "id"))
+        site.app = app
+        site.data_path = (meta.get("website", "data_path") or "") \
+            if meta.has_option("website", "data_path") else ""
+        site.db = databases.get(site.id) \
+            if meta.has_option("website", "dbengine") else None
+    elif app:
+        # If it's a reverse proxy, follow a simplified procedure
+        site = ReverseProxy(id=meta.get("website", "id"))
+        site.app = app
+    else:
+        # Unknown website type.
+        logger.debug(
+            "Webs", "Unknown website found and ignoring, id {0}"
+            .format(meta.get("website", "id"))
         )
-        site.installed = True
+        return
+    certname = meta.get("website", "ssl", fallback="None")
+    site.cert = certificates.get(certname) if certname != "None" else None
+    if site.cert:
+        site.cert.assigns.append({
+            "type": "website", "id": site.id,
+            "name": site.id if site.app else site.name
+        })
+    site.version = meta.get("website", "version", fallback=None)
+    site.enabled = os.path.exists(
+        os.path.join("/etc/nginx/sites-enabled", x)
+    )
+    site.installed = True
 
-        # Load the proper nginx serverblock and get more data
-        try:
-            block = nginx.loadf(os.path.join("/etc/nginx/sites-available", x))
-            for y in block.servers:
-                if "ssl" in y.filter("Key", "listen")[0].value:
-                    site.ssl = True
-                    server = y
-                    break
-            else:
-                server = block.server
-            port_regex = re.compile("(\\d+)\s*(.*)")
-            listen = server.filter("Key", "listen")[0].value.lstrip("[::]:")
-            site.port = int(re.match(port_regex, listen).group(1))
-            site.domain = server.filter("Key", "server_name")[0].value
-            site.path = server.filter("Key", "root")[0].value
-            site.php = "php" in server.filter("Key", "index")[0].value
-        except IndexError:
-            pass
-        storage.websites[site.id] = site
-        signals.emit("websites", "site_loaded", site)
+    # Load the proper nginx serverblock and get more data
+    block_path = os.path.join("/etc/nginx/sites-available", x)
+    block = storage.snapshot.get("websites", block_path, [block_path])
+    if block is None:
+        block = _read_server_block(block_path)
+        storage.snapshot.set("websites", block_path, [block_path], block)
+    for y in block:
+        setattr(site, y, block[y])
+    storage.websites[site.id] = site
+    signals.emit("websites", "site_loaded", site)
 
-    return storage.websites
+
+def _read_server_block(path):
+    """
+    Read website metadata from an nginx serverblock file.
+
+    :param str path: path to the serverblock file
+    :returns: site attributes found in the serverblock
+    :rtype: dict
+    """
+    data = {}
+    try:
+        block = nginx.loadf(path)
+        for y in block.servers:
+            if "ssl" in y.filter("Key", "listen")[0].value:
+                data["ssl"] = True
+                server = y
+                break
+        else:
+            server = block.server
+        port_regex = re.compile("(\\d+)\s*(.*)")
+        listen = server.filter("Key", "listen")[0].value.lstrip("[::]:")
+        data["port"] = int(re.match(port_regex, listen).group(1))
+        data["domain"] = server.filter("Key", "server_name")[0].value
+        data["path"] = server.filter("Key", "root")[0].value
+        data["php"] = "php" in server.filter("Key", "index")[0].value
+    except IndexError:
+        pass
+    return data
 
 
 def nginx_reload():
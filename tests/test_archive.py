@@ -0,0 +1,99 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from arkos.system import archive
+from arkos.system.archive import Archive
+
+
+class ArchiveTestCase(unittest.TestCase):
+    tiers = [(1, 10), (5, 4)]
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "stats", "cpu.rrd")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _archive(self):
+        store = Archive(self.path, self.tiers)
+        self.addCleanup(store.close)
+        return store
+
+    def test_create(self):
+        store = self._archive()
+        self.assertEqual(os.path.getsize(self.path), store.file_size)
+        self.assertEqual(store.range(0, 100), [])
+
+    def test_round_trip(self):
+        store = self._archive()
+        for x in range(1000, 1012):
+            store.add(x, float(x % 10))
+        store.close()
+        store = self._archive()
+        self.assertEqual(store.range(1002, 1011, step=5),
+                         [(1000, 2.0, 0.0, 4.0), (1005, 7.0, 5.0, 9.0),
+                          (1010, 0.5, 0.0, 1.0)])
+        self.assertEqual([x[0] for x in store.range(1008, 1100)],
+                         [1008, 1009, 1010, 1011])
+
+    def test_queued_before_flush(self):
+        store = self._archive()
+        for x in range(1000, 1007):
+            store.add(x, 1.0)
+        # Nothing is written to disk until flushed
+        self.assertEqual(store._read_tier(1)[2], 0.0)
+        self.assertEqual(store.range(1000, 1100),
+                         [(1000, 1.0, 1.0, 1.0), (1005, 1.0, 1.0, 1.0)])
+
+    def test_wraps_and_skips_gaps(self):
+        store = self._archive()
+        for x in list(range(1000, 1004)) + list(range(1020, 1023)):
+            store.add(x, 1.0)
+        store.flush()
+        self.assertEqual([x[0] for x in store.range(1013, 1100)],
+                         [1020, 1021, 1022])
+
+    def test_merges_unfinished_slot(self):
+        store = self._archive()
+        store.add(1000, 2.0)
+        store.add(1001, 4.0)
+        store.close()
+        store = self._archive()
+        store.add(1002, 6.0)
+        store.add(1005, 0.0)
+        store.close()
+        store = self._archive()
+        self.assertEqual(store.range(1000, 1004, step=5)[0],
+                         (1000, 4.5, 2.0, 6.0))
+
+    def test_recreated_on_layout_change(self):
+        self._archive().close()
+        store = Archive(self.path, [(1, 20)])
+        self.addCleanup(store.close)
+        self.assertEqual(os.path.getsize(self.path), store.file_size)
+
+
+class GetTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        p = mock.patch.object(archive.config, "get", return_value=self.dir)
+        p.start()
+        self.addCleanup(p.stop)
+        self.addCleanup(archive.close)
+
+    def test_only_recorded(self):
+        self.assertIsNone(archive.get("cpu"))
+        self.assertEqual(os.listdir(self.dir), [])
+        archive.record(1000, {"cpu": 1.0})
+        self.assertIsNotNone(archive.get("cpu"))
+        self.assertEqual(os.listdir(self.dir), ["cpu.rrd"])
+
+    def test_same_file(self):
+        store = archive.get("disk:a/b", create=True)
+        self.assertIs(archive.get("disk_a_b"), store)
+        self.assertEqual(len(archive._archives), 1)
@@ -0,0 +1,148 @@
+import threading
+import unittest
+
+from arkos.connections import LDAPPool, PooledLDAP, ldap_search
+
+try:
+    import ldap
+    from ldap.controls import SimplePagedResultsControl
+except ImportError:
+    ldap = SimplePagedResultsControl = None
+
+
+class FakeConnection:
+    def __init__(self, n):
+        self.n = n
+        self.unbound = False
+
+    def whoami_s(self):
+        return self.n
+
+    def unbind_s(self):
+        self.unbound = True
+
+
+class LDAPPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.opened = []
+        self.pool = LDAPPool(self._open, size=2)
+
+    def _open(self):
+        conn = FakeConnection(len(self.opened))
+        self.opened.append(conn)
+        return conn
+
+    def test_opens_lazily(self):
+        self.assertEqual(self.opened, [])
+        conn = self.pool.acquire()
+        self.assertEqual(len(self.opened), 1)
+        self.pool.release(conn)
+
+    def test_reuses_idle(self):
+        conn = self.pool.acquire()
+        self.pool.release(conn)
+        self.assertIs(self.pool.acquire(), conn)
+        self.assertEqual(len(self.opened), 1)
+
+    def test_blocks_at_size(self):
+        first, second = self.pool.acquire(), self.pool.acquire()
+        got = []
+        t = threading.Thread(target=lambda: got.append(self.pool.acquire()))
+        t.start()
+        t.join(0.1)
+        self.assertEqual(got, [])
+        self.pool.release(first)
+        t.join(1)
+        self.assertEqual(got, [first])
+        self.assertEqual(len(self.opened), 2)
+        self.pool.release(second)
+
+    def test_discard(self):
+        conn = self.pool.acquire()
+        self.pool.release(conn, discard=True)
+        self.assertTrue(conn.unbound)
+        self.assertIsNot(self.pool.acquire(), conn)
+
+    def test_close(self):
+        conn = self.pool.acquire()
+        self.pool.release(conn)
+        self.pool.close()
+        self.assertTrue(conn.unbound)
+        self.assertIsNot(self.pool.acquire(), conn)
+
+    def test_pooled_calls(self):
+        ldap = PooledLDAP(self.pool)
+        self.assertEqual(ldap.whoami_s(), 0)
+        self.assertEqual(ldap.whoami_s(), 0)
+        self.assertEqual(len(self.opened), 1)
+
+    def test_pooled_connection_held(self):
+        ldap = PooledLDAP(self.pool)
+        with ldap.connection() as conn:
+            self.assertEqual(self.pool._idle, [])
+        self.assertEqual(self.pool._idle, [conn])
+
+
+class PagedConnection:
+    """Serve search results in pages, as a server would."""
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.searches = []
+        self.abandoned = []
+        self.pending = {}
+
+    def search_ext(self, base, scope, filterstr, attrlist, serverctrls):
+        ctrl = serverctrls[0]
+        start = int(ctrl.cookie or 0)
+        end = start + ctrl.size
+        msgid = len(self.searches) + 1
+        self.searches.append(msgid)
+        cookie = str(end).encode() if end < len(self.entries) else b""
+        self.pending[msgid] = \
+            [(ldap.RES_SEARCH_ENTRY, [x], []) for x in
+             self.entries[start:end]] + \
+            [(ldap.RES_SEARCH_RESULT, [], [SimplePagedResultsControl(
+                False, size=0, cookie=cookie)])]
+        return msgid
+
+    def result3(self, msgid, all=1):
+        rtype, rdata, rctrls = self.pending[msgid].pop(0)
+        return (rtype, rdata, msgid, rctrls)
+
+    def abandon(self, msgid):
+        self.abandoned.append(msgid)
+
+
+@unittest.skipIf(SimplePagedResultsControl is None, "pyldap is not installed")
+class LDAPSearchTestCase(unittest.TestCase):
+    entries = [("uid=user{0},ou=users,dc=arkos-servers,dc=org".format(x),
+                {"uid": [str(x).encode()]}) for x in range(7)]
+
+    def test_pages(self):
+        conn = PagedConnection(self.entries)
+        results = list(ldap_search(conn, "ou=users", ldap.SCOPE_SUBTREE,
+                                   attrlist=["uid"], page_size=3))
+        self.assertEqual(results, self.entries)
+        self.assertEqual(len(conn.searches), 3)
+        self.assertEqual(conn.abandoned, [])
+
+    def test_abandon_early_exit(self):
+        conn = PagedConnection(self.entries)
+        search = ldap_search(conn, "ou=users", ldap.SCOPE_SUBTREE,
+                             attrlist=["uid"], page_size=3)
+        next(search)
+        search.close()
+        self.assertEqual(conn.abandoned, [1])
+
+    def test_pooled(self):
+        conn = PagedConnection(self.entries)
+        pool = LDAPPool(lambda: conn, size=1)
+        search = ldap_search(PooledLDAP(pool), "ou=users",
+                             ldap.SCOPE_SUBTREE, attrlist=["uid"],
+                             page_size=5)
+        next(search)
+        self.assertEqual(pool._idle, [])
+        self.assertEqual(len(list(search)), 6)
+        self.assertEqual(pool._idle, [conn])
+
@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from arkos.system import users, groups
+
+
+class FakeLDAP:
+    def __init__(self, entries):
+        self.entries = entries
+        self.searches = 0
+
+    def search_s(self, base, scope, filterstr, attrlist):
+        self.searches += 1
+        return self.entries
+
+
+class NextIDTestCase(unittest.TestCase):
+    module = users
+    attr = "uidNumber"
+
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.path = os.path.join(tmp, "db")
+        with open(self.path, "w") as f:
+            f.write("root:x:0:0\n")
+        name = "PASSWD_FILE" if self.module is users else "GROUP_FILE"
+        for p in [mock.patch.object(self.module, name, self.path),
+                  mock.patch.object(self.module, "conns"),
+                  mock.patch.object(self.module, "config"),
+                  mock.patch.dict(self.module._index,
+                                  {"current": None, "next": None})]:
+            p.start()
+            self.addCleanup(p.stop)
+        self.local = max(self.module._get_index()["next_" + self.attr[:3]],
+                         5000)
+        self.conn = FakeLDAP([
+            ("cn=a", {self.attr: [str(self.local - 1).encode()]}),
+            ("cn=b", {})
+        ])
+        self.module.conns.LDAP = self.conn
+
+    def next_id(self):
+        if self.module is users:
+            return users.get_next_uid()
+        return groups.get_next_gid()
+
+    def added(self, ids):
+        if self.module is users:
+            users._index_added(ids)
+        else:
+            with mock.patch.object(groups, "storage"):
+                groups._invalidate(gids=ids)
+
+    def test_ldap_searched_once(self):
+        self.assertEqual(self.next_id(), self.local)
+        self.assertEqual(self.next_id(), self.local)
+        self.assertEqual(self.conn.searches, 1)
+
+    def test_add_bumps(self):
+        self.next_id()
+        self.added([self.local, self.local + 4])
+        self.assertEqual(self.next_id(), self.local + 5)
+        self.added([self.local + 1])
+        self.assertEqual(self.next_id(), self.local + 5)
+        self.assertEqual(self.conn.searches, 1)
+        self.assertIsNone(self.module._index["current"])
+
+    def test_file_change(self):
+        self.next_id()
+        with open(self.path, "a") as f:
+            f.write("new:x:1:1\n")
+        self.next_id()
+        self.assertEqual(self.conn.searches, 2)
+
+
+class NextGIDTestCase(NextIDTestCase):
+    module = groups
+    attr = "gidNumber"
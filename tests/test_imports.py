@@ -0,0 +1,97 @@
+import os
+import re
+import subprocess
+import sys
+import unittest
+
+
+HEAVY_MODULES = [
+    "cryptography", "dbus", "git", "ldap", "miniupnpc", "nginx", "pacman",
+    "parted", "pycryptsetup", "requests"
+]
+
+# Top-level names of third-party dependencies; tests are skipped instead
+# of failed if one of these is not installed
+DEPENDENCIES = HEAVY_MODULES + [
+    "click", "free_tls_certificates", "gnupg", "netifaces", "ntplib",
+    "passlib", "psutil", "semantic_version"
+]
+
+# Budget for the cumulative import time of a module, in milliseconds
+IMPORT_BUDGET = int(os.environ.get("ARKOS_IMPORT_BUDGET", 200))
+
+
+class MissingDependency(ImportError):
+    """Raised when a third-party dependency is not installed."""
+
+
+def import_times(module):
+    """
+    Import a module in a fresh interpreter and return ``-X importtime`` data.
+
+    :param str module: name of module to import
+    :returns: dict of module names to (self, cumulative) time in microseconds
+    """
+    p = subprocess.Popen(
+        [sys.executable, "-X", "importtime", "-c",
+         "import {0}".format(module)],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    data = p.communicate()[1].decode()
+    if p.returncode != 0:
+        error = data.strip().splitlines()[-1]
+        match = re.match(
+            r"ModuleNotFoundError: No module named '([^']+)'", error)
+        if match and match.group(1).split(".")[0] in DEPENDENCIES:
+            raise MissingDependency(match.group(1))
+        raise ImportError("\n".join(
+            x for x in data.strip().splitlines()
+            if not x.startswith("import time:")))
+    times = {}
+    for line in data.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        fields = line.split(":", 1)[1].split("|")
+        times[fields[2].strip()] = (int(fields[0]), int(fields[1]))
+    return times
+
+
+class ImportTimeTestCase(unittest.TestCase):
+    def setUp(self):
+        if sys.version_info < (3, 7):
+            self.skipTest("-X importtime requires Python 3.7+")
+
+    def _import_times(self, module):
+        try:
+            return import_times(module)
+        except MissingDependency as e:
+            self.skipTest("{0} needs {1}, which is not installed".format(
+                module, e))
+        except ImportError as e:
+            self.fail("{0} could not be imported:\n{1}".format(module, e))
+
+    def _check_deferred(self, module):
+        times = self._import_times(module)
+        for x in times:
+            self.assertNotIn(x.split(".")[0], HEAVY_MODULES,
+                             "{0} imported by {1}".format(x, module))
+
+    def test_core_defers_heavy_imports(self):
+        self._check_deferred("arkos")
+
+    def test_ctl_defers_heavy_imports(self):
+        self._check_deferred("arkos.ctl")
+
+    def test_ctl_import_budget(self):
+        times = self._import_times("arkos.ctl")
+        self.assertLessEqual(times["arkos.ctl"][1] / 1000.0, IMPORT_BUDGET)
+
+
+if __name__ == "__main__":
+    # Print the slowest imports for a module: python -m tests.test_imports
+    module = sys.argv[1] if len(sys.argv) > 1 else "arkos.ctl"
+    times = import_times(module)
+    for name, (tself, tcumul) in sorted(
+            times.items(), key=lambda x: x[1][1], reverse=True)[:25]:
+        print("{0:>10.1f} ms {1:>10.1f} ms  {2}".format(
+            tcumul / 1000.0, tself / 1000.0, name))
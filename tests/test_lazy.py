@@ -0,0 +1,50 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from arkos.utilities.lazy import LazyModule, lazy_import
+
+
+class LazyImportTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        pkg = os.path.join(self.dir, "lazypkg")
+        os.mkdir(pkg)
+        with open(os.path.join(pkg, "__init__.py"), "w") as f:
+            f.write("VALUE = 1\n")
+        with open(os.path.join(pkg, "sub.py"), "w") as f:
+            f.write("VALUE = 2\n")
+        sys.path.insert(0, self.dir)
+
+    def tearDown(self):
+        sys.path.remove(self.dir)
+        for x in ["lazypkg", "lazypkg.sub"]:
+            sys.modules.pop(x, None)
+        shutil.rmtree(self.dir)
+
+    def test_deferred(self):
+        module = lazy_import("lazypkg")
+        self.assertNotIn("lazypkg", sys.modules)
+        self.assertEqual(module.VALUE, 1)
+        self.assertEqual(module.sub.VALUE, 2)
+
+    def test_already_imported(self):
+        import lazypkg
+        module = lazy_import("lazypkg")
+        self.assertIsInstance(module, LazyModule)
+        self.assertEqual(module.VALUE, 1)
+        # Submodules the package does not import itself still resolve
+        self.assertEqual(module.sub.VALUE, 2)
+        self.assertIs(module.sub, sys.modules["lazypkg.sub"])
+        self.assertIs(lazypkg.sub, module.sub)
+
+    def test_attribute(self):
+        value = lazy_import("lazypkg", "sub")
+        self.assertEqual(value.VALUE, 2)
+
+    def test_missing_attribute(self):
+        module = lazy_import("lazypkg")
+        with self.assertRaises(AttributeError):
+            module.missing
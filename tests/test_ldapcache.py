@@ -0,0 +1,72 @@
+import unittest
+from unittest import mock
+
+from arkos.utilities import ldapcache
+from arkos.utilities.ldapcache import LDAPCache
+
+ALICE = "uid=alice,ou=users,dc=arkos-servers,dc=org"
+BOB = "uid=bob,ou=users,dc=arkos-servers,dc=org"
+ADMINS = "cn=admins,ou=groups,dc=arkos-servers,dc=org"
+
+
+class LDAPCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache = LDAPCache()
+        self.cache.configure(True, 60)
+
+    def test_get_set(self):
+        self.assertIsNone(self.cache.get("users", ALICE))
+        obj = {"name": "alice"}
+        self.cache.set("users", ALICE, obj)
+        obj["name"] = "changed"
+        data = self.cache.get("users", ALICE)
+        self.assertEqual(data, {"name": "alice"})
+        # Callers get copies
+        data["name"] = "changed"
+        self.assertEqual(self.cache.get("users", ALICE), {"name": "alice"})
+
+    def test_find(self):
+        self.cache.set("users", ALICE, {"uid": 1000})
+        self.cache.set("users", BOB, {"uid": 1001})
+        self.assertEqual(self.cache.find("users", lambda x: x["uid"] == 1001),
+                         {"uid": 1001})
+        self.assertIsNone(self.cache.find("users", lambda x: False))
+
+    def test_get_all(self):
+        self.cache.set("users", ALICE, {"name": "alice"})
+        self.assertIsNone(self.cache.get_all("users"))
+        self.cache.set_all("users", {ALICE: {"name": "alice"},
+                                     BOB: {"name": "bob"}})
+        self.assertEqual(len(self.cache.get_all("users")), 2)
+
+    def test_invalidate(self):
+        self.cache.set_all("users", {ALICE: {"name": "alice"},
+                                     BOB: {"name": "bob"}})
+        self.cache.invalidate("users", ALICE)
+        self.assertIsNone(self.cache.get("users", ALICE))
+        self.assertEqual(self.cache.get("users", BOB), {"name": "bob"})
+        self.assertIsNone(self.cache.get_all("users"))
+        self.cache.invalidate("users")
+        self.assertIsNone(self.cache.get("users", BOB))
+
+    def test_invalidate_dn(self):
+        self.cache.set("users", ALICE, {"name": "alice"})
+        self.cache.set("groups", ADMINS, {"name": "admins"})
+        self.cache.invalidate_dn(ADMINS)
+        self.assertIsNone(self.cache.get("users", ALICE))
+        self.assertIsNone(self.cache.get("groups", ADMINS))
+
+    def test_expiry(self):
+        with mock.patch.object(ldapcache.time, "time", return_value=1000.0):
+            self.cache.set("users", ALICE, {"name": "alice"})
+        with mock.patch.object(ldapcache.time, "time", return_value=1059.0):
+            self.assertIsNotNone(self.cache.get("users", ALICE))
+        with mock.patch.object(ldapcache.time, "time", return_value=1061.0):
+            self.assertIsNone(self.cache.get("users", ALICE))
+
+    def test_disabled(self):
+        self.cache.configure(False)
+        self.cache.set("users", ALICE, {"name": "alice"})
+        self.cache.set_all("users", {ALICE: {"name": "alice"}})
+        self.assertIsNone(self.cache.get("users", ALICE))
+        self.assertIsNone(self.cache.get_all("users"))
@@ -0,0 +1,44 @@
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from arkos.system import network
+
+
+class ActiveRangesTestCase(unittest.TestCase):
+    def test_ranges(self):
+        ifaces = [
+            SimpleNamespace(ip=[{"addr": "127.0.0.1",
+                                 "netmask": "255.0.0.0"}]),
+            SimpleNamespace(ip=[{"addr": "192.168.1.20",
+                                 "netmask": "255.255.255.0"},
+                                {"addr": "192.168.1.21",
+                                 "netmask": "255.255.255.0"}]),
+            SimpleNamespace(ip=[{"addr": "10.8.0.2", "netmask": None}])
+        ]
+        with mock.patch.object(network, "get_interfaces",
+                               return_value=ifaces):
+            self.assertEqual(network.get_active_ranges(),
+                             ["192.168.1.0/24"])
+
+
+class CounterTestCase(unittest.TestCase):
+    def test_increase(self):
+        self.assertEqual(network._counter_delta(1000, 1500), 500)
+
+    def test_wrap(self):
+        self.assertEqual(network._counter_delta(2 ** 32 - 100, 50), 150)
+        self.assertEqual(network._counter_delta(2 ** 64 - 100, 50), 150)
+
+    def test_reset(self):
+        self.assertEqual(network._counter_delta(2 ** 31, 1000), 0)
+        self.assertEqual(network._counter_delta(2 ** 40, 1000), 0)
+
+    def test_tracker_reset(self):
+        tracker = network.RateTracker()
+        tracker.update(0, 10 ** 6, 10 ** 6)
+        tracker.update(1, 2 * 10 ** 6, 3 * 10 ** 6)
+        tracker.update(2, 500, 500)
+        self.assertEqual(tracker.history[-1], (2, 0.0, 0.0))
+        tracker.update(3, 1500, 2500)
+        self.assertEqual(tracker.history[-1], (3, 1000.0, 2000.0))
@@ -1,7 +1,9 @@
+import io
 import unittest
 
 from arkos import conns, connections
 from arkos.system import users, groups, domains
+from arkos.utilities import errors
 from mockldap import MockLdap
 
 from . import init_testing
@@ -90,6 +92,12 @@ class RolesTestCase(unittest.TestCase):
         self.assertIn(u.last_name, ["", None])
         self.assertTrue(u.verify_passwd("mypass"))
 
+    def test_add_users_in_a_row(self):
+        _add_test_user("testuser1")
+        _add_test_user("testuser2")
+        self.assertNotEqual(users.get(name="testuser1").uid,
+                            users.get(name="testuser2").uid)
+
     def test_del_user(self):
         _add_test_user("testuser")
         u = users.get(name="testuser")
@@ -126,6 +134,12 @@ class RolesTestCase(unittest.TestCase):
         g = groups.get(name="testgroup")
         self.assertEqual(g.users, ["testuser2"])
 
+    def test_add_groups_in_a_row(self):
+        groups.Group(name="testgroup1", users=[]).add()
+        groups.Group(name="testgroup2", users=[]).add()
+        self.assertNotEqual(groups.get(name="testgroup1").gid,
+                            groups.get(name="testgroup2").gid)
+
     def test_del_group(self):
         g = groups.Group(name="testgroup", users=[])
         g.add()
@@ -145,6 +159,55 @@ class RolesTestCase(unittest.TestCase):
         d.remove()
         self.assertIsNone(domains.get("testdomain.xyz"))
 
+    def test_del_domain_in_use(self):
+        _add_test_user("testuser")
+        d = domains.get("localhost")
+        with self.assertRaises(errors.InvalidConfigError):
+            d.remove()
+        self.assertIsNotNone(domains.get("localhost"))
+
+    def test_csv_round_trip(self):
+        _add_test_user("testuser")
+        f = io.StringIO()
+        self.assertEqual(users.write_entries(f, "csv"), 1)
+        users.get(name="testuser").delete()
+        f.seek(0)
+        added, failed = users.bulk_add(users.read_entries(f, "csv"))
+        self.assertEqual(failed, {})
+        u = users.get(name="testuser")
+        self.assertEqual(u.first_name, "Test")
+        self.assertEqual(u.domain, "localhost")
+        self.assertTrue(u.admin)
+        self.assertTrue(u.verify_passwd("testpass"))
+
+    def test_csv_import_needs_password(self):
+        f = io.StringIO("name,domain\ntestuser,localhost\n")
+        added, failed = users.bulk_add(users.read_entries(f, "csv"))
+        self.assertEqual(added, [])
+        self.assertIn("testuser", failed)
+
+    def test_ldif_round_trip(self):
+        _add_test_user("testuser")
+        f = io.StringIO()
+        self.assertEqual(users.write_entries(f, "ldif"), 1)
+        users.get(name="testuser").delete()
+        f.seek(0)
+        added, failed = users.bulk_add(users.read_entries(f, "ldif"))
+        self.assertEqual(failed, {})
+        self.assertTrue(
+            users.get(name="testuser").verify_passwd("testpass"))
+
+    def test_group_round_trip(self):
+        _add_test_user("testuser1")
+        groups.Group(name="testgroup", users=["testuser1"]).add()
+        f = io.StringIO()
+        groups.write_entries(f, "csv")
+        groups.get(name="testgroup").delete()
+        f.seek(0)
+        added, failed = groups.bulk_add(groups.read_entries(f, "csv"))
+        self.assertEqual(failed, {})
+        self.assertEqual(groups.get(name="testgroup").users, ["testuser1"])
+
 
 def _add_test_user(uname):
     u = users.User(
@@ -0,0 +1,136 @@
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from arkos import security
+
+
+def _policy(policy, ports, ranges=None):
+    data = SimpleNamespace(policy=policy, ports=ports)
+    if ranges is not None:
+        data.allowed_ranges = ranges
+    return data
+
+
+class IptablesRulesTestCase(unittest.TestCase):
+    def test_render_anywhere(self):
+        self.assertEqual(
+            security.render_rule("ACCEPT", "TCP", "80", ["anywhere"]),
+            ["-A arkos-apps -p tcp -m tcp --dport 80 -j ACCEPT"])
+
+    def test_render_ranges(self):
+        self.assertEqual(
+            security.render_rule("ACCEPT", "udp", 53,
+                                 ["192.168.0.1/24", "10.0.0.0/8"]),
+            ["-A arkos-apps -s 192.168.0.0/24 -p udp -m udp --dport 53 "
+             "-j ACCEPT",
+             "-A arkos-apps -s 10.0.0.0/8 -p udp -m udp --dport 53 "
+             "-j ACCEPT"])
+
+    def test_render_reject(self):
+        self.assertEqual(
+            security.render_rule("REJECT", "tcp", 22),
+            ["-A arkos-apps -p tcp -m tcp --dport 22 -j REJECT "
+             "--reject-with icmp-port-unreachable"])
+
+    def test_apply_rules(self):
+        with mock.patch.object(security, "shell",
+                               return_value={"code": 0}) as shell:
+            security.apply_rules(["-A arkos-apps -j RETURN"],
+                                 flush=["arkos-apps"])
+        shell.assert_called_once_with(
+            "iptables-restore --noflush",
+            stdin="*filter\n:arkos-apps - [0:0]\n-A arkos-apps -j RETURN\n"
+                  "COMMIT\n")
+
+    def test_chain_rules(self):
+        out = {"code": 0, "stdout": b"-N arkos-apps\n"
+               b"-A arkos-apps -j RETURN\n"}
+        with mock.patch.object(security, "shell", return_value=out):
+            self.assertEqual(security.get_chain_rules("arkos-apps"),
+                             ["-A arkos-apps -j RETURN"])
+        with mock.patch.object(security, "shell", return_value={"code": 1}):
+            self.assertIsNone(security.get_chain_rules("arkos-apps"))
+
+
+class IptablesBackendTestCase(unittest.TestCase):
+    policies = [
+        _policy(2, [("tcp", 80)]),
+        _policy(1, [("tcp", 8000)]),
+        _policy(0, [("udp", 9000)])
+    ]
+    rules = [
+        "-A arkos-apps -p udp -m udp --dport 9000 -j REJECT "
+        "--reject-with icmp-port-unreachable",
+        "-A arkos-apps -s 192.168.0.0/24 -p tcp -m tcp --dport 8000 "
+        "-j ACCEPT",
+        "-A arkos-apps -p tcp -m tcp --dport 80 -j ACCEPT",
+        "-A arkos-apps -j RETURN"
+    ]
+
+    def _regenerate(self, current):
+        with mock.patch.object(security, "get_chain_rules",
+                               return_value=current), \
+                mock.patch.object(security, "apply_rules") as apply, \
+                mock.patch.object(security, "save_rules"), \
+                mock.patch.object(security.signals, "emit"):
+            security.IptablesBackend().regenerate(
+                self.policies, ["192.168.0.0/24"])
+        return apply
+
+    def test_applies_changed_rules(self):
+        apply = self._regenerate([])
+        apply.assert_called_once_with(self.rules, flush=["arkos-apps"])
+
+    def test_skips_unchanged_rules(self):
+        apply = self._regenerate(list(self.rules))
+        apply.assert_not_called()
+
+
+class NftablesBackendTestCase(unittest.TestCase):
+    def _render(self, policies, default_range=["192.168.0.0/24"]):
+        return security.NftablesBackend().render(policies, default_range)
+
+    def test_port_maps(self):
+        ruleset = self._render([
+            _policy(2, [("tcp", 80)]),
+            _policy(1, [("tcp", 8000)]),
+            _policy(0, [("udp", 9000)])
+        ])
+        self.assertIn("elements = { 192.168.0.0/24 }", ruleset)
+        self.assertIn("elements = { 80 : accept, 8000 : jump local_only }",
+                      ruleset)
+        self.assertIn("elements = { 9000 : jump restricted }", ruleset)
+
+    def test_own_ranges(self):
+        ruleset = self._render([
+            _policy(1, [("tcp", 8000)], ["10.0.0.0/8"]),
+            _policy(1, [("udp", 9000)], ["172.16.0.0/12"])
+        ]).splitlines()
+        accept = ruleset.index(
+            "        tcp dport 8000 ip saddr { 10.0.0.0/8 } accept")
+        reject = ruleset.index("        tcp dport 8000 reject")
+        self.assertLess(accept, reject)
+        self.assertEqual(reject - accept, 1)
+        accept = ruleset.index(
+            "        udp dport 9000 ip saddr { 172.16.0.0/12 } accept")
+        self.assertLess(accept, ruleset.index("        udp dport 9000 reject"))
+        self.assertFalse([x for x in ruleset if "8000 :" in x])
+
+    def test_empty_own_ranges(self):
+        ruleset = self._render([_policy(1, [("tcp", 8000)], [])])
+        self.assertNotIn("ip saddr {", ruleset)
+        self.assertIn("tcp dport 8000 reject", ruleset)
+
+    def test_empty_default_range(self):
+        ruleset = self._render([], [])
+        self.assertNotIn("elements", ruleset)
+
+    def test_skips_unchanged_ruleset(self):
+        backend = security.NftablesBackend()
+        with mock.patch.object(security, "shell",
+                               return_value={"code": 0}) as shell, \
+                mock.patch.object(backend, "save"):
+            backend.regenerate([_policy(2, [("tcp", 80)])], [])
+            backend.regenerate([_policy(2, [("tcp", 80)])], [])
+        self.assertEqual(shell.call_count, 1)
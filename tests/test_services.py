@@ -0,0 +1,253 @@
+import datetime
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from arkos.system import services
+
+
+class FinishJobTestCase(unittest.TestCase):
+    def setUp(self):
+        self.svc = services.Service("nginx", "systemd")
+        patcher = mock.patch.object(services, "conns")
+        self.conns = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.conns.SystemDConnect.return_value.Get.return_value = "active"
+
+    def _finish(self, watching, end=None):
+        job = ("/unit/nginx", "/job/1", watching)
+        self.svc._finish_job(job, "start", "running", end or time.time())
+
+    def test_signal(self):
+        with mock.patch.object(services, "_wait_job",
+                               return_value="done") as wait, \
+                mock.patch.object(services, "_poll_job") as poll:
+            self._finish(True)
+        wait.assert_called_once()
+        poll.assert_not_called()
+        self.assertEqual(self.svc.state, "running")
+
+    def test_signal_failed(self):
+        with mock.patch.object(services, "_wait_job", return_value="failed"):
+            with self.assertRaises(services.ActionError):
+                self._finish(True)
+
+    def test_poll_without_signals(self):
+        with mock.patch.object(services, "_wait_job") as wait, \
+                mock.patch.object(services, "_poll_job",
+                                  return_value=True):
+            self._finish(False)
+        wait.assert_not_called()
+        self.assertEqual(self.svc.state, "running")
+
+    def test_poll_on_missed_signal(self):
+        with mock.patch.object(services, "_wait_job", return_value=None), \
+                mock.patch.object(services, "_poll_job",
+                                  return_value=True) as poll:
+            self._finish(True)
+        poll.assert_called_once_with("/job/1", 0)
+        self.assertEqual(self.svc.state, "running")
+
+    def test_timeout(self):
+        with mock.patch.object(services, "_poll_job", return_value=False):
+            with self.assertRaises(services.ActionError):
+                self._finish(False)
+
+
+class SubscribeTestCase(unittest.TestCase):
+    def tearDown(self):
+        services.watch_signals(False)
+
+    def test_polls_by_default(self):
+        with mock.patch.object(services, "conns") as conns:
+            self.assertFalse(services._subscribe())
+        conns.SystemD.Subscribe.assert_not_called()
+
+    def test_registered_loop(self):
+        services.watch_signals()
+        with mock.patch.object(services, "conns") as conns, \
+                mock.patch.object(services, "dbus"):
+            self.assertTrue(services._subscribe())
+            services.watch_signals(False)
+            self.assertFalse(services._subscribe())
+        conns.SystemD.Subscribe.assert_called_once_with()
+        services._cache["bus"] = None
+
+
+class UnitCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        units = {"nginx": {"state": "stopped", "enabled": True,
+                           "file": True}}
+        p = mock.patch.dict(services._cache, {"units": units,
+                                              "time": time.time()})
+        p.start()
+        self.addCleanup(p.stop)
+
+    def test_copy(self):
+        units = services._get_units()
+        services._on_unit_new("redis.service", "/unit/redis")
+        services._update_unit("nginx.service", state="running")
+        self.assertEqual(units, {"nginx": {"state": "stopped",
+                                           "enabled": True, "file": True}})
+        self.assertEqual(sorted(services._get_units()), ["nginx", "redis"])
+        self.assertEqual(services.get("nginx").state, "running")
+
+
+class SupervisorBulkTestCase(unittest.TestCase):
+    def setUp(self):
+        self.svcs = [services.Service("a", "supervisor"),
+                     services.Service("b", "supervisor")]
+        for p in [mock.patch.object(services, "conns"),
+                  mock.patch.object(services, "supervisor_ping"),
+                  mock.patch.object(services.signals, "emit")]:
+            p.start()
+            self.addCleanup(p.stop)
+        self.multicall = services.conns.SupervisorRPC.system.multicall
+
+    def test_single_request(self):
+        self.multicall.return_value = [True, True, True, True]
+        results = services.supervisor_bulk("restart", self.svcs)
+        self.assertEqual(results, {"a": None, "b": None})
+        calls = self.multicall.call_args[0][0]
+        self.assertEqual(self.multicall.call_count, 1)
+        self.assertEqual([(x["methodName"], x["params"][0]) for x in calls],
+                         [("supervisor.stopProcess", "a"),
+                          ("supervisor.stopProcess", "b"),
+                          ("supervisor.startProcess", "a"),
+                          ("supervisor.startProcess", "b")])
+        self.assertEqual([x.state for x in self.svcs],
+                         ["running", "running"])
+
+    def test_faults(self):
+        self.multicall.return_value = [
+            {"faultCode": services.SUPERVISOR_ALREADY_STARTED,
+             "faultString": "ALREADY_STARTED"},
+            {"faultCode": 10, "faultString": "BAD_NAME"}
+        ]
+        results = services.supervisor_bulk("start", self.svcs)
+        self.assertEqual(results, {"a": None, "b": "BAD_NAME"})
+        self.assertEqual(self.svcs[0].state, "running")
+        self.assertEqual(self.svcs[1].state, "")
+
+    def test_unknown_action(self):
+        with self.assertRaises(services.ActionError):
+            services.supervisor_bulk("enable", self.svcs)
+
+
+class SupervisorPingTestCase(unittest.TestCase):
+    def test_trusted(self):
+        services._supervisor["checked"] = 0.0
+        with mock.patch.object(services, "conns") as conns:
+            services.supervisor_ping()
+            services.supervisor_ping()
+        conns.Supervisor.getState.assert_called_once_with()
+        services._supervisor["checked"] = 0.0
+
+
+class BulkTestCase(unittest.TestCase):
+    def _get(self, id):
+        if id.startswith("nginx"):
+            return services.Service("nginx", "system")
+
+    def test_results_by_given_id(self):
+        with mock.patch.object(services, "get", side_effect=self._get), \
+                mock.patch.object(services.Service, "_queue_job"), \
+                mock.patch.object(services.Service, "_finish_job",
+                                  side_effect=services.ActionError(
+                                      "svc", "failed")), \
+                mock.patch.object(services.signals, "emit"):
+            results = services.bulk("start", ["nginx.service", "nope"])
+        self.assertEqual(results, {"nginx.service": "failed",
+                                   "nope": "No such service"})
+
+
+class JournalTestCase(unittest.TestCase):
+    def _read(self, entries, **kwargs):
+        out = io.BytesIO(b"".join(json.dumps(x).encode() + b"\n"
+                                  for x in entries))
+        with mock.patch.dict(sys.modules, {"systemd": None}), \
+                mock.patch.object(services.subprocess, "Popen") as popen:
+            popen.return_value.stdout = out
+            data = list(services._iter_journal("nginx.service", **kwargs))
+        return popen.call_args[0][0], data
+
+    def test_entries(self):
+        cmd, data = self._read([
+            {"__REALTIME_TIMESTAMP": "1500000000000000", "PRIORITY": "6",
+             "MESSAGE": "Started", "__CURSOR": "s=1"},
+            {"__REALTIME_TIMESTAMP": "1500000001000000",
+             "MESSAGE": [104, 105, 7], "__CURSOR": "s=2"}
+        ])
+        self.assertEqual(
+            cmd, ["journalctl", "--no-pager", "-o", "json", "-u",
+                  "nginx.service"])
+        self.assertEqual(data[0], {
+            "time": datetime.datetime.fromtimestamp(1500000000),
+            "priority": 6, "message": "Started", "cursor": "s=1"})
+        self.assertEqual(data[1]["message"], "hi\x07")
+        self.assertIsNone(data[1]["priority"])
+
+    def test_filters(self):
+        cmd, _ = self._read([], cursor="s=1", priority=3, this_boot=True)
+        self.assertEqual(cmd[6:], ["-b", "0", "--after-cursor", "s=1",
+                                   "-p", "3"])
+        since = datetime.datetime(2017, 1, 2, 3, 4, 5)
+        cmd, _ = self._read([], since=since)
+        self.assertEqual(cmd[6:], ["--since", "2017-01-02 03:04:05"])
+
+
+class LimitsTestCase(unittest.TestCase):
+    cfg = {"command": "/usr/bin/gitea web", "user": "gitea",
+           "directory": "/var/lib/gitea"}
+
+    def test_wrap_command(self):
+        cfg = services._wrap_command(
+            self.cfg, {"MemoryMax": "256M", "CPUWeight": 50})
+        self.assertEqual(
+            cfg["command"], "systemd-run --scope --quiet --uid=gitea "
+            "-p CPUWeight=50 -p MemoryMax=256M -- /usr/bin/gitea web")
+        self.assertNotIn("user", cfg)
+        self.assertEqual(cfg["directory"], "/var/lib/gitea")
+        self.assertEqual(
+            services._unwrap_command(cfg),
+            ("/usr/bin/gitea web", "gitea",
+             {"CPUWeight": "50", "MemoryMax": "256M"}))
+
+    def test_unwrap_plain(self):
+        self.assertEqual(services._unwrap_command(self.cfg),
+                         ("/usr/bin/gitea web", "gitea", {}))
+
+    def test_clear_limits(self):
+        cfg = services._wrap_command(self.cfg, {"TasksMax": 64})
+        self.assertEqual(services._wrap_command(cfg, {}), self.cfg)
+
+    def test_unknown_limit(self):
+        svc = services.Service("nginx", "system")
+        with self.assertRaises(services.ActionError):
+            svc.set_limits({"Nice": 5})
+
+    def test_systemd_dropin(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        svc = services.Service("nginx", "system")
+        with mock.patch.object(services, "LIMITS_DIR",
+                               os.path.join(tmp, "{0}.d")), \
+                mock.patch.object(services, "conns") as conns, \
+                mock.patch.object(services.signals, "emit"):
+            svc.set_limits({"MemoryMax": "1G", "TasksMax": 32})
+            path = os.path.join(tmp, "nginx.service.d", services.LIMITS_FILE)
+            with open(path) as f:
+                self.assertEqual(f.read(), "[Service]\nMemoryMax=1G\n"
+                                 "TasksMax=32\n\n")
+            self.assertEqual(svc.get_limits(),
+                             {"MemoryMax": "1G", "TasksMax": "32"})
+            svc.set_limits({})
+            self.assertFalse(os.path.exists(path))
+            self.assertEqual(svc.get_limits(), {})
+        self.assertEqual(conns.SystemD.Reload.call_count, 2)
@@ -0,0 +1,73 @@
+import threading
+import unittest
+from concurrent import futures
+from unittest import mock
+
+from arkos import signals
+
+
+class SignalsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.pool = futures.ThreadPoolExecutor(max_workers=2)
+        patches = [mock.patch.object(signals.storage, "signals", {}),
+                   mock.patch.object(signals, "_pool", self.pool),
+                   mock.patch.object(signals, "logger")]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        self.logger = signals.logger
+        self.addCleanup(self.pool.shutdown)
+
+    def test_add_remove(self):
+        signals.add("a", "websites", "post_add", mock.Mock())
+        signals.add("b", "websites", "post_add", mock.Mock())
+        signals.add("a", "apps", "post_load", mock.Mock())
+        self.assertEqual(len(signals.storage.signals), 2)
+        signals.remove("a")
+        self.assertEqual(list(signals.storage.signals),
+                         [("websites", "post_add")])
+        self.assertEqual(
+            [x.by for x in signals.storage.signals["websites", "post_add"]],
+            ["b"])
+
+    def test_emit_matching(self):
+        hit, other_sig, other_id = mock.Mock(), mock.Mock(), mock.Mock()
+        signals.add("a", "websites", "post_add", hit)
+        signals.add("a", "websites", "pre_add", other_sig)
+        signals.add("a", "apps", "post_add", other_id)
+        signals.emit("websites", "post_add", "site")
+        signals.emit("websites", "post_remove")
+        hit.assert_called_once_with("site")
+        other_sig.assert_not_called()
+        other_id.assert_not_called()
+
+    def test_crit(self):
+        signals.add("a", "websites", "post_add",
+                    mock.Mock(side_effect=ValueError))
+        with self.assertRaises(ValueError):
+            signals.emit("websites", "post_add")
+        signals.emit("websites", "post_add", crit=False)
+        self.assertEqual(signals.get_stats()[0]["calls"], 2)
+
+    def test_background(self):
+        threads = []
+        signals.add("a", "websites", "post_add",
+                    lambda x: threads.append(threading.get_ident()),
+                    background=True)
+        signals.emit("websites", "post_add", "site")
+        self.pool.shutdown(wait=True)
+        self.assertEqual(len(threads), 1)
+        self.assertNotEqual(threads[0], threading.get_ident())
+
+    def test_background_failure(self):
+        ok = mock.Mock()
+        signals.add("a", "websites", "post_add",
+                    mock.Mock(side_effect=ValueError("boom")),
+                    background=True)
+        signals.add("b", "websites", "post_add", ok, background=True)
+        signals.add("c", "websites", "post_add", ok)
+        signals.emit("websites", "post_add", "site")
+        self.pool.shutdown(wait=True)
+        self.assertEqual(ok.call_count, 2)
+        self.logger.error.assert_called_once_with(
+            "Sign", "Listener a for post_add failed: boom")
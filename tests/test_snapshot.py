@@ -0,0 +1,83 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from arkos.utilities.snapshot import Snapshot, file_key
+
+
+class SnapshotTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.source = os.path.join(self.dir, "site.conf")
+        with open(self.source, "w") as f:
+            f.write("server {}\n")
+        self.path = os.path.join(self.dir, "snapshot", "snapshot.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_key_stable(self):
+        self.assertEqual(file_key([self.source]), file_key([self.source]))
+
+    def test_key_changes_on_modify(self):
+        key = file_key([self.source])
+        with open(self.source, "a") as f:
+            f.write("# changed\n")
+        self.assertNotEqual(key, file_key([self.source]))
+
+    def test_key_changes_on_replace(self):
+        key = file_key([self.source])
+        tmp = self.source + ".new"
+        with open(tmp, "w") as f:
+            f.write("server {}\n")
+        st = os.stat(self.source)
+        os.utime(tmp, ns=(st.st_atime_ns, st.st_mtime_ns))
+        os.rename(tmp, self.source)
+        self.assertNotEqual(key, file_key([self.source]))
+
+    def test_key_missing_file(self):
+        missing = os.path.join(self.dir, "missing")
+        self.assertEqual(file_key([missing]), [[missing, None]])
+
+    def test_get_valid_and_outdated(self):
+        snap = Snapshot()
+        snap.load(self.path, "0.8.3")
+        snap.set("websites", "site", [self.source], {"name": "site"})
+        self.assertEqual(snap.get("websites", "site", [self.source]),
+                         {"name": "site"})
+        with open(self.source, "a") as f:
+            f.write("# changed\n")
+        self.assertIsNone(snap.get("websites", "site", [self.source]))
+
+    def test_save_and_load(self):
+        snap = Snapshot()
+        snap.load(self.path, "0.8.3")
+        snap.set("websites", "site", [self.source], {"name": "site"})
+        snap.save()
+        snap = Snapshot()
+        snap.load(self.path, "0.8.3")
+        self.assertEqual(snap.get("websites", "site", [self.source]),
+                         {"name": "site"})
+
+    def test_load_other_release(self):
+        snap = Snapshot()
+        snap.load(self.path, "0.8.3")
+        snap.set("websites", "site", [self.source], {"name": "site"})
+        snap.save()
+        snap = Snapshot()
+        snap.load(self.path, "0.8.4")
+        self.assertIsNone(snap.get("websites", "site", [self.source]))
+
+    def test_save_drops_unseen(self):
+        snap = Snapshot()
+        snap.load(self.path, "0.8.3")
+        snap.set("websites", "old", [self.source], {"name": "old"})
+        snap.set("websites", "site", [self.source], {"name": "site"})
+        snap.save()
+        snap = Snapshot()
+        snap.load(self.path, "0.8.3")
+        snap.get("websites", "site", [self.source])
+        snap.save()
+        snap.load(self.path, "0.8.3")
+        self.assertIsNone(snap.get("websites", "old", [self.source]))
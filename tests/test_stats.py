@@ -0,0 +1,102 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from arkos.system import stats
+
+
+class SamplerTestCase(unittest.TestCase):
+    def _run(self, ticks, interval=10):
+        stop = mock.Mock()
+        stop.wait.side_effect = [False] * ticks + [True]
+        with mock.patch.object(stats, "_take_sample") as take, \
+                mock.patch.object(stats.config, "get",
+                                  return_value=interval), \
+                mock.patch.object(stats.resources, "sample") as sample:
+            stats._run_sampler(stop, 1)
+        self.assertEqual(take.call_count, ticks)
+        return sample
+
+    def test_samples_resources(self):
+        sample = self._run(3)
+        sample.assert_called_once_with()
+
+    def test_resources_disabled(self):
+        sample = self._run(3, interval=0)
+        sample.assert_not_called()
+
+    def test_resource_errors(self):
+        stop = mock.Mock()
+        stop.wait.side_effect = [False, False, True]
+        with mock.patch.object(stats, "_take_sample") as take, \
+                mock.patch.object(stats.config, "get", return_value=10), \
+                mock.patch.object(stats.resources, "sample",
+                                  side_effect=OSError("gone")), \
+                mock.patch.object(stats.logger, "warning") as warning:
+            stats._run_sampler(stop, 1)
+        self.assertEqual(take.call_count, 2)
+        warning.assert_called_once()
+
+
+class RingBufferTestCase(unittest.TestCase):
+    def test_empty(self):
+        buf = stats.RingBuffer(3)
+        self.assertIsNone(buf.oldest)
+        self.assertEqual(buf.range(0, 100), [])
+
+    def test_overwrites_oldest(self):
+        buf = stats.RingBuffer(3)
+        for x in range(5):
+            buf.append(x, x, x, x)
+        self.assertEqual(buf.oldest, 2)
+        self.assertEqual([x[0] for x in buf.range(0, 100)], [2, 3, 4])
+        self.assertEqual(buf.range(3, 3), [(3, 3.0, 3.0, 3.0)])
+
+
+class SeriesTestCase(unittest.TestCase):
+    def test_consolidates(self):
+        series = stats.Series([(1, 10), (5, 10)])
+        for x in range(12):
+            series.add(x, float(x))
+        self.assertEqual(series.tiers[1].range(0, 100),
+                         [(0, 2.0, 0.0, 4.0), (5, 7.0, 5.0, 9.0)])
+        # The slot being filled is included
+        self.assertEqual(series.range(0, 100, step=5)[-1],
+                         (10, 10.5, 10.0, 11.0))
+
+    def test_range_picks_covering_tier(self):
+        series = stats.Series([(1, 5), (5, 10)])
+        for x in range(20):
+            series.add(x, 1.0)
+        self.assertTrue(series.covers(15))
+        self.assertEqual(len(series.range(16, 100)), 4)
+        # The fine tier only reaches back 5 seconds
+        self.assertEqual([x[0] for x in series.range(2, 100)],
+                         [0, 5, 10, 15])
+        self.assertFalse(series.covers(-1))
+
+
+class StartSamplerTestCase(unittest.TestCase):
+    def test_registers_atexit_once(self):
+        with mock.patch.object(stats, "_take_sample"), \
+                mock.patch.object(stats, "_run_sampler"), \
+                mock.patch.object(stats, "psutil"), \
+                mock.patch.object(stats.atexit, "register") as register, \
+                mock.patch.dict(stats._sampler, atexit=False):
+            for x in range(3):
+                stats.start_sampler()
+                stats._sampler["thread"].join()
+        register.assert_called_once_with(stats.archive.close)
+        stats._sampler.update(thread=None, stop=None)
+
+
+class HistoryTestCase(unittest.TestCase):
+    def test_unknown_metric(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        with mock.patch.object(stats.archive.config, "get",
+                               return_value=tmp):
+            self.assertEqual(stats.get_history("bogus"), [])
+        self.assertEqual(os.listdir(tmp), [])
@@ -0,0 +1,88 @@
+import threading
+import unittest
+from unittest import mock
+
+from arkos import tracked_services
+
+
+class BatchTestCase(unittest.TestCase):
+    def setUp(self):
+        patches = [mock.patch.object(tracked_services, "policies"),
+                   mock.patch.object(tracked_services, "security"),
+                   mock.patch.object(tracked_services, "config"),
+                   mock.patch.object(tracked_services, "get",
+                                     return_value=[])]
+        self.policies, self.security, config, _ = \
+            [p.start() for p in patches]
+        for p in patches:
+            self.addCleanup(p.stop)
+        config.get.return_value = True
+        self.save = self.policies.save
+        self.regen = self.security.regenerate_firewall
+
+    def _change(self):
+        tracked_services.save_policies()
+        tracked_services.regenerate_firewall()
+
+    def test_unbatched(self):
+        self._change()
+        self._change()
+        self.assertEqual(self.save.call_count, 2)
+        self.assertEqual(self.regen.call_count, 2)
+
+    def test_deferred(self):
+        with tracked_services.batch():
+            for x in range(3):
+                self._change()
+            self.save.assert_not_called()
+            self.regen.assert_not_called()
+        self.save.assert_called_once_with()
+        self.regen.assert_called_once_with([])
+
+    def test_nothing_pending(self):
+        with tracked_services.batch():
+            pass
+        self.save.assert_not_called()
+        self.regen.assert_not_called()
+
+    def test_nested(self):
+        with tracked_services.batch() as outer:
+            with tracked_services.batch() as inner:
+                self.assertIs(inner, outer)
+                self._change()
+            self.save.assert_not_called()
+            tracked_services.save_policies()
+        self.save.assert_called_once_with()
+        self.regen.assert_called_once_with([])
+        # Later changes are no longer batched
+        self._change()
+        self.assertEqual(self.save.call_count, 2)
+
+    def test_worker_joins(self):
+        entered, release = threading.Event(), threading.Event()
+
+        def work(state):
+            with tracked_services.batch(join=state):
+                self._change()
+                entered.set()
+                release.wait(5)
+
+        with tracked_services.batch() as state:
+            worker = threading.Thread(target=work, args=(state,))
+            worker.start()
+            entered.wait(5)
+        # The batch stays open until the worker leaves it too
+        self.save.assert_not_called()
+        release.set()
+        worker.join(5)
+        self.save.assert_called_once_with()
+        self.regen.assert_called_once_with([])
+
+    def test_other_thread_not_batched(self):
+        with tracked_services.batch():
+            worker = threading.Thread(target=self._change)
+            worker.start()
+            worker.join(5)
+            self.save.assert_called_once_with()
+            self.regen.assert_called_once_with([])
+        self.save.assert_called_once_with()